@@ -0,0 +1,285 @@
+"""Load test: replays synthetic Telegram updates against the real handlers.
+
+Builds the Application from bot.py with a stub Bot that answers Bot API calls
+locally, registers N synthetic users through the registration conversation
+and lets all of them book one event at the same time
+(/events -> select_event -> confirm_booking). Reports throughput, handler
+latency percentiles and whether the event was overbooked.
+
+Needs the same DATABASE_* environment as the bot. TELEGRAM_BOT_TOKEN,
+ADMINISTRATOR_IDS and METRICS_PORT default to bench values (a fake token, admin
+id 1, no metrics server), and the RATE_LIMIT_* settings default to limits the
+bench never reaches, since every synthetic user sends its updates back to back.
+Updates dropped by the rate limiter are reported and fail the run. The bench
+rows are removed afterwards unless --keep is given:
+
+    python bench.py --users 500 --seats 100 --api-latency 0.05
+"""
+import argparse
+import asyncio
+import itertools
+import os
+import statistics
+import time
+from collections import defaultdict
+
+os.environ.setdefault("TELEGRAM_BOT_TOKEN", "123456:bench")
+os.environ.setdefault("ADMINISTRATOR_IDS", "1")  # bot.py разбирает список при импорте
+os.environ.setdefault("METRICS_PORT", "0")
+# Пользователь бенча шлёт обновления подряд; с боевыми лимитами часть из них отбрасывалась бы
+for name in ("RATE_LIMIT_USER_RATE", "RATE_LIMIT_USER_BURST",
+             "RATE_LIMIT_COMMAND_RATE", "RATE_LIMIT_COMMAND_BURST"):
+    os.environ.setdefault(name, "1000")
+
+from telegram import Bot, Update  # noqa: E402
+
+import bot  # noqa: E402
+
+BENCH_USER_BASE = 9_000_000_000  # user_id синтетических пользователей
+BENCH_EVENT_NAME = "bench"
+
+
+class StubBot(Bot):
+    """Bot whose API calls never leave the process.
+
+    Every call sleeps `api_latency` seconds to stand in for the Bot API round
+    trip and is counted per endpoint.
+    """
+
+    def __init__(self, token, api_latency=0.0):
+        super().__init__(token)
+        with self._unfrozen():
+            self._api_latency = api_latency
+            self._message_ids = itertools.count(1)
+            self.calls = defaultdict(int)
+
+    async def _post(self, endpoint, data=None, **kwargs):
+        self.calls[endpoint] += 1
+        if self._api_latency:
+            await asyncio.sleep(self._api_latency)
+        data = data or {}
+        if endpoint == "getMe":
+            return {"id": 123456, "is_bot": True, "first_name": "Bench", "username": "bench_bot"}
+        if endpoint in ("sendMessage", "editMessageText"):
+            return {
+                "message_id": data.get("message_id") or next(self._message_ids),
+                "date": int(time.time()),
+                "chat": {"id": data.get("chat_id", 0), "type": "private"},
+                "text": data.get("text", ""),
+            }
+        return True
+
+
+class UpdateFactory:
+    """Builds Update objects the way Telegram would send them."""
+
+    def __init__(self, bot_instance):
+        self.bot = bot_instance
+        self._update_ids = itertools.count(1)
+        self._message_ids = itertools.count(1)
+
+    @staticmethod
+    def _user(user_id):
+        return {"id": user_id, "is_bot": False, "first_name": f"Bench {user_id}",
+                "username": f"bench{user_id}"}
+
+    def _message(self, user_id, text):
+        message = {
+            "message_id": next(self._message_ids),
+            "date": int(time.time()),
+            "chat": {"id": user_id, "type": "private"},
+            "from": self._user(user_id),
+            "text": text,
+        }
+        if text.startswith("/"):
+            message["entities"] = [{"type": "bot_command", "offset": 0,
+                                    "length": len(text.split()[0])}]
+        return message
+
+    def text(self, user_id, text):
+        return Update.de_json({"update_id": next(self._update_ids),
+                               "message": self._message(user_id, text)}, self.bot)
+
+    def callback(self, user_id, data):
+        return Update.de_json({
+            "update_id": next(self._update_ids),
+            "callback_query": {
+                "id": str(next(self._update_ids)),
+                "from": self._user(user_id),
+                "chat_instance": str(user_id),
+                "data": data,
+                "message": self._message(user_id, "bench"),
+            },
+        }, self.bot)
+
+
+class Recorder:
+    """Collects per-step latencies."""
+
+    def __init__(self):
+        self.latencies = defaultdict(list)
+
+    async def run(self, application, step, update):
+        started = time.perf_counter()
+        await application.process_update(update)
+        self.latencies[step].append(time.perf_counter() - started)
+
+    def all(self):
+        return [value for values in self.latencies.values() for value in values]
+
+
+def percentile(values, share):
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(len(ordered) * share))]
+
+
+async def register(application, updates, recorder, user_id):
+    steps = [
+        ("start", updates.text(user_id, "/start")),
+        ("start_registration", updates.callback(user_id, "start_registration")),
+        ("ask_name", updates.callback(user_id, "continue_registration")),
+        ("save_name", updates.text(user_id, f"Bench User {user_id}")),
+        ("save_contacts", updates.text(user_id, f"@bench{user_id}")),
+        ("skip_tesera", updates.text(user_id, "/skip")),
+        ("save_registration", updates.text(user_id, "bench")),
+    ]
+    for step, update in steps:
+        await recorder.run(application, step, update)
+
+
+async def book(application, updates, recorder, user_id, event_id):
+    steps = [
+        ("show_events", updates.text(user_id, "/events")),
+        ("select_event", updates.callback(user_id, f"select_{event_id}")),
+        ("confirm_booking", updates.callback(user_id, "confirm_booking")),
+    ]
+    for step, update in steps:
+        await recorder.run(application, step, update)
+
+
+def cleanup(cursor, user_ids):
+    cursor.execute("""
+        DELETE FROM notifications
+        WHERE user_id = ANY(%s) OR event_id IN (SELECT event_id FROM events WHERE name = %s)
+    """, (user_ids, BENCH_EVENT_NAME))
+    cursor.execute("""
+        DELETE FROM event_participants
+        WHERE user_id = ANY(%s) OR event_id IN (SELECT event_id FROM events WHERE name = %s)
+    """, (user_ids, BENCH_EVENT_NAME))
+    cursor.execute("DELETE FROM events WHERE name = %s", (BENCH_EVENT_NAME,))
+    cursor.execute("DELETE FROM users WHERE user_id = ANY(%s)", (user_ids,))
+    cursor.execute("""
+        DELETE FROM bot_persistence
+        WHERE (kind IN ('user_data', 'chat_data') AND key = ANY(%s))
+           OR (kind LIKE 'conversation:%%' AND key LIKE %s)
+    """, ([str(user_id) for user_id in user_ids], f"[{str(BENCH_USER_BASE)[:4]}%"))
+
+
+def create_event(cursor, seats):
+    cursor.execute("""
+        INSERT INTO events (name, type, date_start, date_end, max_participants, status)
+        VALUES (%s, 'bench', NOW() + INTERVAL '7 days', NOW() + INTERVAL '7 days 3 hours', %s, 'active')
+        RETURNING event_id
+    """, (BENCH_EVENT_NAME, seats))
+    return cursor.fetchone()[0]
+
+
+def approve(cursor, user_ids):
+    cursor.execute("UPDATE users SET status = 'approved' WHERE user_id = ANY(%s)", (user_ids,))
+
+
+def booking_totals(cursor, event_id):
+    cursor.execute("""
+        SELECT e.max_participants, e.current_participants,
+               (SELECT COUNT(*) FROM event_participants ep
+                WHERE ep.event_id = e.event_id AND ep.booking_status <> 'waitlist')
+        FROM events e WHERE e.event_id = %s
+    """, (event_id,))
+    return cursor.fetchone()
+
+
+def report(title, recorder, elapsed):
+    latencies = recorder.all()
+    print(f"\n{title}: {len(latencies)} updates in {elapsed:.2f}s "
+          f"({len(latencies) / elapsed:.1f} updates/s)")
+    print(f"  {'step':<20}{'n':>6}{'p50 ms':>10}{'p99 ms':>10}{'max ms':>10}")
+    for step, values in recorder.latencies.items():
+        print(f"  {step:<20}{len(values):>6}{percentile(values, 0.5) * 1000:>10.1f}"
+              f"{percentile(values, 0.99) * 1000:>10.1f}{max(values) * 1000:>10.1f}")
+    print(f"  {'all':<20}{len(latencies):>6}{statistics.median(latencies) * 1000:>10.1f}"
+          f"{percentile(latencies, 0.99) * 1000:>10.1f}{max(latencies) * 1000:>10.1f}")
+
+
+async def run(args):
+    bot.init_db()
+    user_ids = [BENCH_USER_BASE + i for i in range(args.users)]
+    await bot.run_db(cleanup, user_ids)
+
+    stub = StubBot(os.environ["TELEGRAM_BOT_TOKEN"], args.api_latency)
+    application = bot.build_application(bot=stub)
+    updates = UpdateFactory(stub)
+    errors = []
+
+    async def on_error(update, context):
+        errors.append(context.error)
+
+    application.add_error_handler(on_error)
+
+    async with application:
+        registration = Recorder()
+        started = time.perf_counter()
+        await asyncio.gather(*(register(application, updates, registration, user_id)
+                               for user_id in user_ids))
+        report("Registration", registration, time.perf_counter() - started)
+
+        # Одобрение идёт мимо обработчиков, поэтому сбрасываем кэш профилей
+        await bot.run_db(approve, user_ids)
+        bot.user_cache.clear()
+        event_id = await bot.run_db(create_event, args.seats)
+        bot.events_cache.invalidate()
+
+        booking = Recorder()
+        started = time.perf_counter()
+        await asyncio.gather(*(book(application, updates, booking, user_id, event_id)
+                               for user_id in user_ids))
+        report("Booking", booking, time.perf_counter() - started)
+
+        max_participants, counter, booked = await bot.run_db(booking_totals, event_id)
+        overbooked = max(booked - max_participants, 0)
+        print(f"\nSeats: {max_participants}, booked: {booked}, counter: {counter}, "
+              f"overbooked: {overbooked}, counter drift: {counter - booked}")
+        print(f"Handler errors: {len(errors)}")
+        for error in errors[:5]:
+            print(f"  {error!r}")
+        throttled = [line for line in bot.metrics.render().splitlines()
+                     if line.startswith("bot_updates_throttled_total")]
+        print("Throttled updates: " + (", ".join(throttled) or "0"))
+        print("Bot API calls: " + ", ".join(f"{name}={count}" for name, count in sorted(stub.calls.items())))
+        print(f"Connection pool: {bot.connection_pool.stats()}")
+        print("Top statements by total time:")
+        for statement, entry in bot.query_profiler.top(5):
+            print(f"  {entry['total'] * 1000:8.1f} ms {entry['calls']:6} calls  "
+                  f"{','.join(entry['handlers'])}: {statement[:90]}")
+
+        await bot.broadcaster.drain(0)
+
+    # Очистка после shutdown: он сохраняет состояние диалогов в bot_persistence
+    if not args.keep:
+        await bot.run_db(cleanup, user_ids)
+    bot.connection_pool.closeall()
+    return 1 if overbooked or errors or throttled else 0
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--users", type=int, default=200, help="concurrent synthetic users")
+    parser.add_argument("--seats", type=int, default=50, help="seats in the bench event")
+    parser.add_argument("--api-latency", type=float, default=0.0,
+                        help="simulated Bot API round trip, seconds")
+    parser.add_argument("--keep", action="store_true", help="keep bench rows in the database")
+    args = parser.parse_args()
+    raise SystemExit(asyncio.run(run(args)))
+
+
+if __name__ == "__main__":
+    main()
@@ -1,21 +1,46 @@
+import time
+import uuid
+_IMPORT_STARTED = time.perf_counter()  # для замера времени запуска
+
 import logging
 import os  # Для environment variables
 from datetime import datetime, timedelta
 from telegram import Update, InlineKeyboardButton, InlineKeyboardMarkup, ReplyKeyboardRemove
+from telegram.error import BadRequest, Forbidden, RetryAfter, TelegramError
+from telegram.request import HTTPXRequest
 from telegram.ext import (
     Application,
+    ApplicationHandlerStop,
+    BasePersistence,
+    PersistenceInput,
     CommandHandler,
     ConversationHandler,
     CallbackContext,
     CallbackQueryHandler,
     MessageHandler,
     filters,
-    JobQueue
+    JobQueue,
+    TypeHandler
 )
+from aiohttp import ClientError, ClientSession, ClientTimeout, web
 import psycopg2
 from psycopg2 import pool  # Import connection pooling
+from psycopg2 import errors, extensions
+from psycopg2.extras import Json, execute_values
 import datetime
 import asyncio  # Import asyncio
+import contextvars
+import functools
+import contextlib
+import hmac
+import itertools
+import json
+import re
+import signal
+import string
+import threading
+from collections import OrderedDict, defaultdict, deque
+from concurrent.futures import ThreadPoolExecutor
 
 # Настройки
 TOKEN = os.environ.get("TELEGRAM_BOT_TOKEN")  # Or your database host
@@ -26,6 +51,92 @@ DATABASE_NAME = os.environ.get("DATABASE_NAME")
 ADMINISTRATOR_IDS = [int(admin_id) for admin_id in
                      os.environ.get("ADMINISTRATOR_IDS", "").split(",")]  # Example: "12345,67890"
 
+# Настройки пула соединений
+DB_POOL_MIN = int(os.environ.get("DB_POOL_MIN", "1"))
+DB_POOL_MAX = int(os.environ.get("DB_POOL_MAX", "10"))
+DB_POOL_ACQUIRE_TIMEOUT = float(os.environ.get("DB_POOL_ACQUIRE_TIMEOUT", "10"))  # секунды
+DB_POOL_MAX_LIFETIME = float(os.environ.get("DB_POOL_MAX_LIFETIME", "3600"))  # секунды
+DB_POOL_VALIDATE_IDLE = float(os.environ.get("DB_POOL_VALIDATE_IDLE", "30"))  # проверять после простоя
+# Строк за один fetch из курсора на сервере (stream_query)
+DB_STREAM_ITERSIZE = int(os.environ.get("DB_STREAM_ITERSIZE", "1000"))
+
+# Лимиты Telegram на отправку сообщений
+TELEGRAM_GLOBAL_RATE = float(os.environ.get("TELEGRAM_GLOBAL_RATE", "30"))  # сообщений в секунду
+TELEGRAM_CHAT_RATE = float(os.environ.get("TELEGRAM_CHAT_RATE", "1"))  # сообщений в секунду на чат
+TELEGRAM_CHAT_BURST = int(os.environ.get("TELEGRAM_CHAT_BURST", "3"))
+TELEGRAM_SEND_RETRIES = int(os.environ.get("TELEGRAM_SEND_RETRIES", "3"))
+
+# Защита от флуда: входящие обновления одного пользователя (администраторы не ограничены)
+RATE_LIMIT_USER_RATE = float(os.environ.get("RATE_LIMIT_USER_RATE", "2"))  # обновлений в секунду
+RATE_LIMIT_USER_BURST = int(os.environ.get("RATE_LIMIT_USER_BURST", "10"))
+RATE_LIMIT_COMMAND_RATE = float(os.environ.get("RATE_LIMIT_COMMAND_RATE", "0.5"))  # на команду/кнопку
+RATE_LIMIT_COMMAND_BURST = int(os.environ.get("RATE_LIMIT_COMMAND_BURST", "4"))
+DUPLICATE_CALLBACK_WINDOW = float(os.environ.get("DUPLICATE_CALLBACK_WINDOW_MS", "1000")) / 1000
+
+# Время жизни кэша списка мероприятий (секунды)
+EVENTS_CACHE_TTL = float(os.environ.get("EVENTS_CACHE_TTL", "300"))
+# Кэш профилей пользователей; не подтверждённые живут недолго, чтобы одобрение
+# на другом воркере подхватывалось быстро
+USER_CACHE_SIZE = int(os.environ.get("USER_CACHE_SIZE", "10000"))
+USER_CACHE_TTL = float(os.environ.get("USER_CACHE_TTL", "600"))
+USER_CACHE_PENDING_TTL = float(os.environ.get("USER_CACHE_PENDING_TTL", "30"))
+
+# За сколько минут до начала мероприятия отправлять напоминание
+REMINDER_LEAD = timedelta(minutes=int(os.environ.get("REMINDER_LEAD_MINUTES", "60")))
+
+# Режим получения обновлений: "polling" или "webhook"
+BOT_MODE = os.environ.get("BOT_MODE", "polling")
+WEBHOOK_URL = os.environ.get("WEBHOOK_URL")  # публичный адрес; без него webhook не регистрируется
+WEBHOOK_LISTEN = os.environ.get("WEBHOOK_LISTEN", "0.0.0.0")
+WEBHOOK_PORT = int(os.environ.get("WEBHOOK_PORT", "8080"))
+WEBHOOK_PATH = os.environ.get("WEBHOOK_PATH", "/telegram")
+WEBHOOK_SECRET = os.environ.get("WEBHOOK_SECRET")  # обязателен для webhook-сервера
+
+# Как часто сохранять состояние диалогов и user_data в БД (секунды)
+PERSISTENCE_FLUSH_INTERVAL = float(os.environ.get("PERSISTENCE_FLUSH_INTERVAL", "10"))
+
+# Размеры страниц списков мероприятий и заявок
+EVENTS_PAGE_SIZE = int(os.environ.get("EVENTS_PAGE_SIZE", "8"))
+PENDING_PAGE_SIZE = int(os.environ.get("PENDING_PAGE_SIZE", "10"))
+# Сколько отрисованных клавиатур и кнопок мероприятий держать в кэше
+TEMPLATE_CACHE_SIZE = int(os.environ.get("TEMPLATE_CACHE_SIZE", "1024"))
+
+# Метрики в формате Prometheus; METRICS_PORT=0 отключает endpoint
+METRICS_LISTEN = os.environ.get("METRICS_LISTEN", "127.0.0.1")
+METRICS_PORT = int(os.environ.get("METRICS_PORT", "9100"))
+# Профилирование запросов: медленные запросы логируются, EXPLAIN — по желанию
+SLOW_QUERY_MS = float(os.environ.get("SLOW_QUERY_MS", "200"))
+SLOW_QUERY_EXPLAIN = os.environ.get("SLOW_QUERY_EXPLAIN", "0") == "1"
+# Соединений к Bot API: при concurrent_updates одного соединения не хватает
+TELEGRAM_CONNECTION_POOL_SIZE = int(os.environ.get("TELEGRAM_CONNECTION_POOL_SIZE", "256"))
+
+# Очередь уведомлений (outbox) в таблице notifications
+OUTBOX_BATCH_SIZE = int(os.environ.get("OUTBOX_BATCH_SIZE", "100"))
+OUTBOX_POLL_INTERVAL = float(os.environ.get("OUTBOX_POLL_INTERVAL", "5"))  # секунды
+OUTBOX_LEASE = int(os.environ.get("OUTBOX_LEASE", "60"))  # секунды на отправку пачки
+OUTBOX_RETRY_DELAY = int(os.environ.get("OUTBOX_RETRY_DELAY", "30"))  # секунды, растёт с попытками
+OUTBOX_MAX_ATTEMPTS = int(os.environ.get("OUTBOX_MAX_ATTEMPTS", "5"))
+
+# Несколько воркеров на один токен: обновления распределяются по user_id % WORKER_COUNT,
+# WORKER_PEERS — базовые адреса webhook-серверов всех воркеров по порядку WORKER_ID
+WORKER_ID = int(os.environ.get("WORKER_ID", "0"))
+WORKER_COUNT = int(os.environ.get("WORKER_COUNT", "1"))
+WORKER_PEERS = [peer.strip().rstrip("/") for peer in
+                os.environ.get("WORKER_PEERS", "").split(",") if peer.strip()]
+WORKER_FORWARD_TIMEOUT = float(os.environ.get("WORKER_FORWARD_TIMEOUT", "5"))  # секунды
+LEADER_CHECK_INTERVAL = float(os.environ.get("LEADER_CHECK_INTERVAL", "10"))  # секунды
+REMINDER_RESYNC_INTERVAL = float(os.environ.get("REMINDER_RESYNC_INTERVAL", "60"))  # секунды
+
+# Массовые рассылки (/broadcast): прогресс сохраняется после каждой пачки получателей
+BROADCAST_CHUNK_SIZE = int(os.environ.get("BROADCAST_CHUNK_SIZE", "100"))
+BROADCAST_POLL_INTERVAL = float(os.environ.get("BROADCAST_POLL_INTERVAL", "30"))  # секунды
+BROADCAST_LEASE = int(os.environ.get("BROADCAST_LEASE", "60"))  # секунды на отправку пачки
+# Сколько ждать, пока рассылка дошлёт текущую пачку при потере лидерства
+BROADCAST_STOP_TIMEOUT = float(os.environ.get("BROADCAST_STOP_TIMEOUT", "30"))  # секунды
+
+# Сколько секунд после SIGTERM даётся на завершение обработчиков и отправок
+SHUTDOWN_TIMEOUT = float(os.environ.get("SHUTDOWN_TIMEOUT", "25"))
+
 # Состояния
 (
     # Регистрация
@@ -37,8 +148,8 @@ ADMINISTRATOR_IDS = [int(admin_id) for admin_id in
     EVENT_NAME, EVENT_TYPE, EVENT_DATE, EVENT_MAX_PARTICIPANTS,
     EVENT_DESCRIPTION, EVENT_CONFIRM,
     # Бронирование
-    SHOW_EVENTS, SELECT_EVENT, CONFIRM_BOOKING, BOOKING_COMPLETE
-) = range(19)
+    SHOW_EVENTS, SELECT_EVENT, CONFIRM_BOOKING
+) = range(18)
 
 # Логирование
 logging.basicConfig(format="%(asctime)s - %(name)s - %(levelname)s - %(message)s", level=logging.INFO)
@@ -47,156 +158,2308 @@ logger = logging.getLogger(__name__)
 # Пул соединений PostgreSQL
 connection_pool = None
 
-# --- Инициализация базы данных ---
-def init_db():
-    global connection_pool
-    connection_pool = psycopg2.pool.SimpleConnectionPool(
-        1, 5,
-        host=DATABASE_HOST,
-        user=DATABASE_USER,
-        password=DATABASE_PASSWORD,
-        database=DATABASE_NAME
+# Пул потоков для блокирующих вызовов psycopg2, чтобы не останавливать event loop
+db_executor = ThreadPoolExecutor(max_workers=DB_POOL_MAX, thread_name_prefix="db")
+
+
+# --- Тексты и клавиатуры ---
+# Все тексты бота собраны здесь, чтобы их можно было править и переводить, не трогая
+# обработчики. Шаблоны — строки str.format; поля проверяются и метод format
+# привязывается один раз при импорте.
+TEXTS = {
+    "access_denied": "🚫 Доступ запрещён.",
+    "throttled": "⏳ Слишком много запросов. Подождите несколько секунд.",
+    "save_error": "Ошибка при сохранении данных. Попробуйте позже.",
+    "load_error": "Ошибка при загрузке данных.",
+    "bye": "Bye! I hope we can talk again some day.",
+    # Регистрация
+    "welcome": "Добро пожаловать в бота для мероприятий!",
+    "consent": (
+        "Для регистрации нам потребуется обработать ваши персональные данные. \n\n"
+        "Имя и контакты - для связи.\n"
+        "Продолжая, вы соглашаетесь с нашей политикой конфиденциальности."
+    ),
+    "ask_name": "Введите ваше имя и фамилию:",
+    "ask_contacts": (
+        "Введите контакты для связи (Telegram, VK или телефон): \n"
+        "Пример: Telegram: @username / +79991112233"
+    ),
+    "ask_tesera": "Укажите ваш ник на Тесере (если есть, или нажмите /skip):",
+    "ask_source": (
+        "Откуда вы узнали о наших мероприятиях?\n"
+        "Пример: «От друзей», «Из группы VK»"
+    ),
+    "registration_saved": "Регистрация завершена! Ожидайте подтверждения администратора.",
+    "registration_approved": "🎉 Ваша регистрация подтверждена! Теперь вы можете записываться на мероприятия.",
+    "registration_rejected": "❌ Ваша регистрация отклонена. Причина: {reason}",
+    "default_rejection_reason": "Энергетическая несовместимость",
+    "approval_required": "⛔ Запись на мероприятия доступна после подтверждения регистрации.",
+    # Админ-панель
+    "admin_menu": "Админ-панель. Выберите действие:",
+    "new_registration": (
+        "⚠️ Новая заявка на регистрацию!\n"
+        "ID: {user_id}\n"
+        "Имя: {user_name}\n\n"
+        "Подтвердить или отклонить?"
+    ),
+    "ask_rejection_reason": "Укажите причину отказа (или отправьте /cancel):",
+    "user_approved": "✅ Пользователь {user_id} подтверждён.",
+    "user_rejected": "❌ Пользователь {user_id} отклонён. Причина: {reason}",
+    "approve_error": "❌ Ошибка при подтверждении.",
+    "reject_error": "❌ Ошибка при отклонении.",
+    "no_pending": "Нет заявок на регистрацию.",
+    "pending_list": "📝 Список заявок:\n\n",
+    "pending_entry": "ID: {user_id}\nИмя: {name}\nКонтакты: {contacts}\n\n",
+    "pending_selected": "☑️ {name}",
+    "pending_unselected": "⬜ {name}",
+    "bulk_approved": "✅ Одобрено заявок: {count}",
+    "bulk_rejected": "❌ Отклонено заявок: {count}",
+    "bulk_error": "❌ Ошибка при обработке заявок.",
+    # Служебные команды
+    "db_stats": "📊 Самые затратные запросы:\n\n{statements}",
+    "db_stats_entry": (
+        "{total_ms:.0f} мс / {calls} выз. (ср. {avg_ms:.1f}, макс. {max_ms:.1f} мс)\n"
+        "{handlers}\n{statement}"
+    ),
+    "db_stats_empty": "Запросов пока не было.",
+    "db_stats_reset": "Статистика запросов сброшена.",
+    "occupancy_ok": "✅ Счётчики мест совпадают с бронированиями.",
+    "occupancy_fixed": "🔧 Исправлены счётчики мест:\n{events}",
+    "occupancy_fixed_entry": "• {name} (ID: {event_id})",
+    # Рассылки
+    "broadcast_usage": "Использование: /broadcast <текст объявления>",
+    "broadcast_started": (
+        "📣 Рассылка #{broadcast_id} запущена, получателей: {recipients}. "
+        "Когда она закончится, пришлю отчёт."
+    ),
+    "broadcast_finished": (
+        "📣 Рассылка #{broadcast_id} завершена.\n"
+        "Доставлено: {delivered}\n"
+        "Заблокировали бота: {blocked}\n"
+        "Ошибки: {failed}"
+    ),
+    # Мероприятия
+    "event_admins_only": "❌ Создавать мероприятия могут только администраторы.",
+    "ask_event_name": (
+        "Введите название мероприятия:\n"
+        "Пример: «Аджилити Кемп 2024»"
+    ),
+    "ask_event_type": "Выберите тип мероприятия:",
+    "ask_camp_date": (
+        "Введите дату и время кемпа (формат: ДД.ММ.ГГГГ ЧЧ:ММ):\n"
+        "Пример: 25.12.2025 14:00"
+    ),
+    "ask_max_participants": (
+        "Введите максимальное число участников (цифра):\n"
+        "Пример: 10"
+    ),
+    "ask_camp_max_participants": (
+        "Введите максимальное число участников: \n"
+        "Пример: 15"
+    ),
+    "invalid_date": "Неверный формат даты. Используйте ДД.ММ.ГГГГ ЧЧ:ММ",
+    "positive_number_required": "❌ Введите положительное число.",
+    "number_required": "❌ Введите число (например, 20).",
+    "ask_event_description": (
+        "Добавьте описание мероприятия (или нажмите /skip):\n"
+        "Пример: «Трехдневный кемп с обучением аджилити»"
+    ),
+    "description_skipped": "Нет описания",
+    "event_preview": (
+        "<b>Новое мероприятие</b>\n\n"
+        "Название: {name}\n"
+        "Тип: {type}\n"
+        "Дата: {date}\n"
+        "Макс. участников: {max_participants}\n"
+        "Описание: {description}"
+    ),
+    "no_description": "не указано",
+    "event_saved": "Мероприятие сохранено!",
+    "event_save_error": "Ошибка при сохранении.",
+    "event_creation_cancelled": "❌ Создание мероприятия отменено.",
+    "choose_event": "📅 Выберите мероприятие:",
+    "no_events": "🎭 Активных мероприятий нет.",
+    "events_error": "❌ Ошибка при загрузке мероприятий.",
+    "event_button": "{name} ({date:%d.%m.%Y}) | 🆓 {free}/{max_participants}",
+    # Бронирование
+    "event_not_found": "❌ Мероприятие не найдено.",
+    "already_booked": "⚠️ Вы уже записаны на это мероприятие.",
+    "event_full": "❌ Мест больше нет. Можно встать в лист ожидания.",
+    "confirm_booking": "Подтвердите запись на мероприятие:\n\nСвободных мест: {free}/{max_participants}",
+    "booking_error": "❌ Ошибка при бронировании.",
+    "booking_complete": "✅ Запись завершена!",
+    "payment_required": "💳 Оплатите участие, чтобы завершить бронирование.",
+    "waitlist_joined": "🕒 Вы в листе ожидания (№{position}). Сообщим, если освободится место.",
+    "waitlist_promoted": "🎟️ Освободилось место! Вы переведены из листа ожидания в участники.",
+    "booking_cancelled": "Бронирование отменено.",
+    "booking_approved": "✅ Ваша заявка на мероприятие одобрена!",
+    "booking_rejected": "❌ Ваша заявка на мероприятие отклонена.",
+    "booking_approved_admin": "Заявка пользователя {user_id} подтверждена.",
+    "booking_rejected_admin": "Заявка пользователя {user_id} отклонена.",
+    "booking_missing_admin": "Заявка пользователя {user_id} не найдена.",
+    "new_booking": (
+        "⚠️ Новая заявка на мероприятие!\n\n"
+        "Мероприятие: {event_name}\n"
+        "Участник: {user_name} (ID: {user_id})\n"
+        "Контакты: {contacts}\n\n"
+        "Подтвердить запись?"
+    ),
+    # Оплата; {price} подставляется и в Python, и в SQL (reserve_seat)
+    "payment_details": (
+        "🔹 <b>Оплата мероприятия</b>\n\n"
+        "Сумма: {price} ₽\n"
+        "Способ оплаты: <b>СБП</b>\n\n"
+        "➔ Реквизиты для перевода:\n"
+        "Банк: Тинькофф\n"
+        "Номер: <code>+7 (XXX) XXX-XX-XX</code>\n\n"
+        "Или переведите по ссылке: [Оплатить через СБП](https://qr.nspk.ru/...)\n\n"
+        "После оплаты нажмите кнопку ниже ⤵️"
+    ),
+    "payment_sent": "🔄 Платеж отправлен на проверку. Мы уведомим вас о подтверждении.",
+    "payment_error": "❌ Ошибка при обработке платежа.",
+    "payment_verified": "✅ Ваш платеж подтвержден! Бронирование активно.",
+    "payment_rejected": "❌ Платеж не подтвержден. Пожалуйста, свяжитесь с администратором.",
+    "payment_verified_admin": "Платеж пользователя {user_id} подтвержден.",
+    "payment_rejected_admin": "Платеж пользователя {user_id} отклонен.",
+    "telegram_error": "❌ Ошибка Telegram.",
+    "new_payment": (
+        "⚠️ Новый платеж для проверки!\n\n"
+        "Мероприятие: {event_name}\n"
+        "Участник: {user_name} (ID: {user_id})\n"
+        "Сумма: {price} ₽\n\n"
+        "Подтвердить получение средств?"
+    ),
+    # Чат мероприятия и напоминания
+    "chat_title": "Чат мероприятия: {event_name}",
+    "chat_invite": (
+        "🔹 Вы подтверждены на мероприятие!\n"
+        "Присоединяйтесь к чату: {invite_link}\n\n"
+        "Правила чата: ..."
+    ),
+    "default_chat_rules": "Правила не установлены",
+    "no_chat_rules": "Правила не установлены.",
+    "chat_rules_error": "Произошла ошибка при получении правил чата",
+    "chat_rules_send_error": "Не удалось отправить правила чата.",
+    "reminder": (
+        "⏰ Напоминание: мероприятие «{event_name}»\n"
+        "Начнётся через {minutes_left} мин. ({start_time:%H:%M})"
+    ),
+    "reminder_chat": "\n\nЧат: {invite_link}",
+    # Кнопки
+    "button_register": "Регистрация",
+    "button_continue_registration": "Продолжить регистрацию",
+    "button_cancel": "Отмена",
+    "button_cancel_mark": "❌ Отмена",
+    "button_confirm": "✅ Подтвердить",
+    "button_reject": "❌ Отклонить",
+    "button_pending_list": "Список заявок",
+    "button_exit": "Выйти",
+    "button_back": "Назад",
+    "button_camp": "Кемп",
+    "button_game_event": "Игротека",
+    "button_other": "Другое",
+    "button_save": "Сохранить",
+    "button_discard": "Отменить",
+    "button_waitlist": "🕒 Встать в лист ожидания",
+    "button_paid": "✅ Я оплатил",
+    "button_prev": "⬅️",
+    "button_next": "➡️",
+    "button_approve_selected": "✅ Одобрить выбранные ({count})",
+    "button_reject_selected": "❌ Отклонить выбранные ({count})",
+}
+
+
+def _compile_templates(texts):
+    """Binds str.format of every text with fields; fails at import on positional fields."""
+    templates = {}
+    for key, text in texts.items():
+        fields = [field for _, field, _, _ in string.Formatter().parse(text) if field is not None]
+        if not fields:
+            continue
+        if not all(fields):
+            raise ValueError(f"Template {key!r} must use named fields")
+        templates[key] = text.format
+    return templates
+
+
+_TEMPLATES = _compile_templates(TEXTS)
+
+
+def render(key: str, **params) -> str:
+    """Fills the template `key` from TEXTS with params."""
+    return _TEMPLATES[key](**params)
+
+
+def _button(key: str, callback_data: str) -> InlineKeyboardButton:
+    return InlineKeyboardButton(TEXTS[key], callback_data=callback_data)
+
+
+# Неизменные клавиатуры: объекты Telegram неизменяемы, поэтому их можно отдавать
+# во все обработчики без копирования
+START_KEYBOARD = InlineKeyboardMarkup([[_button("button_register", "start_registration")]])
+CONSENT_KEYBOARD = InlineKeyboardMarkup([
+    [_button("button_continue_registration", "continue_registration")],
+    [_button("button_cancel", "cancel")]
+])
+ADMIN_MENU_KEYBOARD = InlineKeyboardMarkup([
+    [_button("button_pending_list", "list_pending")],
+    [_button("button_exit", "cancel")]
+])
+BACK_TO_ADMIN_KEYBOARD = InlineKeyboardMarkup([[_button("button_back", "back_to_admin")]])
+REJECTION_REASON_KEYBOARD = InlineKeyboardMarkup([
+    [_button("default_rejection_reason", "default_reason")]
+])
+EVENT_TYPE_KEYBOARD = InlineKeyboardMarkup([
+    [_button("button_camp", "camp")],
+    [_button("button_game_event", "game_event")],
+    [_button("button_other", "other")]
+])
+EVENT_CONFIRM_KEYBOARD = InlineKeyboardMarkup([
+    [_button("button_save", "save_event")],
+    [_button("button_discard", "cancel")]
+])
+BOOKING_CONFIRM_KEYBOARD = InlineKeyboardMarkup([
+    [_button("button_confirm", "confirm_booking")],
+    [_button("button_cancel_mark", "cancel")]
+])
+CANCEL_BUTTON = _button("button_cancel", "cancel")
+
+
+# Клавиатуры с id мероприятия или пользователя строятся один раз на набор параметров
+@functools.lru_cache(maxsize=TEMPLATE_CACHE_SIZE)
+def registration_review_keyboard(user_id: int) -> InlineKeyboardMarkup:
+    return InlineKeyboardMarkup([[
+        _button("button_confirm", f"approve_{user_id}"),
+        _button("button_reject", f"reject_{user_id}")
+    ]])
+
+
+@functools.lru_cache(maxsize=TEMPLATE_CACHE_SIZE)
+def waitlist_keyboard(event_id: int) -> InlineKeyboardMarkup:
+    return InlineKeyboardMarkup([
+        [_button("button_waitlist", f"waitlist_{event_id}")],
+        [_button("button_cancel_mark", "cancel")]
+    ])
+
+
+@functools.lru_cache(maxsize=TEMPLATE_CACHE_SIZE)
+def booking_review_keyboard(event_id: int, user_id: int) -> InlineKeyboardMarkup:
+    return InlineKeyboardMarkup([
+        [_button("button_confirm", f"approve_booking_{event_id}_{user_id}")],
+        [_button("button_reject", f"reject_booking_{event_id}_{user_id}")]
+    ])
+
+
+@functools.lru_cache(maxsize=TEMPLATE_CACHE_SIZE)
+def payment_keyboard(event_id: int) -> InlineKeyboardMarkup:
+    return InlineKeyboardMarkup([[_button("button_paid", f"confirm_payment_{event_id}")]])
+
+
+@functools.lru_cache(maxsize=TEMPLATE_CACHE_SIZE)
+def payment_review_keyboard(event_id: int, user_id: int) -> InlineKeyboardMarkup:
+    return InlineKeyboardMarkup([
+        [_button("button_confirm", f"verify_payment_{event_id}_{user_id}")],
+        [_button("button_reject", f"reject_payment_{event_id}_{user_id}")]
+    ])
+
+
+@functools.lru_cache(maxsize=TEMPLATE_CACHE_SIZE)
+def event_button(event_id: int, name: str, date: datetime.datetime, free: int,
+                 max_participants: int) -> InlineKeyboardButton:
+    """Button of one event in the events list; cached per name, date and free seats."""
+    return InlineKeyboardButton(
+        render("event_button", name=name, date=date, free=free, max_participants=max_participants),
+        callback_data=f"select_{event_id}"
     )
 
-    conn = get_db_connection()
-    cursor = conn.cursor()
-    try:
-        cursor.execute(
-            """
-            CREATE TABLE IF NOT EXISTS users (
-                user_id BIGINT PRIMARY KEY,
-                username TEXT,
-                first_name TEXT NOT NULL,
-                last_name TEXT,
-                contacts TEXT NOT NULL,
-                tesera_nick TEXT,
-                source TEXT,
-                status TEXT NOT NULL,
-                rejection_reason TEXT,
-                registration_date TIMESTAMP DEFAULT NOW()
+
+# --- Метрики ---
+class Metrics:
+    """Minimal thread-safe registry of counters and histograms.
+
+    Values are exported in the Prometheus text format by render(). Histograms
+    share one set of latency buckets (seconds).
+    """
+
+    BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._help = {}
+        self._counters = defaultdict(float)  # (name, labels) -> значение
+        self._histograms = {}  # (name, labels) -> [счетчики корзин, сумма, количество]
+
+    def describe(self, name, kind, text):
+        self._help[name] = (kind, text)
+
+    def inc(self, metric, amount=1, **labels):
+        key = (metric, tuple(sorted(labels.items())))
+        with self._lock:
+            self._counters[key] += amount
+
+    def observe(self, metric, value, **labels):
+        key = (metric, tuple(sorted(labels.items())))
+        with self._lock:
+            histogram = self._histograms.get(key)
+            if histogram is None:
+                histogram = self._histograms[key] = [[0] * len(self.BUCKETS), 0.0, 0]
+            for i, bound in enumerate(self.BUCKETS):
+                if value <= bound:
+                    histogram[0][i] += 1
+            histogram[1] += value
+            histogram[2] += 1
+
+    @staticmethod
+    def _labels(labels, extra=()):
+        pairs = list(labels) + list(extra)
+        if not pairs:
+            return ""
+        escaped = (str(value).replace("\\", "\\\\").replace('"', '\\"') for _, value in pairs)
+        return "{" + ",".join(f'{name}="{value}"' for (name, _), value in zip(pairs, escaped)) + "}"
+
+    def render(self) -> str:
+        with self._lock:
+            counters = sorted(self._counters.items())
+            histograms = sorted((key, [list(value[0]), value[1], value[2]])
+                                for key, value in self._histograms.items())
+        lines = []
+        described = set()
+
+        def header(name):
+            if name not in described and name in self._help:
+                kind, text = self._help[name]
+                lines.append(f"# HELP {name} {text}")
+                lines.append(f"# TYPE {name} {kind}")
+            described.add(name)
+
+        for (name, labels), value in counters:
+            header(name)
+            lines.append(f"{name}{self._labels(labels)} {value:g}")
+        for (name, labels), (buckets, total, count) in histograms:
+            header(name)
+            for bound, bucket_count in zip(self.BUCKETS, buckets):
+                lines.append(f"{name}_bucket{self._labels(labels, [('le', f'{bound:g}')])} {bucket_count}")
+            lines.append(f"{name}_bucket{self._labels(labels, [('le', '+Inf')])} {count}")
+            lines.append(f"{name}_sum{self._labels(labels)} {total:.6f}")
+            lines.append(f"{name}_count{self._labels(labels)} {count}")
+        return "\n".join(lines) + "\n"
+
+
+metrics = Metrics()
+metrics.describe("bot_handler_duration_seconds", "histogram", "Update handler latency.")
+metrics.describe("bot_handler_errors_total", "counter", "Update handlers that raised.")
+metrics.describe("bot_db_query_duration_seconds", "histogram", "DB transaction time, excluding pool wait.")
+metrics.describe("bot_db_errors_total", "counter", "DB transactions that raised.")
+metrics.describe("bot_db_pool_wait_seconds", "histogram", "Time spent waiting for a pooled connection.")
+metrics.describe("bot_telegram_request_duration_seconds", "histogram", "Bot API request latency.")
+metrics.describe("bot_telegram_request_errors_total", "counter", "Failed Bot API requests.")
+metrics.describe("bot_job_duration_seconds", "histogram", "JobQueue job duration.")
+metrics.describe("bot_job_errors_total", "counter", "JobQueue jobs that raised.")
+metrics.describe("bot_outbox_sent_total", "counter", "Notifications delivered from the outbox.")
+metrics.describe("bot_outbox_failed_total", "counter", "Outbox deliveries that failed.")
+metrics.describe("bot_broadcast_messages_total", "counter", "Announcement sends by result.")
+metrics.describe("bot_updates_throttled_total", "counter", "Updates dropped by the rate limiter.")
+
+
+def instrument(callback, histogram, errors_counter, **labels):
+    """Wraps an async callback so its duration and failures are recorded.
+
+    The callback name is also put into current_handler, which tags the SQL
+    statements it runs.
+    """
+    labels = labels or {"name": callback.__name__}
+
+    @functools.wraps(callback)
+    async def wrapper(*args, **kwargs):
+        started = time.perf_counter()
+        token = current_handler.set(callback.__name__)
+        try:
+            return await callback(*args, **kwargs)
+        except ApplicationHandlerStop:
+            raise  # штатная остановка обработки, а не ошибка обработчика
+        except Exception:
+            metrics.inc(errors_counter, **labels)
+            raise
+        finally:
+            current_handler.reset(token)
+            metrics.observe(histogram, time.perf_counter() - started, **labels)
+
+    return wrapper
+
+
+def instrument_job(callback):
+    """Decorator for JobQueue callbacks."""
+    return instrument(callback, "bot_job_duration_seconds", "bot_job_errors_total")
+
+
+def instrument_handlers(application: Application) -> None:
+    """Wraps the callbacks of all registered handlers, including conversation states."""
+
+    def wrap(handler):
+        if isinstance(handler, ConversationHandler):
+            for nested in handler.entry_points + handler.fallbacks:
+                wrap(nested)
+            for state_handlers in handler.states.values():
+                for nested in state_handlers:
+                    wrap(nested)
+        elif not getattr(handler.callback, "__wrapped__", None):
+            handler.callback = instrument(
+                handler.callback, "bot_handler_duration_seconds", "bot_handler_errors_total",
+                handler=handler.callback.__name__
+            )
+
+    for handlers in application.handlers.values():
+        for handler in handlers:
+            wrap(handler)
+
+
+class InstrumentedRequest(HTTPXRequest):
+    """HTTPXRequest that records latency and failures of every Bot API call."""
+
+    async def do_request(self, url, method, request_data=None, *args, **kwargs):
+        endpoint = url.rsplit("/", 1)[-1]
+        started = time.perf_counter()
+        try:
+            code, payload = await super().do_request(url, method, request_data, *args, **kwargs)
+        except Exception:
+            metrics.inc("bot_telegram_request_errors_total", method=endpoint, code="network")
+            raise
+        finally:
+            metrics.observe("bot_telegram_request_duration_seconds",
+                            time.perf_counter() - started, method=endpoint)
+        if code >= 400:
+            metrics.inc("bot_telegram_request_errors_total", method=endpoint, code=code)
+        return code, payload
+
+
+class MetricsServer:
+    """Serves GET /metrics for Prometheus on a local port."""
+
+    def __init__(self, listen: str, port: int):
+        self.listen = listen
+        self.port = port
+        self._runner = None
+
+    async def handle_metrics(self, request: web.Request) -> web.Response:
+        body = metrics.render()
+        if connection_pool:
+            # Счетчики пула снимаются в момент запроса
+            body += "".join(
+                f"bot_db_pool_{name} {value:g}\n" for name, value in sorted(connection_pool.stats().items())
             )
+        return web.Response(text=body, content_type="text/plain", charset="utf-8")
+
+    async def start(self) -> None:
+        app = web.Application()
+        app.router.add_get("/metrics", self.handle_metrics)
+        self._runner = web.AppRunner(app, access_log=None)
+        await self._runner.setup()
+        await web.TCPSite(self._runner, self.listen, self.port).start()
+        logger.info(f"Metrics available at http://{self.listen}:{self.port}/metrics")
+
+    async def stop(self) -> None:
+        if self._runner:
+            await self._runner.cleanup()
+            self._runner = None
+
+
+# --- Профилирование запросов ---
+# Имя обработчика или задачи, от имени которой выполняются запросы к БД
+current_handler = contextvars.ContextVar("current_handler", default="background")
+
+
+class QueryProfiler:
+    """Aggregates statement timings and reports slow statements.
+
+    Statements are grouped by their text with literals replaced by "?", so
+    execute_values batches of different sizes land in one entry.
+    """
+
+    LITERALS = re.compile(r"'(?:[^']|'')*'|\b\d+(?:\.\d+)?\b")
+    VALUE_LISTS = re.compile(r"\((?:\?|NULL)(?:, (?:\?|NULL))*\)(?:, \((?:\?|NULL)(?:, (?:\?|NULL))*\))+")
+
+    def __init__(self, slow_ms, explain=False):
+        self.slow_ms = slow_ms
+        self.explain = explain
+        self._lock = threading.Lock()
+        self._stats = {}  # текст запроса -> агрегаты
+
+    @classmethod
+    def normalize(cls, sql) -> str:
+        if isinstance(sql, bytes):
+            sql = sql.decode("utf-8", "replace")
+        sql = " ".join(sql.split())
+        sql = cls.LITERALS.sub("?", sql)
+        return cls.VALUE_LISTS.sub("(...)", sql)
+
+    def record(self, cursor, sql, params, duration, failed=False) -> None:
+        statement = self.normalize(sql)
+        handler = current_handler.get()
+        with self._lock:
+            entry = self._stats.get(statement)
+            if entry is None:
+                entry = self._stats[statement] = {
+                    "calls": 0, "total": 0.0, "max": 0.0, "rows": 0, "handlers": set()
+                }
+            entry["calls"] += 1
+            entry["total"] += duration
+            entry["max"] = max(entry["max"], duration)
+            entry["rows"] += max(cursor.rowcount, 0)
+            entry["handlers"].add(handler)
+
+        if duration * 1000 >= self.slow_ms:
+            message = f"Slow query {duration * 1000:.0f} ms in {handler}: {statement[:1000]}"
+            if self.explain and not failed:
+                message += "\n" + self._explain(cursor, sql, params)
+            logger.warning(message)
+
+    @staticmethod
+    def _explain(cursor, sql, params) -> str:
+        """Captures the plan of a slow statement.
+
+        Only read-only statements are run again with ANALYZE; writes get a
+        plain EXPLAIN so they are not applied twice. A savepoint keeps a
+        failing EXPLAIN from aborting the caller's transaction.
         """
+        if isinstance(sql, bytes):
+            sql = sql.decode("utf-8", "replace")
+        read_only = sql.lstrip().upper().startswith(("SELECT", "WITH")) and not re.search(
+            r"\b(INSERT|UPDATE|DELETE)\b|FOR UPDATE", sql, re.IGNORECASE
         )
-        cursor.execute(
-            """
-            CREATE TABLE IF NOT EXISTS events (
-                event_id SERIAL PRIMARY KEY,
-                name TEXT NOT NULL,
-                description TEXT,
-                type TEXT NOT NULL,
-                date_start TIMESTAMP NOT NULL,
-                date_end TIMESTAMP,
-                location TEXT,
-                max_participants INTEGER,
-                current_participants INTEGER DEFAULT 0,
-                price INTEGER,
-                payment_required BOOLEAN DEFAULT FALSE,
-                google_form_link TEXT,
-                status TEXT DEFAULT 'active',
-                created_by BIGINT REFERENCES users(user_id)
-            )
+        options = "ANALYZE, BUFFERS" if read_only else "COSTS"
+        conn = cursor.connection
+        try:
+            with conn.cursor(cursor_factory=extensions.cursor) as explain_cursor:
+                if not conn.autocommit:
+                    explain_cursor.execute("SAVEPOINT explain_slow_query")
+                try:
+                    explain_cursor.execute(f"EXPLAIN ({options}) {sql}", params)
+                    plan = "\n".join(row[0] for row in explain_cursor.fetchall())
+                finally:
+                    if not conn.autocommit:
+                        explain_cursor.execute("ROLLBACK TO SAVEPOINT explain_slow_query")
+            return plan
+        except psycopg2.Error as e:
+            return f"EXPLAIN failed: {e}"
+
+    def top(self, limit=10):
+        """Returns the statements with the highest total time."""
+        with self._lock:
+            items = [(statement, dict(entry, handlers=sorted(entry["handlers"])))
+                     for statement, entry in self._stats.items()]
+        return sorted(items, key=lambda item: item[1]["total"], reverse=True)[:limit]
+
+    def reset(self) -> None:
+        with self._lock:
+            self._stats = {}
+
+
+query_profiler = QueryProfiler(SLOW_QUERY_MS, SLOW_QUERY_EXPLAIN)
+
+
+class ProfilingCursor(extensions.cursor):
+    """Cursor that reports every statement's duration to query_profiler.
+
+    For a named (server-side) cursor execute() only declares it; stream_query
+    reports the fetch time instead.
+    """
+
+    def execute(self, query, vars=None):
+        if self.name:
+            return super().execute(query, vars)
+        started = time.perf_counter()
+        try:
+            result = super().execute(query, vars)
+        except Exception:
+            query_profiler.record(self, query, vars, time.perf_counter() - started, failed=True)
+            raise
+        query_profiler.record(self, query, vars, time.perf_counter() - started)
+        return result
+
+
+# --- Пул соединений ---
+class ConnectionPool:
+    """Thread-safe PostgreSQL connection pool.
+
+    Unlike psycopg2's SimpleConnectionPool, getconn() waits up to
+    acquire_timeout for a free connection instead of failing immediately,
+    idle connections are validated on checkout and connections older than
+    max_lifetime are recycled. Wait time and exhaustion are counted in stats().
+    """
+
+    def __init__(self, minconn, maxconn, acquire_timeout=10.0, max_lifetime=3600.0,
+                 validate_idle=30.0, prefill=True, **connect_kwargs):
+        self.minconn = minconn
+        self.maxconn = maxconn
+        self.acquire_timeout = acquire_timeout
+        self.max_lifetime = max_lifetime
+        self.validate_idle = validate_idle
+        self._connect_kwargs = connect_kwargs
+        self._cond = threading.Condition()
+        self._idle = deque()  # (conn, returned_at)
+        self._created_at = {}  # id(conn) -> время открытия
+        self._size = 0  # открытые соединения, включая выданные
+        self._closed = False
+        self._stats = {
+            "acquired": 0,
+            "waits": 0,
+            "wait_time_total": 0.0,
+            "wait_time_max": 0.0,
+            "exhausted": 0,
+            "timeouts": 0,
+            "recycled": 0,
+            "broken": 0,
+        }
+        if prefill:
+            self.warm()
+
+    def warm(self, count=None) -> int:
+        """Opens connections until the pool holds count (default minconn); returns how many were opened."""
+        count = self.minconn if count is None else count
+        opened = 0
+        while True:
+            with self._cond:
+                if self._closed or self._size >= count:
+                    return opened
+                self._size += 1
+            try:
+                conn = self._connect()
+            except Exception:
+                with self._cond:
+                    self._size -= 1
+                    self._cond.notify()
+                raise
+            with self._cond:
+                self._idle.append((conn, time.monotonic()))
+                self._cond.notify()
+            opened += 1
+
+    def _connect(self):
+        conn = psycopg2.connect(**self._connect_kwargs)
+        self._created_at[id(conn)] = time.monotonic()
+        return conn
+
+    def _count(self, name):
+        with self._cond:
+            self._stats[name] += 1
+
+    def _expired(self, conn):
+        created_at = self._created_at.get(id(conn), 0)
+        return time.monotonic() - created_at > self.max_lifetime
+
+    def _is_usable(self, conn, idle_since):
+        """Checks a connection taken from the idle list before handing it out."""
+        if conn.closed:
+            self._count("broken")
+            return False
+        if self._expired(conn):
+            self._count("recycled")
+            return False
+        if time.monotonic() - idle_since > self.validate_idle:
+            try:
+                # Проверка соединения не должна попадать в /dbstats
+                with conn.cursor(cursor_factory=extensions.cursor) as cursor:
+                    cursor.execute("SELECT 1")
+                conn.rollback()
+            except psycopg2.Error:
+                self._count("broken")
+                return False
+        return True
+
+    def _discard(self, conn):
+        self._created_at.pop(id(conn), None)
+        try:
+            conn.close()
+        except psycopg2.Error:
+            pass
+        with self._cond:
+            self._size -= 1
+            self._cond.notify()
+
+    def getconn(self, timeout=None):
+        """Returns a connection, waiting up to timeout seconds if the pool is exhausted."""
+        timeout = self.acquire_timeout if timeout is None else timeout
+        started = time.monotonic()
+        deadline = started + timeout
+        waited = False
+        while True:
+            conn = None
+            with self._cond:
+                while True:
+                    if self._closed:
+                        raise pool.PoolError("connection pool is closed")
+                    if self._idle:
+                        conn, idle_since = self._idle.pop()
+                        break
+                    if self._size < self.maxconn:
+                        self._size += 1
+                        break
+                    if not waited:
+                        waited = True
+                        self._stats["exhausted"] += 1
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        self._stats["timeouts"] += 1
+                        raise pool.PoolError(
+                            f"connection pool exhausted: no connection within {timeout:.1f}s"
+                        )
+                    self._cond.wait(remaining)
+
+            if conn is None:
+                try:
+                    conn = self._connect()
+                except Exception:
+                    with self._cond:
+                        self._size -= 1
+                        self._cond.notify()
+                    raise
+            elif not self._is_usable(conn, idle_since):
+                self._discard(conn)
+                continue
+
+            wait_time = time.monotonic() - started
+            with self._cond:
+                self._stats["acquired"] += 1
+                if waited:
+                    self._stats["waits"] += 1
+                self._stats["wait_time_total"] += wait_time
+                self._stats["wait_time_max"] = max(self._stats["wait_time_max"], wait_time)
+            return conn
+
+    def putconn(self, conn, close=False):
+        """Returns a connection to the pool, closing it if it is broken or too old."""
+        if close or self._closed or conn.closed or self._expired(conn):
+            if not conn.closed and not close and not self._closed:
+                self._count("recycled")
+            self._discard(conn)
+            return
+        if conn.info.transaction_status != extensions.TRANSACTION_STATUS_IDLE:
+            try:
+                conn.rollback()
+            except psycopg2.Error:
+                self._count("broken")
+                self._discard(conn)
+                return
+        with self._cond:
+            self._idle.append((conn, time.monotonic()))
+            self._cond.notify()
+
+    def closeall(self):
+        """Closes idle connections; connections in use are closed when returned."""
+        with self._cond:
+            self._closed = True
+            idle = list(self._idle)
+            self._idle.clear()
+            self._cond.notify_all()
+        for conn, _ in idle:
+            self._discard(conn)
+
+    def stats(self):
+        """Returns a snapshot of pool counters."""
+        with self._cond:
+            snapshot = dict(self._stats)
+            snapshot["size"] = self._size
+            snapshot["idle"] = len(self._idle)
+            snapshot["in_use"] = self._size - len(self._idle)
+        return snapshot
+
+# --- Рассылка сообщений ---
+class TokenBucket:
+    """Async token bucket: `rate` tokens per second with bursts up to `capacity`."""
+
+    def __init__(self, rate, capacity=None):
+        self.rate = rate
+        self.capacity = capacity or max(1, rate)
+        self._tokens = self.capacity
+        self._updated = time.monotonic()
+        self._lock = asyncio.Lock()
+
+    def _refill(self):
+        now = time.monotonic()
+        self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+        self._updated = now
+
+    @property
+    def idle(self):
+        """True when the bucket is full again, i.e. it carries no state worth keeping."""
+        self._refill()
+        return self._tokens >= self.capacity
+
+    def try_acquire(self) -> bool:
+        """Takes a token if one is available right now; never waits."""
+        self._refill()
+        if self._tokens >= 1:
+            self._tokens -= 1
+            return True
+        return False
+
+    async def acquire(self):
+        """Waits until a token is available and takes it."""
+        async with self._lock:
+            while True:
+                self._refill()
+                if self._tokens >= 1:
+                    self._tokens -= 1
+                    return
+                await asyncio.sleep((1 - self._tokens) / self.rate)
+
+
+class Broadcaster:
+    """Sends messages to many chats concurrently within Telegram rate limits.
+
+    Every send takes a token from the chat's own bucket and from the global
+    bucket. RetryAfter responses are waited out and the send is retried,
+    unless the wait would run past the caller's `deadline` (event loop time).
+    """
+
+    MAX_CHAT_BUCKETS = 10000
+
+    def __init__(self, global_rate, chat_rate, chat_burst=1, max_retries=3):
+        self._global_bucket = TokenBucket(global_rate)
+        self._chat_rate = chat_rate
+        self._chat_burst = chat_burst
+        self._chat_buckets = {}
+        self.max_retries = max_retries
+        self._tasks = set()
+
+    def _chat_bucket(self, chat_id):
+        bucket = self._chat_buckets.get(chat_id)
+        if bucket is None:
+            if len(self._chat_buckets) >= self.MAX_CHAT_BUCKETS:
+                self._chat_buckets = {
+                    key: value for key, value in self._chat_buckets.items() if not value.idle
+                }
+            bucket = self._chat_buckets[chat_id] = TokenBucket(self._chat_rate, self._chat_burst)
+        return bucket
+
+    async def send(self, bot, chat_id, text, deadline=None, **kwargs):
+        """Sends one message, waiting for rate-limit tokens and retrying after RetryAfter."""
+        for attempt in range(self.max_retries + 1):
+            await self._chat_bucket(chat_id).acquire()
+            await self._global_bucket.acquire()
+            try:
+                return await bot.send_message(chat_id=chat_id, text=text, **kwargs)
+            except RetryAfter as e:
+                if attempt == self.max_retries:
+                    raise
+                if deadline is not None and asyncio.get_running_loop().time() + e.retry_after >= deadline:
+                    raise
+                logger.warning(f"Flood control for chat {chat_id}, retrying in {e.retry_after}s")
+                await asyncio.sleep(e.retry_after)
+
+    async def send_many(self, bot, chat_ids, text, **kwargs):
+        """Sends the message to all chats concurrently; returns results or exceptions."""
+        results = await asyncio.gather(
+            *(self.send(bot, chat_id, text, **kwargs) for chat_id in chat_ids),
+            return_exceptions=True
+        )
+        for chat_id, result in zip(chat_ids, results):
+            if isinstance(result, Exception):
+                logger.error(f"Failed to send message to {chat_id}: {result}")
+        return results
+
+    def broadcast(self, bot, chat_ids, text, **kwargs):
+        """Schedules send_many in the background and returns without waiting for it."""
+        task = asyncio.get_running_loop().create_task(
+            self.send_many(bot, list(chat_ids), text, **kwargs)
+        )
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+        return task
+
+    async def drain(self, timeout) -> int:
+        """Waits up to timeout seconds for background broadcasts; returns how many were cut off."""
+        if not self._tasks:
+            return 0
+        _, pending = await asyncio.wait(set(self._tasks), timeout=max(timeout, 0))
+        for task in pending:
+            task.cancel()
+        return len(pending)
+
+
+broadcaster = Broadcaster(
+    TELEGRAM_GLOBAL_RATE, TELEGRAM_CHAT_RATE,
+    chat_burst=TELEGRAM_CHAT_BURST, max_retries=TELEGRAM_SEND_RETRIES
+)
+
+
+# --- Ограничение частоты запросов ---
+class RateLimiter:
+    """Drops floods of updates before they reach the handlers.
+
+    Runs as a TypeHandler in an early group, so a rejected update costs a few
+    dictionary lookups and no DB or Bot API calls. Each user has a bucket for
+    all updates and one per command or callback prefix; a callback with the
+    same data as the user's previous one within the duplicate window is
+    dropped as a double tap. Administrators are never limited. The user is
+    told about throttling once, until their updates are let through again;
+    every dropped callback query is still answered.
+    """
+
+    MAX_USERS = 10000
+    CALLBACK_ARGS = re.compile(r"_-?\d.*$")  # "select_12" -> "select"
+
+    def __init__(self, user_rate, user_burst, command_rate, command_burst, duplicate_window):
+        self.user_rate = user_rate
+        self.user_burst = user_burst
+        self.command_rate = command_rate
+        self.command_burst = command_burst
+        self.duplicate_window = duplicate_window
+        self._user_buckets = {}
+        self._command_buckets = {}  # (user_id, команда) -> TokenBucket
+        self._last_callback = {}  # user_id -> (callback_data, время)
+        self._warned = set()
+
+    @staticmethod
+    def _bucket(buckets, key, rate, burst):
+        bucket = buckets.get(key)
+        if bucket is None:
+            if len(buckets) >= RateLimiter.MAX_USERS:
+                # Полные корзины ничего не помнят, их можно выбросить
+                stale = [item for item, value in buckets.items() if value.idle]
+                for item in stale:
+                    del buckets[item]
+            bucket = buckets[key] = TokenBucket(rate, burst)
+        return bucket
+
+    def _is_duplicate(self, user_id, data) -> bool:
+        now = time.monotonic()
+        previous = self._last_callback.get(user_id)
+        if len(self._last_callback) >= self.MAX_USERS:
+            self._last_callback = {
+                key: value for key, value in self._last_callback.items()
+                if now - value[1] < self.duplicate_window
+            }
+        self._last_callback[user_id] = (data, now)
+        return previous is not None and previous[0] == data and now - previous[1] < self.duplicate_window
+
+    def _command(self, update: Update):
+        if update.callback_query and update.callback_query.data:
+            return self.CALLBACK_ARGS.sub("", update.callback_query.data)
+        text = update.message.text if update.message else None
+        if text and text.startswith("/"):
+            return text.split(maxsplit=1)[0].split("@", 1)[0]
+        return None
+
+    def verdict(self, update: Update):
+        """Returns why the update should be dropped, or None to let it through."""
+        user = update.effective_user
+        if user is None or user.id in ADMINISTRATOR_IDS:
+            return None
+        query = update.callback_query
+        if query and query.data and self._is_duplicate(user.id, query.data):
+            return "duplicate"
+        if not self._bucket(self._user_buckets, user.id,
+                            self.user_rate, self.user_burst).try_acquire():
+            return "user"
+        command = self._command(update)
+        if command and not self._bucket(self._command_buckets, (user.id, command),
+                                        self.command_rate, self.command_burst).try_acquire():
+            return "command"
+        return None
+
+    async def check(self, update: Update, context: CallbackContext) -> None:
+        reason = self.verdict(update)
+        if reason is None:
+            if update.effective_user:
+                self._warned.discard(update.effective_user.id)
+            return
+        metrics.inc("bot_updates_throttled_total", reason=reason)
+        user_id = update.effective_user.id
+        # Повторное нажатие просто игнорируем; о частых запросах сообщаем один раз
+        notify = reason != "duplicate" and user_id not in self._warned
+        if notify:
+            if len(self._warned) >= self.MAX_USERS:
+                # Тех, чья корзина уже наполнилась, можно предупредить заново
+                self._warned = {
+                    key for key in self._warned
+                    if key in self._user_buckets and not self._user_buckets[key].idle
+                }
+            self._warned.add(user_id)
+        try:
+            if update.callback_query:
+                # Без answer() кнопка у пользователя продолжает крутиться
+                await update.callback_query.answer(TEXTS["throttled"] if notify else None)
+            elif notify and update.effective_message:
+                await update.effective_message.reply_text(TEXTS["throttled"])
+        except TelegramError as e:
+            logger.warning(f"Failed to answer throttled update from {user_id}: {e}")
+        raise ApplicationHandlerStop
+
+
+rate_limiter = RateLimiter(
+    RATE_LIMIT_USER_RATE, RATE_LIMIT_USER_BURST,
+    RATE_LIMIT_COMMAND_RATE, RATE_LIMIT_COMMAND_BURST,
+    DUPLICATE_CALLBACK_WINDOW
+)
+
+
+# --- Время запуска ---
+class StartupTimer:
+    """Measures startup stages; they may overlap, so the total is wall time since import."""
+
+    def __init__(self, started: float):
+        self.started = started
+        self.stages = {}
+
+    @contextlib.contextmanager
+    def stage(self, name: str):
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.stages[name] = time.perf_counter() - started
+
+    def log(self) -> None:
+        breakdown = ", ".join(f"{name} {seconds:.2f}s" for name, seconds in self.stages.items())
+        logger.info(f"Started in {time.perf_counter() - self.started:.2f}s ({breakdown})")
+
+
+startup = StartupTimer(_IMPORT_STARTED)
+
+
+# --- Миграции схемы ---
+# Версия схемы хранится в единственной строке schema_version. Миграции применяются
+# по порядку; каждая — список SQL-команд. Новые изменения схемы добавляются только
+# новой миграцией в конец списка.
+MIGRATION_LOCK_ID = 727001  # ключ advisory-блокировки на время миграций
+LEADER_LOCK_ID = 727002  # ключ advisory-блокировки лидера среди воркеров
+
+# Пересчёт счётчиков занятости всех мероприятий одним запросом. SHARE-блокировка
+# ждёт завершения текущих бронирований и не даёт начаться новым до конца пересчёта,
+# иначе триггер и пересчёт могли бы записать разные значения. Строки events
+# блокируются раньше таблицы — в том же порядке, что и при бронировании (lock_event).
+RECONCILE_OCCUPANCY_SQL = """
+    SELECT event_id FROM events ORDER BY event_id FOR UPDATE;
+    LOCK TABLE event_participants IN SHARE MODE;
+    UPDATE events e
+    SET current_participants = c.seats,
+        pending_participants = c.pending,
+        confirmed_participants = c.confirmed,
+        paid_participants = c.paid
+    FROM (
+        SELECT ev.event_id,
+               COUNT(ep.participant_id) FILTER (WHERE ep.booking_status <> 'waitlist') AS seats,
+               COUNT(ep.participant_id) FILTER (WHERE ep.booking_status = 'pending') AS pending,
+               COUNT(ep.participant_id) FILTER (WHERE ep.booking_status = 'confirmed') AS confirmed,
+               COUNT(ep.participant_id) FILTER (WHERE ep.payment_status = 'paid') AS paid
+        FROM events ev
+        LEFT JOIN event_participants ep ON ep.event_id = ev.event_id
+        GROUP BY ev.event_id
+    ) c
+    WHERE e.event_id = c.event_id
+      AND (e.current_participants, e.pending_participants,
+           e.confirmed_participants, e.paid_participants)
+          IS DISTINCT FROM (c.seats, c.pending, c.confirmed, c.paid)
+    RETURNING e.event_id, e.name
+"""
+
+MIGRATIONS = [
+    (1, "initial schema", [
         """
+        CREATE TABLE IF NOT EXISTS users (
+            user_id BIGINT PRIMARY KEY,
+            username TEXT,
+            first_name TEXT NOT NULL,
+            last_name TEXT,
+            contacts TEXT NOT NULL,
+            tesera_nick TEXT,
+            source TEXT,
+            status TEXT NOT NULL,
+            rejection_reason TEXT,
+            registration_date TIMESTAMP DEFAULT NOW()
         )
-        cursor.execute(
-            """
-            CREATE TABLE IF NOT EXISTS event_participants (
-                participant_id SERIAL PRIMARY KEY,
-                user_id BIGINT REFERENCES users(user_id),
-                event_id INTEGER REFERENCES events(event_id),
-                booking_status TEXT NOT NULL,
-                payment_status TEXT,
-                booking_date TIMESTAMP DEFAULT NOW(),
-                UNIQUE (user_id, event_id)
-            )
+        """,
         """
+        CREATE TABLE IF NOT EXISTS events (
+            event_id SERIAL PRIMARY KEY,
+            name TEXT NOT NULL,
+            description TEXT,
+            type TEXT NOT NULL,
+            date_start TIMESTAMP NOT NULL,
+            date_end TIMESTAMP,
+            location TEXT,
+            max_participants INTEGER,
+            current_participants INTEGER DEFAULT 0,
+            price INTEGER,
+            payment_required BOOLEAN DEFAULT FALSE,
+            google_form_link TEXT,
+            status TEXT DEFAULT 'active',
+            created_by BIGINT REFERENCES users(user_id)
         )
-        cursor.execute(
-            """
-            CREATE TABLE IF NOT EXISTS payments (
-                payment_id SERIAL PRIMARY KEY,
-                user_id BIGINT REFERENCES users(user_id),
-                event_id INTEGER REFERENCES events(event_id),
-                amount INTEGER NOT NULL,
-                currency TEXT DEFAULT 'RUB',
-                method TEXT,
-                receipt_photo TEXT,
-                status TEXT DEFAULT 'pending',
-                admin_comment TEXT,
-                payment_date TIMESTAMP DEFAULT NOW()
-            )
+        """,
         """
+        CREATE TABLE IF NOT EXISTS event_participants (
+            participant_id SERIAL PRIMARY KEY,
+            user_id BIGINT REFERENCES users(user_id),
+            event_id INTEGER REFERENCES events(event_id),
+            booking_status TEXT NOT NULL,
+            payment_status TEXT,
+            booking_date TIMESTAMP DEFAULT NOW(),
+            UNIQUE (user_id, event_id)
         )
-        cursor.execute(
-            """
-            CREATE TABLE IF NOT EXISTS chats (
-                chat_id SERIAL PRIMARY KEY,
-                event_id INTEGER REFERENCES events(event_id),
-                invite_link TEXT,
-                rules TEXT,
-                is_active BOOLEAN DEFAULT TRUE
-            )
+        """,
         """
+        CREATE TABLE IF NOT EXISTS payments (
+            payment_id SERIAL PRIMARY KEY,
+            user_id BIGINT REFERENCES users(user_id),
+            event_id INTEGER REFERENCES events(event_id),
+            amount INTEGER NOT NULL,
+            currency TEXT DEFAULT 'RUB',
+            method TEXT,
+            receipt_photo TEXT,
+            status TEXT DEFAULT 'pending',
+            admin_comment TEXT,
+            payment_date TIMESTAMP DEFAULT NOW()
         )
-        cursor.execute(
-            """
-            CREATE TABLE IF NOT EXISTS notifications (
-                notification_id SERIAL PRIMARY KEY,
-                user_id BIGINT REFERENCES users(user_id),
-                event_id INTEGER REFERENCES events(event_id),
-                message TEXT NOT NULL,
-                type TEXT NOT NULL,
-                is_sent BOOLEAN DEFAULT FALSE,
-                created_at TIMESTAMP DEFAULT NOW()
-            )
+        """,
         """
+        CREATE TABLE IF NOT EXISTS chats (
+            chat_id SERIAL PRIMARY KEY,
+            event_id INTEGER REFERENCES events(event_id),
+            invite_link TEXT,
+            rules TEXT,
+            is_active BOOLEAN DEFAULT TRUE
         )
-        cursor.execute(
-            """
-            CREATE TABLE IF NOT EXISTS admin_actions (
-                action_id SERIAL PRIMARY KEY,
-                admin_id BIGINT REFERENCES users(user_id),
-                target_user_id BIGINT REFERENCES users(user_id),
-                action_type TEXT NOT NULL,
-                details TEXT,
-                action_time TIMESTAMP DEFAULT NOW()
-            )
+        """,
+        """
+        CREATE TABLE IF NOT EXISTS notifications (
+            notification_id SERIAL PRIMARY KEY,
+            user_id BIGINT REFERENCES users(user_id),
+            event_id INTEGER REFERENCES events(event_id),
+            message TEXT NOT NULL,
+            type TEXT NOT NULL,
+            is_sent BOOLEAN DEFAULT FALSE,
+            created_at TIMESTAMP DEFAULT NOW()
+        )
+        """,
+        """
+        CREATE TABLE IF NOT EXISTS admin_actions (
+            action_id SERIAL PRIMARY KEY,
+            admin_id BIGINT REFERENCES users(user_id),
+            target_user_id BIGINT REFERENCES users(user_id),
+            action_type TEXT NOT NULL,
+            details TEXT,
+            action_time TIMESTAMP DEFAULT NOW()
+        )
+        """
+    ]),
+    (2, "indexes for hot lookup paths", [
+        # show_events: активные мероприятия по дате
+        """
+        CREATE INDEX IF NOT EXISTS idx_events_active_date
+            ON events (date_start, event_id) WHERE status = 'active'
+        """,
+        # restore_reminder_schedule: предстоящие мероприятия
+        """
+        CREATE INDEX IF NOT EXISTS idx_events_date_start ON events (date_start)
+        """,
+        # list_pending_users: заявки, ожидающие модерации
+        """
+        CREATE INDEX IF NOT EXISTS idx_users_pending
+            ON users (registration_date, user_id) WHERE status = 'pending'
+        """,
+        # участники мероприятия по статусу брони
+        """
+        CREATE INDEX IF NOT EXISTS idx_event_participants_event_status
+            ON event_participants (event_id, booking_status)
+        """,
+        """
+        CREATE INDEX IF NOT EXISTS idx_chats_event_id ON chats (event_id)
+        """
+    ]),
+    (3, "one reminder per participant", [
+        """
+        CREATE UNIQUE INDEX IF NOT EXISTS idx_notifications_reminder
+            ON notifications (user_id, event_id) WHERE type = 'reminder'
+        """
+    ]),
+    (4, "conversation persistence", [
+        """
+        CREATE TABLE IF NOT EXISTS bot_persistence (
+            kind TEXT NOT NULL,
+            key TEXT NOT NULL,
+            data JSONB NOT NULL,
+            updated_at TIMESTAMP DEFAULT NOW(),
+            PRIMARY KEY (kind, key)
+        )
+        """
+    ]),
+    (5, "notification outbox", [
+        """
+        ALTER TABLE notifications
+            ADD COLUMN IF NOT EXISTS payload JSONB,
+            ADD COLUMN IF NOT EXISTS attempts INTEGER NOT NULL DEFAULT 0,
+            ADD COLUMN IF NOT EXISTS claimed_until TIMESTAMP,
+            ADD COLUMN IF NOT EXISTS last_error TEXT
+        """,
+        """
+        CREATE INDEX IF NOT EXISTS idx_notifications_outbox
+            ON notifications (notification_id) WHERE NOT is_sent
+        """
+    ]),
+    (6, "resumable broadcasts", [
+        """
+        CREATE TABLE IF NOT EXISTS broadcasts (
+            broadcast_id SERIAL PRIMARY KEY,
+            message TEXT NOT NULL,
+            created_by BIGINT NOT NULL,
+            status TEXT NOT NULL DEFAULT 'running',
+            last_user_id BIGINT NOT NULL DEFAULT 0,
+            delivered INTEGER NOT NULL DEFAULT 0,
+            blocked INTEGER NOT NULL DEFAULT 0,
+            failed INTEGER NOT NULL DEFAULT 0,
+            created_at TIMESTAMP DEFAULT NOW(),
+            finished_at TIMESTAMP
+        )
+        """,
+        # Получатели рассылки: одобренные пользователи по возрастанию user_id
+        """
+        CREATE INDEX IF NOT EXISTS idx_users_approved ON users (user_id) WHERE status = 'approved'
+        """
+    ]),
+    (7, "occupancy counters maintained by triggers", [
+        # current_participants — занятые места (все брони, кроме листа ожидания)
         """
+        ALTER TABLE events
+            ADD COLUMN IF NOT EXISTS pending_participants INTEGER NOT NULL DEFAULT 0,
+            ADD COLUMN IF NOT EXISTS confirmed_participants INTEGER NOT NULL DEFAULT 0,
+            ADD COLUMN IF NOT EXISTS paid_participants INTEGER NOT NULL DEFAULT 0
+        """,
+        """
+        CREATE OR REPLACE FUNCTION event_occupancy_add(
+            p_event_id INTEGER, p_booking_status TEXT, p_payment_status TEXT, p_sign INTEGER
+        ) RETURNS void AS $$
+            UPDATE events
+            SET current_participants = current_participants
+                    + p_sign * (p_booking_status <> 'waitlist')::int,
+                pending_participants = pending_participants
+                    + p_sign * (p_booking_status = 'pending')::int,
+                confirmed_participants = confirmed_participants
+                    + p_sign * (p_booking_status = 'confirmed')::int,
+                paid_participants = paid_participants
+                    + p_sign * (COALESCE(p_payment_status, '') = 'paid')::int
+            WHERE event_id = p_event_id
+        $$ LANGUAGE sql
+        """,
+        """
+        CREATE OR REPLACE FUNCTION event_participants_occupancy() RETURNS trigger AS $$
+        BEGIN
+            IF TG_OP <> 'INSERT' THEN
+                PERFORM event_occupancy_add(OLD.event_id, OLD.booking_status, OLD.payment_status, -1);
+            END IF;
+            IF TG_OP <> 'DELETE' THEN
+                PERFORM event_occupancy_add(NEW.event_id, NEW.booking_status, NEW.payment_status, 1);
+            END IF;
+            RETURN NULL;
+        END
+        $$ LANGUAGE plpgsql
+        """,
+        """
+        DROP TRIGGER IF EXISTS event_participants_occupancy_change ON event_participants
+        """,
+        """
+        CREATE TRIGGER event_participants_occupancy_change
+            AFTER INSERT OR DELETE ON event_participants
+            FOR EACH ROW EXECUTE FUNCTION event_participants_occupancy()
+        """,
+        """
+        DROP TRIGGER IF EXISTS event_participants_occupancy_update ON event_participants
+        """,
+        # Смена booking_date и прочих полей счётчики не трогает
+        """
+        CREATE TRIGGER event_participants_occupancy_update
+            AFTER UPDATE OF event_id, booking_status, payment_status ON event_participants
+            FOR EACH ROW
+            WHEN (OLD.event_id IS DISTINCT FROM NEW.event_id
+                  OR OLD.booking_status IS DISTINCT FROM NEW.booking_status
+                  OR OLD.payment_status IS DISTINCT FROM NEW.payment_status)
+            EXECUTE FUNCTION event_participants_occupancy()
+        """,
+        """
+        UPDATE events SET current_participants = 0 WHERE current_participants IS NULL
+        """,
+        """
+        ALTER TABLE events
+            ALTER COLUMN current_participants SET NOT NULL
+        """,
+        RECONCILE_OCCUPANCY_SQL,
+    ]),
+    (8, "broadcast claims", [
+        # Рассылку ведёт один воркер: claimed_by — его метка, claimed_until — срок аренды
+        """
+        ALTER TABLE broadcasts
+            ADD COLUMN IF NOT EXISTS claimed_by TEXT,
+            ADD COLUMN IF NOT EXISTS claimed_until TIMESTAMP
+        """
+    ]),
+]
+
+
+SCHEMA_VERSION = MIGRATIONS[-1][0]
+
+
+def current_schema_version(cursor) -> int:
+    """Reads schema_version without the migration lock; 0 on an empty database."""
+    cursor.execute("SELECT to_regclass('schema_version') IS NOT NULL")
+    if not cursor.fetchone()[0]:
+        return 0
+    cursor.execute("SELECT version FROM schema_version")
+    row = cursor.fetchone()
+    return row[0] if row else 0
+
+
+def apply_migrations(cursor) -> int:
+    """Applies pending migrations and returns the resulting schema version."""
+    # Несколько процессов не должны применять миграции одновременно
+    cursor.execute("SELECT pg_advisory_xact_lock(%s)", (MIGRATION_LOCK_ID,))
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS schema_version (
+            id BOOLEAN PRIMARY KEY DEFAULT TRUE CHECK (id),
+            version INTEGER NOT NULL,
+            updated_at TIMESTAMP DEFAULT NOW()
         )
+    """)
+    cursor.execute("SELECT version FROM schema_version")
+    row = cursor.fetchone()
+    version = row[0] if row else 0
+
+    for migration_version, description, statements in MIGRATIONS:
+        if migration_version <= version:
+            continue
+        for statement in statements:
+            cursor.execute(statement)
+        cursor.execute("""
+            INSERT INTO schema_version (id, version) VALUES (TRUE, %s)
+            ON CONFLICT (id) DO UPDATE SET version = EXCLUDED.version, updated_at = NOW()
+        """, (migration_version,))
+        logger.info(f"Applied migration {migration_version}: {description}")
+        version = migration_version
+    return version
 
-        conn.commit()
-        print("Database initialized.")
+
+# --- Инициализация базы данных ---
+def db_connect_kwargs() -> dict:
+    return dict(host=DATABASE_HOST, user=DATABASE_USER, password=DATABASE_PASSWORD,
+                database=DATABASE_NAME, cursor_factory=ProfilingCursor)
+
+
+def init_db():
+    """Opens the pool with a single connection and migrates the schema if it is behind.
+
+    The rest of the pool is opened by connection_pool.warm() once the bot is running.
+    """
+    global connection_pool
+    with startup.stage("db connect"):
+        connection_pool = ConnectionPool(
+            DB_POOL_MIN, DB_POOL_MAX,
+            acquire_timeout=DB_POOL_ACQUIRE_TIMEOUT,
+            max_lifetime=DB_POOL_MAX_LIFETIME,
+            validate_idle=DB_POOL_VALIDATE_IDLE,
+            prefill=False,
+            **db_connect_kwargs()
+        )
+        connection_pool.warm(1)
+
+    try:
+        with startup.stage("schema"):
+            # Обычный запуск: схема актуальна, DDL и блокировка миграций не нужны
+            version = _run_in_transaction(current_schema_version)
+            if version < SCHEMA_VERSION:
+                version = _run_in_transaction(apply_migrations)
+        logger.info(f"Database initialized, schema version {version}.")
     except psycopg2.Error as e:
         logger.error(f"DB init error: {e}")
-    finally:
-        if cursor:
-            cursor.close()
-        if conn:
-            return_db_connection(conn)
 
 
 # --- Функции для работы с базой данных ---
 def get_db_connection():
-    return connection_pool.getconn()
+    started = time.perf_counter()
+    try:
+        return connection_pool.getconn()
+    finally:
+        metrics.observe("bot_db_pool_wait_seconds", time.perf_counter() - started)
 
 
 def return_db_connection(conn):
     connection_pool.putconn(conn)  # Ускоряем работу запросов, очищая коннекты
 
 
+def _run_in_transaction(callback, *args):
+    """Runs callback(cursor, *args) inside one transaction on a pooled connection."""
+    conn = get_db_connection()
+    started = time.perf_counter()
+    try:
+        with conn.cursor() as cursor:
+            result = callback(cursor, *args)
+        conn.commit()
+        return result
+    except Exception:
+        metrics.inc("bot_db_errors_total", query=callback.__name__)
+        if not conn.closed:
+            conn.rollback()
+        raise
+    finally:
+        metrics.observe("bot_db_query_duration_seconds", time.perf_counter() - started,
+                        query=callback.__name__)
+        return_db_connection(conn)
+
+
+async def run_db(callback, *args):
+    """Runs callback(cursor, *args) in a transaction on the DB thread pool."""
+    loop = asyncio.get_running_loop()
+    # Контекст копируется, чтобы запросы в потоке знали свой обработчик
+    context = contextvars.copy_context()
+    return await loop.run_in_executor(
+        db_executor, functools.partial(context.run, _run_in_transaction, callback, *args)
+    )
+
+
+def _execute(cursor, sql, params):
+    cursor.execute(sql, params)
+    return cursor.rowcount
+
+
+def _fetchone(cursor, sql, params):
+    cursor.execute(sql, params)
+    return cursor.fetchone()
+
+
+def _fetchall(cursor, sql, params):
+    cursor.execute(sql, params)
+    return cursor.fetchall()
+
+
+async def db_execute(sql, params=None) -> int:
+    """Executes a statement and returns the number of affected rows."""
+    return await run_db(_execute, sql, params)
+
+
+async def db_fetchone(sql, params=None):
+    """Executes a query and returns its first row (or None)."""
+    return await run_db(_fetchone, sql, params)
+
+
+async def db_fetchall(sql, params=None):
+    """Executes a query and returns all rows."""
+    return await run_db(_fetchall, sql, params)
+
+
+_stream_ids = itertools.count(1)
+
+
+def _close_stream(conn, cursor):
+    try:
+        cursor.close()
+        conn.rollback()
+    except psycopg2.Error as e:
+        logger.error(f"DB error: {e}")
+    finally:
+        return_db_connection(conn)
+
+
+async def stream_query(sql, params=None, itersize=DB_STREAM_ITERSIZE):
+    """Yields the rows of a query from a server-side cursor, itersize rows per fetch.
+
+    The pooled connection and its transaction are held until the generator is
+    exhausted or closed, so the rows should be consumed promptly.
+    """
+    loop = asyncio.get_running_loop()
+    context = contextvars.copy_context()
+
+    def call(func, *args):
+        return loop.run_in_executor(db_executor, functools.partial(context.run, func, *args))
+
+    conn = await call(get_db_connection)
+    cursor = conn.cursor(name=f"stream_{next(_stream_ids)}")
+    fetch_time = 0.0
+    try:
+        await call(cursor.execute, sql, params)
+        while True:
+            started = time.perf_counter()
+            rows = await call(cursor.fetchmany, itersize)
+            fetch_time += time.perf_counter() - started
+            if not rows:
+                break
+            for row in rows:
+                yield row
+        await call(query_profiler.record, cursor, sql, params, fetch_time)
+    except Exception:
+        metrics.inc("bot_db_errors_total", query="stream_query")
+        raise
+    finally:
+        metrics.observe("bot_db_query_duration_seconds", fetch_time, query="stream_query")
+        await call(_close_stream, conn, cursor)
+
+
+# --- Очередь уведомлений ---
+# Уведомления пользователям записываются в notifications в той же транзакции,
+# что и изменение состояния, а отправляет их фоновый NotificationOutbox.
+def notification_payload(reply_markup=None, parse_mode=None) -> Json:
+    """Send options stored with a notification (notifications.payload)."""
+    payload = {}
+    if reply_markup:
+        payload["reply_markup"] = reply_markup.to_dict()
+    if parse_mode:
+        payload["parse_mode"] = parse_mode
+    return Json(payload or None)
+
+
+def enqueue_notifications(cursor, user_ids, message, notification_type, event_id=None,
+                          reply_markup=None, parse_mode=None) -> None:
+    """Queues the same message for several users within the caller's transaction."""
+    payload = notification_payload(reply_markup, parse_mode)
+    execute_values(cursor, """
+        INSERT INTO notifications (user_id, event_id, message, type, payload)
+        VALUES %s
+    """, [(user_id, event_id, message, notification_type, payload) for user_id in user_ids])
+
+
+def enqueue_notification(cursor, user_id, message, notification_type, event_id=None,
+                         reply_markup=None, parse_mode=None) -> None:
+    """Queues a message for one user within the caller's transaction."""
+    enqueue_notifications(cursor, [user_id], message, notification_type, event_id,
+                          reply_markup, parse_mode)
+
+
+def claim_notifications(cursor, limit):
+    """Leases up to `limit` due notifications; rows locked by other workers are skipped."""
+    cursor.execute("""
+        UPDATE notifications n
+        SET claimed_until = NOW() + make_interval(secs => %s), attempts = n.attempts + 1
+        WHERE n.notification_id IN (
+            SELECT notification_id FROM notifications
+            WHERE NOT is_sent AND attempts < %s
+              AND (claimed_until IS NULL OR claimed_until < NOW())
+            ORDER BY notification_id
+            LIMIT %s
+            FOR UPDATE SKIP LOCKED
+        )
+        RETURNING n.notification_id, n.user_id, n.message, n.payload
+    """, (OUTBOX_LEASE, OUTBOX_MAX_ATTEMPTS, limit))
+    return cursor.fetchall()
+
+
+def complete_notifications(cursor, sent_ids, failures):
+    """Marks delivered notifications and schedules retries for failed ones.
+
+    failures is a list of (notification_id, error, permanent); permanent
+    failures (blocked bot, bad request) are not retried.
+    """
+    if sent_ids:
+        cursor.execute("""
+            UPDATE notifications SET is_sent = TRUE, claimed_until = NULL, last_error = NULL
+            WHERE notification_id = ANY(%s)
+        """, (sent_ids,))
+    for notification_id, error, permanent in failures:
+        cursor.execute("""
+            UPDATE notifications
+            SET last_error = %s,
+                attempts = CASE WHEN %s THEN %s ELSE attempts END,
+                claimed_until = NOW() + make_interval(secs => %s * attempts)
+            WHERE notification_id = %s
+        """, (error, permanent, OUTBOX_MAX_ATTEMPTS, OUTBOX_RETRY_DELAY, notification_id))
+
+
+class NotificationOutbox:
+    """Background worker that delivers queued notifications.
+
+    Batches are claimed with a lease, so a crashed worker's rows are picked up
+    again once the lease expires, and several workers never send the same row.
+    Messages go through the broadcaster to respect Telegram rate limits; a
+    RetryAfter wait that would outlast the lease fails the row instead, so it
+    is retried later rather than claimed and sent by another worker meanwhile.
+    wake() makes the worker poll immediately after a handler has committed.
+    """
+
+    LEASE_SHARE = 0.8  # остаток аренды оставляем на запись результатов
+
+    def __init__(self, batch_size, poll_interval):
+        self.batch_size = batch_size
+        self.poll_interval = poll_interval
+        self._wakeup = asyncio.Event()
+        self._stopping = False
+        self._task = None
+
+    def wake(self) -> None:
+        self._wakeup.set()
+
+    def start(self, bot) -> None:
+        self._stopping = False
+        self._task = asyncio.get_running_loop().create_task(self._run(bot))
+
+    async def stop(self) -> None:
+        """Stops the worker after the batch it is sending."""
+        if self._task:
+            self._stopping = True
+            self.wake()
+            await self._task
+            self._task = None
+
+    async def drain(self, bot, timeout) -> None:
+        """Stops the worker and sends what is already queued within timeout seconds.
+
+        Whatever is left stays in the table and goes out after the restart.
+        """
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + timeout
+        try:
+            await asyncio.wait_for(self.stop(), max(deadline - loop.time(), 0))
+            while deadline > loop.time():
+                claimed = await asyncio.wait_for(self.process_batch(bot), deadline - loop.time())
+                if claimed < self.batch_size:
+                    return
+        except asyncio.TimeoutError:
+            logger.warning("Outbox not drained before the shutdown deadline")
+        except (psycopg2.Error, pool.PoolError) as e:
+            logger.error(f"DB error: {e}")
+
+    async def _deliver(self, bot, row, deadline):
+        notification_id, user_id, message, payload = row
+        payload = payload or {}
+        kwargs = {}
+        if payload.get("reply_markup"):
+            kwargs["reply_markup"] = InlineKeyboardMarkup.de_json(payload["reply_markup"], bot)
+        if payload.get("parse_mode"):
+            kwargs["parse_mode"] = payload["parse_mode"]
+        await broadcaster.send(bot, user_id, message, deadline=deadline, **kwargs)
+
+    async def process_batch(self, bot) -> int:
+        """Delivers one batch; returns the number of claimed notifications."""
+        loop = asyncio.get_running_loop()
+        claimed_at = loop.time()
+        rows = await run_db(claim_notifications, self.batch_size)
+        if not rows:
+            return 0
+        deadline = claimed_at + OUTBOX_LEASE * self.LEASE_SHARE
+        results = await asyncio.gather(*(self._deliver(bot, row, deadline) for row in rows),
+                                       return_exceptions=True)
+        sent_ids, failures = [], []
+        for row, result in zip(rows, results):
+            if isinstance(result, Exception):
+                logger.error(f"Failed to deliver notification {row[0]} to {row[1]}: {result}")
+                failures.append((row[0], str(result), isinstance(result, (Forbidden, BadRequest))))
+            else:
+                sent_ids.append(row[0])
+        await run_db(complete_notifications, sent_ids, failures)
+        metrics.inc("bot_outbox_sent_total", len(sent_ids))
+        metrics.inc("bot_outbox_failed_total", len(failures))
+        return len(rows)
+
+    async def _run(self, bot):
+        current_handler.set("outbox")
+        while not self._stopping:
+            try:
+                claimed = await self.process_batch(bot)
+            except (psycopg2.Error, pool.PoolError) as e:
+                logger.error(f"DB error: {e}")
+                claimed = 0
+            if claimed >= self.batch_size:
+                continue  # очередь не пуста — сразу берём следующую пачку
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), self.poll_interval)
+            except asyncio.TimeoutError:
+                pass
+            self._wakeup.clear()
+
+
+outbox = NotificationOutbox(OUTBOX_BATCH_SIZE, OUTBOX_POLL_INTERVAL)
+
+
+# --- Массовые рассылки ---
+# Объявление всем одобренным пользователям. Получатели читаются пачками по возрастанию
+# user_id, каждая отдельным запросом, чтобы соединение не держалось, пока пачка
+# отправляется с учётом лимита; после каждой пачки в broadcasts сохраняются last_user_id
+# и счётчики, поэтому после перезапуска рассылка продолжается с места остановки
+# (пачка, прерванная до сохранения, может уйти повторно). Рассылку ведёт тот воркер,
+# который взял её в аренду (claimed_by/claimed_until); каждое сохранение продлевает
+# аренду и проходит, только пока она принадлежит этому воркеру.
+def create_broadcast(cursor, message, created_by):
+    """Creates a broadcast; returns its id and the number of recipients."""
+    cursor.execute("""
+        INSERT INTO broadcasts (message, created_by) VALUES (%s, %s)
+        RETURNING broadcast_id
+    """, (message, created_by))
+    broadcast_id = cursor.fetchone()[0]
+    cursor.execute("SELECT COUNT(*) FROM users WHERE status = 'approved'")
+    return broadcast_id, cursor.fetchone()[0]
+
+
+def claim_broadcasts(cursor, owner):
+    """Leases running broadcasts that no other worker holds; returns their rows."""
+    cursor.execute("""
+        UPDATE broadcasts b
+        SET claimed_by = %s, claimed_until = NOW() + make_interval(secs => %s)
+        WHERE b.broadcast_id IN (
+            SELECT broadcast_id FROM broadcasts
+            WHERE status = 'running'
+              AND (claimed_until IS NULL OR claimed_until < NOW() OR claimed_by = %s)
+            ORDER BY broadcast_id
+            FOR UPDATE SKIP LOCKED
+        )
+        RETURNING b.broadcast_id, b.message, b.created_by, b.last_user_id
+    """, (owner, BROADCAST_LEASE, owner))
+    return sorted(cursor.fetchall())
+
+
+def next_broadcast_recipients(cursor, last_user_id, limit):
+    """Returns up to `limit` approved user ids after `last_user_id`."""
+    cursor.execute("""
+        SELECT user_id FROM users
+        WHERE status = 'approved' AND user_id > %s
+        ORDER BY user_id
+        LIMIT %s
+    """, (last_user_id, limit))
+    return [user_id for (user_id,) in cursor.fetchall()]
+
+
+def checkpoint_broadcast(cursor, broadcast_id, owner, last_user_id, delivered, blocked, failed,
+                         finished=False, release=False):
+    """Saves progress after a chunk and renews the lease.
+
+    Returns the running totals, or None if the broadcast is now claimed by
+    another worker; `release` gives the claim up for the next leader.
+    """
+    cursor.execute("""
+        UPDATE broadcasts
+        SET last_user_id = %s,
+            delivered = delivered + %s,
+            blocked = blocked + %s,
+            failed = failed + %s,
+            status = CASE WHEN %s THEN 'finished' ELSE status END,
+            finished_at = CASE WHEN %s THEN NOW() END,
+            claimed_until = CASE WHEN %s OR %s THEN NULL
+                                 ELSE NOW() + make_interval(secs => %s) END
+        WHERE broadcast_id = %s AND claimed_by = %s
+        RETURNING delivered, blocked, failed
+    """, (last_user_id, delivered, blocked, failed, finished, finished, finished, release,
+          BROADCAST_LEASE, broadcast_id, owner))
+    return cursor.fetchone()
+
+
+class BroadcastRunner:
+    """Runs unfinished broadcasts in the background on the leader worker.
+
+    Sends go through broadcaster, so a broadcast stays within Telegram's global
+    rate limit while other notifications keep flowing. A broadcast is leased
+    to one runner at a time, so a demoted leader that is still finishing its
+    chunk and the new leader never send it together.
+    """
+
+    LEASE_SHARE = 0.8  # доля аренды, которую может занять отправка одной пачки
+
+    def __init__(self, chunk_size):
+        self.chunk_size = chunk_size
+        self.owner = f"{WORKER_ID}-{uuid.uuid4().hex[:12]}"  # метка в broadcasts.claimed_by
+        self._tasks = {}  # broadcast_id -> задача
+        self._stopping = False
+
+    async def resume(self, bot) -> None:
+        """Claims and starts every unfinished broadcast that is free or already ours."""
+        self._stopping = False
+        try:
+            rows = await run_db(claim_broadcasts, self.owner)
+        except (psycopg2.Error, pool.PoolError) as e:
+            logger.error(f"DB error: {e}")
+            return
+        for broadcast_id, message, created_by, last_user_id in rows:
+            if broadcast_id in self._tasks:
+                continue
+            if last_user_id:
+                logger.info(f"Resuming broadcast {broadcast_id} after user {last_user_id}")
+            task = asyncio.get_running_loop().create_task(
+                self._run(bot, broadcast_id, message, created_by, last_user_id)
+            )
+            self._tasks[broadcast_id] = task
+            task.add_done_callback(lambda _, key=broadcast_id: self._tasks.pop(key, None))
+
+    async def stop(self, timeout=BROADCAST_STOP_TIMEOUT) -> None:
+        """Stops running broadcasts once the current chunk is sent and saved.
+
+        A broadcast still sending after `timeout` seconds is cancelled; its
+        unsaved chunk goes out again when the broadcast is resumed.
+        """
+        self._stopping = True
+        if not self._tasks:
+            return
+        _, pending = await asyncio.wait(set(self._tasks.values()), timeout=max(timeout, 0))
+        for task in pending:
+            task.cancel()
+
+    async def _send_chunk(self, bot, user_ids, message):
+        # Пачка должна уложиться в аренду, продлённую при прошлом сохранении
+        deadline = asyncio.get_running_loop().time() + BROADCAST_LEASE * self.LEASE_SHARE
+        results = await asyncio.gather(
+            *(broadcaster.send(bot, user_id, message, deadline=deadline) for user_id in user_ids),
+            return_exceptions=True
+        )
+        delivered = blocked = failed = 0
+        for user_id, result in zip(user_ids, results):
+            if isinstance(result, Forbidden):  # пользователь заблокировал бота
+                blocked += 1
+            elif isinstance(result, Exception):
+                failed += 1
+                logger.error(f"Failed to send broadcast to {user_id}: {result}")
+            else:
+                delivered += 1
+        metrics.inc("bot_broadcast_messages_total", delivered, result="delivered")
+        metrics.inc("bot_broadcast_messages_total", blocked, result="blocked")
+        metrics.inc("bot_broadcast_messages_total", failed, result="failed")
+        return delivered, blocked, failed
+
+    async def _run(self, bot, broadcast_id, message, created_by, last_user_id):
+        current_handler.set("broadcast")
+        finished = False
+        try:
+            while not finished:
+                chunk = await run_db(next_broadcast_recipients, last_user_id, self.chunk_size)
+                counts = await self._send_chunk(bot, chunk, message)
+                if chunk:
+                    last_user_id = chunk[-1]
+                finished = len(chunk) < self.chunk_size  # неполная пачка — последняя
+                totals = await run_db(checkpoint_broadcast, broadcast_id, self.owner,
+                                      last_user_id, *counts, finished, self._stopping)
+                if totals is None or self._stopping:
+                    break
+        except (psycopg2.Error, pool.PoolError) as e:
+            logger.error(f"DB error: {e}")
+            return
+        if totals is None:
+            logger.warning(f"Broadcast {broadcast_id} is claimed by another worker, stopping")
+            return
+        if not finished:
+            return
+
+        delivered, blocked, failed = totals
+        logger.info(f"Broadcast {broadcast_id} finished: {delivered} delivered, "
+                    f"{blocked} blocked, {failed} failed")
+        try:
+            await broadcaster.send(
+                bot, created_by,
+                render("broadcast_finished", broadcast_id=broadcast_id, delivered=delivered,
+                       blocked=blocked, failed=failed)
+            )
+        except Exception as e:
+            logger.error(f"Failed to send message to {created_by}: {e}")
+
+
+broadcasts = BroadcastRunner(BROADCAST_CHUNK_SIZE)
+
+
+@instrument_job
+async def resume_broadcasts(context: CallbackContext) -> None:
+    """Job: picks up broadcasts created on other workers."""
+    await broadcasts.resume(context.bot)
+
+
+# --- Бронирование мест ---
+# Результаты попытки занять место
+BOOKING_RESERVED = "reserved"
+BOOKING_FULL = "full"
+BOOKING_DUPLICATE = "duplicate"
+BOOKING_NOT_FOUND = "not_found"
+BOOKING_WAITLISTED = "waitlisted"
+
+# Любая запись в event_participants сначала блокирует строку мероприятия: триггер
+# занятости обновит её в той же транзакции, а /reconcile берёт блокировки в том же
+# порядке, поэтому взаимных блокировок не возникает.
+
+
+def lock_event(cursor, event_id) -> None:
+    """Locks the event row before its bookings are changed."""
+    cursor.execute("SELECT 1 FROM events WHERE event_id = %s FOR UPDATE", (event_id,))
+
+
+def reserve_seat(cursor, user_id, event_id):
+    """Atomically claims a seat, creates the booking and queues payment details.
+
+    Everything happens in one statement. The event row is locked FOR UPDATE,
+    so concurrent bookings serialize on it and see the counter left by the
+    previous one; the occupancy trigger moves the counter when the booking
+    row is inserted, so max_participants can never be exceeded. The same
+    statement reports why a seat was not taken and returns what the
+    notifications need.
+
+    Returns (result, booking), where booking holds event_name, payment_required,
+    price, user_name and contacts.
+    """
+    cursor.execute("""
+        WITH event AS (
+            SELECT event_id, max_participants, current_participants,
+                   COALESCE(payment_required, FALSE) AS payment_required, price
+            FROM events
+            WHERE event_id = %(event_id)s AND status = 'active'
+            FOR UPDATE
+        ), booking AS (
+            INSERT INTO event_participants (user_id, event_id, booking_status, payment_status)
+            SELECT %(user_id)s, event_id,
+                   CASE WHEN payment_required THEN 'pending' ELSE 'confirmed' END,
+                   CASE WHEN payment_required THEN 'unpaid' ELSE 'not_required' END
+            FROM event
+            WHERE max_participants IS NULL OR current_participants < max_participants
+            ON CONFLICT (user_id, event_id) DO NOTHING
+            RETURNING event_id
+        ), payment_notice AS (
+            INSERT INTO notifications (user_id, event_id, message, type, payload)
+            SELECT %(user_id)s, event.event_id,
+                   replace(%(payment_text)s, '{price}', COALESCE(event.price, 0)::text),
+                   'payment_details', %(payment_payload)s::jsonb
+            FROM event
+            JOIN booking ON booking.event_id = event.event_id
+            WHERE event.payment_required
+        )
+        SELECT EXISTS (SELECT 1 FROM booking),
+               e.event_id IS NOT NULL,
+               -- место было, но вставку пропустил ON CONFLICT — значит, запись уже есть
+               EXISTS (SELECT 1 FROM event
+                       WHERE max_participants IS NULL OR current_participants < max_participants)
+               OR EXISTS (SELECT 1 FROM event_participants
+                          WHERE user_id = %(user_id)s AND event_id = %(event_id)s),
+               e.name, COALESCE(e.payment_required, FALSE), e.price,
+               u.first_name, u.contacts
+        FROM (VALUES (1)) AS one (x)
+        LEFT JOIN events e ON e.event_id = %(event_id)s AND e.status = 'active'
+        LEFT JOIN users u ON u.user_id = %(user_id)s
+    """, {
+        "user_id": user_id,
+        "event_id": event_id,
+        "payment_text": TEXTS["payment_details"],
+        "payment_payload": notification_payload(payment_keyboard(event_id), "HTML"),
+    })
+    reserved, found, duplicate, *details = cursor.fetchone()
+    booking = dict(zip(("event_name", "payment_required", "price", "user_name", "contacts"), details))
+
+    if reserved:
+        return BOOKING_RESERVED, booking
+    if not found:
+        return BOOKING_NOT_FOUND, booking
+    return (BOOKING_DUPLICATE if duplicate else BOOKING_FULL), booking
+
+
+def join_waitlist(cursor, user_id, event_id):
+    """Adds the user to the waitlist of a full active event.
+
+    The event row is locked first, as in reserve_seat. If a seat has freed up
+    since the waitlist button was shown, the seat is booked instead, because
+    waitlisted users are only promoted when someone cancels.
+
+    Returns (BOOKING_WAITLISTED, position), or the result of reserve_seat.
+    """
+    cursor.execute("""
+        SELECT max_participants IS NULL OR current_participants < max_participants
+        FROM events
+        WHERE event_id = %s AND status = 'active'
+        FOR UPDATE
+    """, (event_id,))
+    event = cursor.fetchone()
+    if not event:
+        return BOOKING_NOT_FOUND, None
+    if event[0]:
+        return reserve_seat(cursor, user_id, event_id)
+
+    cursor.execute("""
+        INSERT INTO event_participants (user_id, event_id, booking_status)
+        VALUES (%s, %s, 'waitlist')
+        ON CONFLICT (user_id, event_id) DO NOTHING
+        RETURNING participant_id
+    """, (user_id, event_id))
+    row = cursor.fetchone()
+    if not row:
+        return BOOKING_DUPLICATE, None
+    cursor.execute("""
+        SELECT COUNT(*) FROM event_participants
+        WHERE event_id = %s AND booking_status = 'waitlist' AND participant_id <= %s
+    """, (event_id, row[0]))
+    return BOOKING_WAITLISTED, cursor.fetchone()[0]
+
+
+def release_seat(cursor, user_id, event_id):
+    """Removes a booking and hands its seat to the first waitlisted user.
+
+    Returns (released_status, promotion), where released_status is the
+    booking_status of the removed row (None if there was none). The seat goes
+    to the promoted user if there is one, and promotion then holds what the
+    notifications need (user_id, user_name, contacts, event_name,
+    payment_required, price). The occupancy trigger keeps the counters in step.
+    """
+    cursor.execute("""
+        SELECT name, COALESCE(payment_required, FALSE), price FROM events
+        WHERE event_id = %s
+        FOR UPDATE
+    """, (event_id,))
+    event = cursor.fetchone()
+    if not event:
+        return None, None
+    event_name, payment_required, price = event
+
+    cursor.execute("""
+        DELETE FROM event_participants
+        WHERE event_id = %s AND user_id = %s
+        RETURNING booking_status
+    """, (event_id, user_id))
+    row = cursor.fetchone()
+    if not row:
+        return None, None
+    released_status = row[0]
+    if released_status == 'waitlist':
+        return released_status, None
+
+    cursor.execute("""
+        UPDATE event_participants
+        SET booking_status = CASE WHEN %(paid)s THEN 'pending' ELSE 'confirmed' END,
+            payment_status = CASE WHEN %(paid)s THEN 'unpaid' ELSE 'not_required' END,
+            booking_date = NOW()
+        WHERE participant_id = (
+            SELECT participant_id FROM event_participants
+            WHERE event_id = %(event_id)s AND booking_status = 'waitlist'
+            ORDER BY participant_id
+            LIMIT 1
+        )
+        RETURNING user_id,
+                  (SELECT first_name FROM users u WHERE u.user_id = event_participants.user_id),
+                  (SELECT contacts FROM users u WHERE u.user_id = event_participants.user_id)
+    """, {"paid": payment_required, "event_id": event_id})
+    promoted = cursor.fetchone()
+    if not promoted:
+        return released_status, None
+    return released_status, {
+        "user_id": promoted[0], "user_name": promoted[1], "contacts": promoted[2],
+        "event_name": event_name, "payment_required": payment_required, "price": price,
+    }
+
+
+# --- Постраничный вывод ---
+# Страницы выбираются по ключу (дата, id): курсор — ключ первой или последней
+# строки страницы, поэтому каждая страница — один небольшой индексный запрос.
+PAGE_NEXT = "next"
+PAGE_PREV = "prev"
+
+
+def encode_cursor(sort_value: datetime.datetime, row_id: int) -> str:
+    return f"{sort_value.isoformat()}_{row_id}"
+
+
+def decode_cursor(text: str):
+    sort_value, row_id = text.rsplit("_", 1)
+    return datetime.datetime.fromisoformat(sort_value), int(row_id)
+
+
+def fetch_keyset_page(cursor, select_sql, key_columns, direction, position, page_size, params=()):
+    """Fetches one page of `select_sql` ordered by the two `key_columns`.
+
+    select_sql must end with a WHERE clause. `position` is a decoded cursor
+    (or None for the first page); rows strictly after it (PAGE_NEXT) or before
+    it (PAGE_PREV) are returned in ascending order. Returns (rows, has_more),
+    where has_more tells whether further rows exist in `direction`.
+    """
+    params = list(params)
+    forward = direction == PAGE_NEXT
+    sql = select_sql
+    if position is not None:
+        sql += f" AND ({', '.join(key_columns)}) {'>' if forward else '<'} (%s, %s)"
+        params.extend(position)
+    order = "ASC" if forward else "DESC"
+    sql += f" ORDER BY {', '.join(f'{column} {order}' for column in key_columns)} LIMIT %s"
+    params.append(page_size + 1)
+
+    cursor.execute(sql, params)
+    rows = cursor.fetchall()
+    has_more = len(rows) > page_size
+    rows = rows[:page_size]
+    if not forward:
+        rows.reverse()
+    return rows, has_more
+
+
+def page_navigation(direction, position, has_more):
+    """Returns (has_prev, has_next) for a page fetched by fetch_keyset_page."""
+    if direction == PAGE_NEXT:
+        return position is not None, has_more
+    return has_more, True
+
+
+def fetch_events_page(cursor, direction, position):
+    return fetch_keyset_page(cursor, """
+        SELECT event_id, name, date_start, max_participants, current_participants
+        FROM events
+        WHERE status = 'active'
+    """, ("date_start", "event_id"), direction, position, EVENTS_PAGE_SIZE)
+
+
+# --- Кэш мероприятий ---
+class EventsCache:
+    """Caches pages of active events together with their rendered keyboards.
+
+    Pages are keyed by (direction, cursor) and reloaded after `ttl` seconds or
+    after invalidate(). Booking changes only patch the participant counter of
+    the affected rows via adjust_participants(), so browsing the list is
+    served without touching the DB.
+    """
+
+    def __init__(self, ttl):
+        self.ttl = ttl
+        self._pages = {}  # (direction, cursor) -> страница
+        self._generation = 0
+        self._lock = asyncio.Lock()
+
+    def _fresh_page(self, key):
+        page = self._pages.get(key)
+        if page and time.monotonic() - page["loaded_at"] < self.ttl:
+            return page
+        return None
+
+    async def _load(self, key):
+        async with self._lock:
+            page = self._fresh_page(key)
+            if page:
+                return page
+            direction, cursor_text = key
+            position = decode_cursor(cursor_text) if cursor_text else None
+            generation = self._generation
+            rows, has_more = await run_db(fetch_events_page, direction, position)
+            page = {
+                "rows": [list(row) for row in rows],
+                "navigation": page_navigation(direction, position, has_more),
+                "markup": None,
+                "loaded_at": time.monotonic(),
+            }
+            # Если во время загрузки кэш сбросили, результат может быть устаревшим
+            if generation == self._generation:
+                self._pages[key] = page
+            return page
+
+    async def get_markup(self, direction=PAGE_NEXT, cursor_text=None):
+        """Returns the keyboard for one page, or None when the page is empty."""
+        key = (direction, cursor_text)
+        page = self._fresh_page(key) or await self._load(key)
+        if not page["rows"]:
+            return None
+        if page["markup"] is None:
+            page["markup"] = render_events_keyboard(page["rows"], *page["navigation"])
+        return page["markup"]
+
+    def invalidate(self):
+        """Drops cached pages; the next request reloads them from the DB."""
+        self._generation += 1
+        self._pages = {}
+
+    def adjust_participants(self, event_id, delta):
+        """Patches the participant counter of one event on every cached page."""
+        self._generation += 1
+        for page in self._pages.values():
+            for row in page["rows"]:
+                if row[0] == event_id:
+                    row[4] += delta
+                    page["markup"] = None
+
+
+def render_events_keyboard(events, has_prev=False, has_next=False) -> InlineKeyboardMarkup:
+    keyboard = [[event_button(event_id, name, date, max_p - current_p, max_p)]
+                for event_id, name, date, max_p, current_p in events]
+
+    navigation = []
+    if has_prev:
+        first = events[0]
+        navigation.append(InlineKeyboardButton(
+            TEXTS["button_prev"], callback_data=f"events_{PAGE_PREV}_{encode_cursor(first[2], first[0])}"
+        ))
+    if has_next:
+        last = events[-1]
+        navigation.append(InlineKeyboardButton(
+            TEXTS["button_next"], callback_data=f"events_{PAGE_NEXT}_{encode_cursor(last[2], last[0])}"
+        ))
+    if navigation:
+        keyboard.append(navigation)
+
+    keyboard.append([CANCEL_BUTTON])
+    return InlineKeyboardMarkup(keyboard)
+
+
+events_cache = EventsCache(EVENTS_CACHE_TTL)
+
+
+# --- Кэш пользователей ---
+def fetch_user_profile(cursor, user_id):
+    cursor.execute("""
+        SELECT status, first_name, contacts FROM users WHERE user_id = %s
+    """, (user_id,))
+    row = cursor.fetchone()
+    return dict(zip(("status", "first_name", "contacts"), row)) if row else None
+
+
+class UserCache:
+    """Bounded LRU cache of user profiles (status, first_name, contacts).
+
+    Handlers that change a user write the new values through put() or
+    set_status(). Approved profiles live for `ttl` seconds; pending, rejected
+    and unknown users only for `short_ttl`, since their status is the one
+    that changes.
+    """
+
+    def __init__(self, max_size, ttl, short_ttl):
+        self.max_size = max_size
+        self.ttl = ttl
+        self.short_ttl = short_ttl
+        self._entries = OrderedDict()  # user_id -> (профиль или None, истекает)
+
+    def _store(self, user_id, profile):
+        approved = profile is not None and profile["status"] == "approved"
+        expires_at = time.monotonic() + (self.ttl if approved else self.short_ttl)
+        self._entries[user_id] = (profile, expires_at)
+        self._entries.move_to_end(user_id)
+        while len(self._entries) > self.max_size:
+            self._entries.popitem(last=False)
+
+    async def get(self, user_id):
+        """Returns the profile dict, or None for unregistered users."""
+        entry = self._entries.get(user_id)
+        if entry and entry[1] > time.monotonic():
+            self._entries.move_to_end(user_id)
+            return entry[0]
+        profile = await run_db(fetch_user_profile, user_id)
+        self._store(user_id, profile)
+        return profile
+
+    async def is_approved(self, user_id) -> bool:
+        profile = await self.get(user_id)
+        return profile is not None and profile["status"] == "approved"
+
+    def put(self, user_id, status, first_name, contacts):
+        self._store(user_id, {"status": status, "first_name": first_name, "contacts": contacts})
+
+    def set_status(self, user_ids, status):
+        """Updates cached users' status; users not in the cache are left to the next load."""
+        for user_id in user_ids:
+            entry = self._entries.get(user_id)
+            if entry and entry[0] is not None:
+                self._store(user_id, dict(entry[0], status=status))
+
+    def clear(self):
+        self._entries.clear()
+
+
+user_cache = UserCache(USER_CACHE_SIZE, USER_CACHE_TTL, USER_CACHE_PENDING_TTL)
+
+
+async def require_approved(update: Update) -> bool:
+    """Booking gate: returns False (and tells the user why) unless they are approved."""
+    if await user_cache.is_approved(update.effective_user.id):
+        return True
+    text = TEXTS["approval_required"]
+    if update.callback_query:
+        await update.callback_query.edit_message_text(text)
+    else:
+        await update.message.reply_text(text)
+    return False
+
+
 # Команда /start
 async def start(update: Update, context: CallbackContext) -> int:
     """Starts the conversation."""
     logger.info(f"User {update.effective_user.id} started the bot")
 
-    keyboard = [
-        [InlineKeyboardButton("Регистрация", callback_data="start_registration")]
-    ]
-
     try:
-        await update.message.reply_text(
-            "Добро пожаловать в бота для мероприятий!",
-            reply_markup=InlineKeyboardMarkup(keyboard)
-        )
+        await update.message.reply_text(TEXTS["welcome"], reply_markup=START_KEYBOARD)
         return START
     except Exception as e:
         logger.error(f"Error in start: {e}")
@@ -208,22 +2471,7 @@ async def start_registration(update: Update, context: CallbackContext) -> int:
     """Asks the user for consent to process personal data."""
     query = update.callback_query
     await query.answer()
-
-    consent_text = (
-        "Для регистрации нам потребуется обработать ваши персональные данные. \n\n"
-        "Имя и контакты - для связи.\n"
-        "Продолжая, вы соглашаетесь с нашей политикой конфиденциальности."
-    )
-
-    keyboard = [
-        [InlineKeyboardButton("Продолжить регистрацию", callback_data="continue_registration")],
-        [InlineKeyboardButton("Отмена", callback_data="cancel")]
-    ]
-
-    await query.edit_message_text(
-        consent_text,
-        reply_markup=InlineKeyboardMarkup(keyboard)
-    )
+    await query.edit_message_text(TEXTS["consent"], reply_markup=CONSENT_KEYBOARD)
     return REGISTRATION_CONSENT
 
 
@@ -232,7 +2480,7 @@ async def ask_name(update: Update, context: CallbackContext) -> int:
     """Asks the user to enter their name."""
     query = update.callback_query
     await query.answer()
-    await query.edit_message_text("Введите ваше имя и фамилию:")
+    await query.edit_message_text(TEXTS["ask_name"])
     return REGISTER_NAME
 
 
@@ -240,10 +2488,7 @@ async def ask_name(update: Update, context: CallbackContext) -> int:
 async def save_name(update: Update, context: CallbackContext) -> int:
     """Saves the user's name."""
     context.user_data["name"] = update.message.text
-    await update.message.reply_text(
-        "Введите контакты для связи (Telegram, VK или телефон): \n"
-        "Пример: Telegram: @username / +79991112233"
-    )
+    await update.message.reply_text(TEXTS["ask_contacts"])
     return REGISTER_CONTACTS
 
 
@@ -251,19 +2496,14 @@ async def save_name(update: Update, context: CallbackContext) -> int:
 async def save_contacts(update: Update, context: CallbackContext) -> int:
     """Saves the user's contact information."""
     context.user_data["contacts"] = update.message.text
-    await update.message.reply_text(
-        "Укажите ваш ник на Тесере (если есть, или нажмите /skip):"
-    )
+    await update.message.reply_text(TEXTS["ask_tesera"])
     return REGISTER_TESERA
 
 # Обработчик ника в Тесера
 async def save_tesera(update: Update, context: CallbackContext) -> int:
     """Saves the user's tesera nick."""
     context.user_data["tesera_nick"] = update.message.text
-    await update.message.reply_text(
-        "Откуда вы узнали о наших мероприятиях?\n"
-        "Пример: «От друзей», «Из группы VK»"
-    )
+    await update.message.reply_text(TEXTS["ask_source"])
     return REGISTER_SOURCE
 
 
@@ -271,10 +2511,7 @@ async def save_tesera(update: Update, context: CallbackContext) -> int:
 async def skip_tesera(update: Update, context: CallbackContext) -> int:
     """Skips the Tesera nick entry."""
     context.user_data["tesera_nick"] = None
-    await update.message.reply_text(
-        "Откуда вы узнали о наших мероприятиях?\n"
-        "Пример: «От друзей», «Из группы VK»"
-    )
+    await update.message.reply_text(TEXTS["ask_source"])
     return REGISTER_SOURCE
 
 
@@ -284,12 +2521,8 @@ async def save_registration(update: Update, context: CallbackContext) -> int:
     user_data = context.user_data
     user = update.message.from_user
 
-    conn = None
-    cursor = None
     try:
-        conn = get_db_connection()
-        cursor = conn.cursor()
-        cursor.execute("""
+        await db_execute("""
             INSERT INTO users (
                 user_id, username, first_name, contacts, tesera_nick, source, status)
                 VALUES (%s, %s, %s, %s, %s, %s, 'pending')
@@ -301,20 +2534,15 @@ async def save_registration(update: Update, context: CallbackContext) -> int:
             user_data.get("tesera_nick"),
             update.message.text
         ))
-        conn.commit()
+        user_cache.put(user.id, "pending", user_data["name"], user_data["contacts"])
         await update.message.reply_text(
-            "Регистрация завершена! Ожидайте подтверждения администратора."
+            TEXTS["registration_saved"]
         )
         await notify_admins(context, user.id, user_data["name"])
         context.user_data.clear()  # clear the user data after the conversation
     except psycopg2.Error as e:
-        await update.message.reply_text("Ошибка при сохранении данных. Попробуйте позже.")
+        await update.message.reply_text(TEXTS["save_error"])
         logger.error(f"DB error: {e}")
-    finally:
-        if cursor:
-            cursor.close()
-        if conn:
-            return_db_connection(conn)
 
     return ConversationHandler.END
 
@@ -322,90 +2550,267 @@ async def save_registration(update: Update, context: CallbackContext) -> int:
 # Уведомление админа
 async def notify_admins(context: CallbackContext, user_id: int, user_name: str) -> None:
     """Notifies administrators about a new registration."""
-    message = (
-        "⚠️ Новая заявка на регистрацию!\n"
-        f"ID: {user_id}\n"
-        f"Имя: {user_name}\n\n"
-        "Подтвердить или отклонить?"
+    broadcaster.broadcast(
+        context.bot, ADMINISTRATOR_IDS,
+        render("new_registration", user_id=user_id, user_name=user_name),
+        reply_markup=registration_review_keyboard(user_id)
     )
 
-    keyboard = [
-        [
-            InlineKeyboardButton("✅ Подтвердить", callback_data=f"approve_{user_id}"),
-            InlineKeyboardButton("❌ Отклонить", callback_data=f"reject_{user_id}")
-        ]
-    ]
-
-    for admin_id in ADMINISTRATOR_IDS:
-        try:
-            await context.bot.send_message(
-                chat_id=admin_id,
-                text=message,
-                reply_markup=InlineKeyboardMarkup(keyboard)
-            )
-        except Exception as e:
-            logger.error(f"Failed to send message to admin {admin_id}: {e}")
-
 # Команда /admin
 async def admin_menu(update: Update, context: CallbackContext) -> int:
     """Displays the admin menu."""
     user_id = update.effective_user.id
     if user_id not in ADMINISTRATOR_IDS:
-        await update.message.reply_text("🚫 Доступ запрещён.")
+        await update.message.reply_text(TEXTS["access_denied"])
         return ConversationHandler.END
 
-    keyboard = [
-        [InlineKeyboardButton("Список заявок", callback_data="list_pending")],
-        [InlineKeyboardButton("Выйти", callback_data="cancel")]
-    ]
+    if update.callback_query:  # кнопка "Назад"
+        await update.callback_query.answer()
+        await update.callback_query.edit_message_text(
+            TEXTS["admin_menu"], reply_markup=ADMIN_MENU_KEYBOARD
+        )
+    else:
+        await update.message.reply_text(TEXTS["admin_menu"], reply_markup=ADMIN_MENU_KEYBOARD)
+    return ADMIN_MENU
+
+
+async def show_db_stats(update: Update, context: CallbackContext) -> None:
+    """Shows the most expensive SQL statements; "/dbstats reset" clears the counters."""
+    if update.effective_user.id not in ADMINISTRATOR_IDS:
+        await update.message.reply_text(TEXTS["access_denied"])
+        return
+
+    if context.args and context.args[0] == "reset":
+        query_profiler.reset()
+        await update.message.reply_text(TEXTS["db_stats_reset"])
+        return
+
+    lines = []
+    for statement, entry in query_profiler.top(10):
+        lines.append(render(
+            "db_stats_entry",
+            total_ms=entry["total"] * 1000, calls=entry["calls"],
+            avg_ms=entry["total"] / entry["calls"] * 1000, max_ms=entry["max"] * 1000,
+            handlers=", ".join(entry["handlers"]), statement=statement[:200]
+        ))
+    text = render("db_stats", statements="\n\n".join(lines)) if lines else TEXTS["db_stats_empty"]
+    await update.message.reply_text(text[:4000])
+
+
+def reconcile_occupancy(cursor):
+    """Recomputes all occupancy counters; returns (event_id, name) of the corrected events."""
+    cursor.execute(RECONCILE_OCCUPANCY_SQL)
+    return cursor.fetchall()
+
+
+async def reconcile_counters(update: Update, context: CallbackContext) -> None:
+    """Recomputes event occupancy counters from the bookings: /reconcile."""
+    if update.effective_user.id not in ADMINISTRATOR_IDS:
+        await update.message.reply_text(TEXTS["access_denied"])
+        return
+
+    try:
+        fixed = await run_db(reconcile_occupancy)
+    except psycopg2.Error as e:
+        logger.error(f"DB error: {e}")
+        await update.message.reply_text(TEXTS["save_error"])
+        return
+
+    if not fixed:
+        await update.message.reply_text(TEXTS["occupancy_ok"])
+        return
+    events_cache.invalidate()
+    logger.warning(f"Occupancy counters corrected for events {[event_id for event_id, _ in fixed]}")
+    names = "\n".join(render("occupancy_fixed_entry", name=name, event_id=event_id)
+                      for event_id, name in fixed)
+    await update.message.reply_text(render("occupancy_fixed", events=names)[:4000])
+
+
+async def start_broadcast(update: Update, context: CallbackContext) -> None:
+    """Starts an announcement to all approved users: /broadcast <text>."""
+    user_id = update.effective_user.id
+    if user_id not in ADMINISTRATOR_IDS:
+        await update.message.reply_text(TEXTS["access_denied"])
+        return
+
+    parts = update.message.text.split(maxsplit=1)
+    if len(parts) < 2:
+        await update.message.reply_text(TEXTS["broadcast_usage"])
+        return
+
+    try:
+        broadcast_id, recipients = await run_db(create_broadcast, parts[1], user_id)
+    except psycopg2.Error as e:
+        logger.error(f"DB error: {e}")
+        await update.message.reply_text(TEXTS["save_error"])
+        return
+
     await update.message.reply_text(
-        "Админ-панель. Выберите действие:",
-        reply_markup=InlineKeyboardMarkup(keyboard)
+        render("broadcast_started", broadcast_id=broadcast_id, recipients=recipients)
     )
-    return ADMIN_MENU
+    # На остальных воркерах рассылку подхватит задача resume_broadcasts лидера
+    if leader.is_leader:
+        await broadcasts.resume(context.bot)
 
 
 # Просмотр заявок
+def fetch_pending_page(cursor, direction, position):
+    return fetch_keyset_page(cursor, """
+        SELECT user_id, first_name, contacts, registration_date
+        FROM users
+        WHERE status = 'pending'
+    """, ("registration_date", "user_id"), direction, position, PENDING_PAGE_SIZE)
+
+
+def set_pending_users_status(cursor, user_ids, status, message, reason=None):
+    """Moves pending users to `status` in one UPDATE and queues `message` to them.
+
+    Returns the ids actually changed.
+    """
+    cursor.execute("""
+        UPDATE users
+        SET status = %s, rejection_reason = %s
+        WHERE user_id = ANY(%s) AND status = 'pending'
+        RETURNING user_id
+    """, (status, reason, list(user_ids)))
+    changed = [row[0] for row in cursor.fetchall()]
+    enqueue_notifications(cursor, changed, message, f"registration_{status}")
+    return changed
+
+
+async def render_pending_page(query, context: CallbackContext, notice: str = "") -> None:
+    """Shows the current page of pending users with multi-select toggles.
+
+    The page anchor is kept in user_data, so toggles and bulk actions redraw
+    the same page.
+    """
+    direction, cursor_text = context.user_data.get("pending_page", [PAGE_NEXT, None])
+    position = decode_cursor(cursor_text) if cursor_text else None
+    rows, has_more = await run_db(fetch_pending_page, direction, position)
+    if not rows and position is not None:
+        direction, position = PAGE_NEXT, None
+        context.user_data["pending_page"] = [direction, None]
+        rows, has_more = await run_db(fetch_pending_page, direction, position)
+    has_prev, has_next = page_navigation(direction, position, has_more)
+
+    selected = set(context.user_data.get("pending_selected", []))
+    if not rows:
+        await query.edit_message_text(
+            (notice + "\n\n" if notice else "") + TEXTS["no_pending"],
+            reply_markup=BACK_TO_ADMIN_KEYBOARD
+        )
+        return
+
+    message = notice + "\n\n" if notice else ""
+    message += TEXTS["pending_list"]
+    keyboard = []
+    for user_id, name, contacts, _ in rows:
+        message += render("pending_entry", user_id=user_id, name=name, contacts=contacts)
+        toggle = "pending_selected" if user_id in selected else "pending_unselected"
+        keyboard.append([InlineKeyboardButton(
+            render(toggle, name=name), callback_data=f"pending_toggle_{user_id}"
+        )])
+
+    navigation = []
+    if has_prev:
+        first = rows[0]
+        navigation.append(InlineKeyboardButton(
+            TEXTS["button_prev"], callback_data=f"pending_{PAGE_PREV}_{encode_cursor(first[3], first[0])}"
+        ))
+    if has_next:
+        last = rows[-1]
+        navigation.append(InlineKeyboardButton(
+            TEXTS["button_next"], callback_data=f"pending_{PAGE_NEXT}_{encode_cursor(last[3], last[0])}"
+        ))
+    if navigation:
+        keyboard.append(navigation)
+    if selected:
+        keyboard.append([
+            InlineKeyboardButton(render("button_approve_selected", count=len(selected)),
+                                 callback_data="pending_approve"),
+            InlineKeyboardButton(render("button_reject_selected", count=len(selected)),
+                                 callback_data="pending_reject")
+        ])
+    keyboard.append([_button("button_back", "back_to_admin")])
+
+    await query.edit_message_text(message, reply_markup=InlineKeyboardMarkup(keyboard))
+
+
 async def list_pending_users(update: Update, context: CallbackContext) -> int:
-    """Lists pending user registrations."""
+    """Lists pending user registrations page by page."""
     query = update.callback_query
     await query.answer()
+    if query.from_user.id not in ADMINISTRATOR_IDS:
+        return ConversationHandler.END
 
-    conn = None
-    cursor = None
+    if query.data == "list_pending":
+        context.user_data["pending_page"] = [PAGE_NEXT, None]
+    else:
+        _, direction, cursor_text = query.data.split("_", 2)  # "pending_next_<cursor>"
+        context.user_data["pending_page"] = [direction, cursor_text]
     try:
-        conn = get_db_connection()
-        cursor = conn.cursor()
-        cursor.execute("""
-            SELECT user_id, first_name, contacts
-            FROM users
-            WHERE status = 'pending'
-        """)
-        pending_users = cursor.fetchall()
+        await render_pending_page(query, context)
+    except psycopg2.Error as e:
+        logger.error(f"DB error: {e}")
+        await query.edit_message_text(TEXTS["load_error"])
 
-        if not pending_users:
-            await query.edit_message_text("Нет заявок на регистрацию.")
-            return ADMIN_MENU
+    return ADMIN_MENU
 
-        message = "📝 Список заявок:\n\n"
-        for user_id, name, contacts in pending_users:
-            message += f"ID: {user_id}\nИмя: {name}\nКонтакты: {contacts}\n\n"
 
-        await query.edit_message_text(
-            message,
-            reply_markup=InlineKeyboardMarkup([
-                [InlineKeyboardButton("Назад", callback_data="back_to_admin")]
-            ])
-        )
+async def toggle_pending_user(update: Update, context: CallbackContext) -> int:
+    """Adds a pending user to the bulk selection or removes them from it."""
+    query = update.callback_query
+    await query.answer()
+    if query.from_user.id not in ADMINISTRATOR_IDS:
+        return ConversationHandler.END
+
+    user_id = int(query.data.split("_")[2])  # "pending_toggle_123"
+    selected = context.user_data.setdefault("pending_selected", [])
+    if user_id in selected:
+        selected.remove(user_id)
+    else:
+        selected.append(user_id)
+
+    try:
+        await render_pending_page(query, context)
     except psycopg2.Error as e:
         logger.error(f"DB error: {e}")
-        await query.edit_message_text("Ошибка при загрузке данных.")
-    finally:
-        if cursor:
-            cursor.close()
-        if conn:
-            return_db_connection(conn)
+        await query.edit_message_text(TEXTS["load_error"])
+    return ADMIN_MENU
+
 
+async def moderate_selected_users(update: Update, context: CallbackContext) -> int:
+    """Approves or rejects all selected pending users at once."""
+    query = update.callback_query
+    await query.answer()
+    if query.from_user.id not in ADMINISTRATOR_IDS:
+        return ConversationHandler.END
+
+    action = query.data.split("_")[1]  # "pending_approve" / "pending_reject"
+    selected = context.user_data.get("pending_selected", [])
+    if not selected:
+        return ADMIN_MENU
+
+    try:
+        if action == "approve":
+            changed = await run_db(set_pending_users_status, selected, "approved",
+                                   TEXTS["registration_approved"])
+            notice = render("bulk_approved", count=len(changed))
+        else:
+            changed = await run_db(set_pending_users_status, selected, "rejected",
+                                   render("registration_rejected",
+                                          reason=TEXTS["default_rejection_reason"]),
+                                   TEXTS["default_rejection_reason"])
+            notice = render("bulk_rejected", count=len(changed))
+        context.user_data["pending_selected"] = []
+        user_cache.set_status(changed, "approved" if action == "approve" else "rejected")
+
+        # Уведомления отправит outbox, не задерживая ответ админу
+        outbox.wake()
+        await render_pending_page(query, context, notice)
+    except psycopg2.Error as e:
+        logger.error(f"DB error: {e}")
+        await query.edit_message_text(TEXTS["bulk_error"])
     return ADMIN_MENU
 
 
@@ -418,40 +2823,29 @@ async def approve_user(update: Update, context: CallbackContext) -> None:
     # Извлекаем user_id из callback_data (формат "approve_12345")
     user_id = int(query.data.split("_")[1])
 
-    conn = None
-    cursor = None
-    try:
-        conn = get_db_connection()
-        cursor = conn.cursor()
-
-        # Обновляем статус в базе данных
+    def approve(cursor):
+        # Обновляем статус и ставим уведомление в очередь одной транзакцией
         cursor.execute("""
             UPDATE users 
             SET status = 'approved' 
             WHERE user_id = %s
         """, (user_id,))
-        conn.commit()
+        enqueue_notification(cursor, user_id, TEXTS["registration_approved"], "registration_approved")
 
-        # Уведомляем пользователя
-        await context.bot.send_message(
-            chat_id=user_id,
-            text="🎉 Ваша регистрация подтверждена! Теперь вы можете записываться на мероприятия."
-        )
+    try:
+        await run_db(approve)
+        user_cache.set_status([user_id], "approved")
+        outbox.wake()
 
         # Редактируем сообщение с кнопками
         await query.edit_message_text(
-            text=f"✅ Пользователь {user_id} подтверждён.",
+            text=render("user_approved", user_id=user_id),
             reply_markup=None  # Убираем кнопки после нажатия
         )
 
     except Exception as e:
         logger.error(f"Ошибка при подтверждении пользователя: {e}")
-        await query.edit_message_text("❌ Ошибка при подтверждении.")
-    finally:
-        if cursor:
-            cursor.close()
-        if conn:
-            return_db_connection(conn)
+        await query.edit_message_text(TEXTS["approve_error"])
 
 
 async def reject_user_callback(update: Update, context: CallbackContext) -> int:
@@ -464,10 +2858,8 @@ async def reject_user_callback(update: Update, context: CallbackContext) -> int:
 
     # Редактируем сообщение для ввода причины
     await query.edit_message_text(
-        text="Укажите причину отказа (или отправьте /cancel):",
-        reply_markup=InlineKeyboardMarkup([
-            [InlineKeyboardButton("Энергетическая несовместимость", callback_data="default_reason")]
-        ])
+        text=TEXTS["ask_rejection_reason"],
+        reply_markup=REJECTION_REASON_KEYBOARD
     )
     return REJECT_REASON
 
@@ -478,53 +2870,44 @@ async def save_rejection_reason(update: Update, context: CallbackContext) -> int
 
     # Определяем причину (из кнопки или текстового сообщения)
     if update.callback_query and update.callback_query.data == "default_reason":
-        reason = "Энергетическая несовместимость"
+        reason = TEXTS["default_rejection_reason"]
         await update.callback_query.answer()
     else:
         reason = update.message.text
 
-    conn = None
-    cursor = None
-    try:
-        conn = get_db_connection()
-        cursor = conn.cursor()
-
-        # Обновляем статус в базе данных
+    def reject(cursor):
+        # Обновляем статус и ставим уведомление в очередь одной транзакцией
         cursor.execute("""
             UPDATE users 
             SET status = 'rejected', rejection_reason = %s 
             WHERE user_id = %s
         """, (reason, user_id))
-        conn.commit()
+        enqueue_notification(cursor, user_id, render("registration_rejected", reason=reason),
+                             "registration_rejected")
 
-        # Уведомляем пользователя
-        await context.bot.send_message(
-            chat_id=user_id,
-            text=f"❌ Ваша регистрация отклонена. Причина: {reason}"
-        )
+    try:
+        await run_db(reject)
+        user_cache.set_status([user_id], "rejected")
+        outbox.wake()
 
         # Отправляем подтверждение админу
         if update.callback_query:
             await update.callback_query.edit_message_text(
-                text=f"❌ Пользователь {user_id} отклонён. Причина: {reason}",
+                text=render("user_rejected", user_id=user_id, reason=reason),
                 reply_markup=None
             )
         else:
             await update.message.reply_text(
-                f"❌ Пользователь {user_id} отклонён. Причина: {reason}"
+                render("user_rejected", user_id=user_id, reason=reason)
             )
 
     except Exception as e:
         logger.error(f"Ошибка при отклонении пользователя: {e}")
         if update.callback_query:
-            await update.callback_query.edit_message_text("❌ Ошибка при отклонении.")
+            await update.callback_query.edit_message_text(TEXTS["reject_error"])
         else:
-            await update.message.reply_text("❌ Ошибка при отклонении.")
+            await update.message.reply_text(TEXTS["reject_error"])
     finally:
-        if cursor:
-            cursor.close()
-        if conn:
-            return_db_connection(conn)
         context.user_data.clear()
 
     return ConversationHandler.END
@@ -535,13 +2918,10 @@ async def create_event(update: Update, context: CallbackContext) -> int:
     """Starts the event creation process."""
     # Проверка прав (только админы или все пользователи?)
     if update.effective_user.id not in ADMINISTRATOR_IDS:
-        await update.message.reply_text("❌ Создавать мероприятия могут только администраторы.")
+        await update.message.reply_text(TEXTS["event_admins_only"])
         return ConversationHandler.END
 
-    await update.message.reply_text(
-        "Введите название мероприятия:\n"
-        "Пример: «Аджилити Кемп 2024»"
-    )
+    await update.message.reply_text(TEXTS["ask_event_name"])
     return EVENT_NAME
 
 
@@ -549,15 +2929,7 @@ async def create_event(update: Update, context: CallbackContext) -> int:
 async def save_event_name(update: Update, context: CallbackContext) -> int:
     """Saves the event name."""
     context.user_data["event_name"] = update.message.text
-    keyboard = [
-        [InlineKeyboardButton("Кемп", callback_data="camp")],
-        [InlineKeyboardButton("Игротека", callback_data="game_event")],
-        [InlineKeyboardButton("Другое", callback_data="other")]
-    ]
-    await update.message.reply_text(
-        "Выберите тип мероприятия:",
-        reply_markup=InlineKeyboardMarkup(keyboard)
-    )
+    await update.message.reply_text(TEXTS["ask_event_type"], reply_markup=EVENT_TYPE_KEYBOARD)
     return EVENT_TYPE
 
 
@@ -570,16 +2942,10 @@ async def save_event_type(update: Update, context: CallbackContext) -> int:
     context.user_data["event_type"] = event_type
 
     if event_type == "camp":
-        await query.edit_message_text(
-            "Введите дату и время кемпа (формат: ДД.ММ.ГГГГ ЧЧ:ММ):\n"
-            "Пример: 25.12.2025 14:00"
-        )
+        await query.edit_message_text(TEXTS["ask_camp_date"])
         return EVENT_DATE
     else:
-        await query.edit_message_text(
-            "Введите максимальное число участников (цифра):\n"
-            "Пример: 10"
-        )
+        await query.edit_message_text(TEXTS["ask_max_participants"])
         return EVENT_MAX_PARTICIPANTS
 
 
@@ -591,13 +2957,10 @@ async def save_event_date(update: Update, context: CallbackContext) -> int:
         date_obj = datetime.datetime.strptime(date_str, "%d.%m.%Y %H:%M")  # fixed bug here
         context.user_data["event_date"] = date_obj.isoformat()
 
-        await update.message.reply_text(
-            "Введите максимальное число участников: \n"
-            "Пример: 15"
-        )
+        await update.message.reply_text(TEXTS["ask_camp_max_participants"])
         return EVENT_MAX_PARTICIPANTS
     except ValueError:
-        await update.message.reply_text("Неверный формат даты. Используйте ДД.ММ.ГГГГ ЧЧ:ММ")
+        await update.message.reply_text(TEXTS["invalid_date"])
         return EVENT_DATE
 
 
@@ -607,16 +2970,13 @@ async def save_max_participants(update: Update, context: CallbackContext) -> int
     try:
         max_participants = int(update.message.text)
         if max_participants <= 0:
-            await update.message.reply_text("❌ Введите положительное число.")
+            await update.message.reply_text(TEXTS["positive_number_required"])
             return EVENT_MAX_PARTICIPANTS
         context.user_data["max_participants"] = max_participants
-        await update.message.reply_text(
-            "Добавьте описание мероприятия (или нажмите /skip):\n"
-            "Пример: «Трехдневный кемп с обучением аджилити»"
-        )
+        await update.message.reply_text(TEXTS["ask_event_description"])
         return EVENT_DESCRIPTION
     except ValueError:
-        await update.message.reply_text("❌ Введите число (например, 20).")
+        await update.message.reply_text(TEXTS["number_required"])
         return EVENT_MAX_PARTICIPANTS
 
 
@@ -624,7 +2984,7 @@ async def skip_description(update: Update, context: CallbackContext) -> int:
     """Skips the event description."""
     context.user_data["description"] = None
     # Вместо вызова confirm_event напрямую, имитируем ввод пустого описания
-    context.user_data["description"] = "Нет описания"  # или просто None
+    context.user_data["description"] = TEXTS["description_skipped"]  # или просто None
     return await confirm_event(update, context)  # Передаём update явно
 
 
@@ -632,36 +2992,23 @@ async def skip_description(update: Update, context: CallbackContext) -> int:
 async def confirm_event(update: Update, context: CallbackContext) -> int:
     """Confirms the event details before saving."""
     event_data = context.user_data
-
-    # Добавьте проверку на наличие описания
-    description = event_data.get("description", "не указано")
-
-    message = (
-        "<b>Новое мероприятие</b>\n\n"
-        f"Название: {event_data['event_name']}\n"
-        f"Тип: {event_data['event_type']}\n"
-        f"Дата: {event_data['event_date']}\n"
-        f"Макс. участников: {event_data['max_participants']}\n"
-        f"Описание: {description}"
+    message = render(
+        "event_preview",
+        name=event_data["event_name"],
+        type=event_data["event_type"],
+        date=event_data["event_date"],
+        max_participants=event_data["max_participants"],
+        description=event_data.get("description", TEXTS["no_description"])
     )
 
-    keyboard = [
-        [InlineKeyboardButton("Сохранить", callback_data="save_event")],
-        [InlineKeyboardButton("Отменить", callback_data="cancel")]
-    ]
-
     # Отправляем сообщение с кнопками
     if update.callback_query:
         await update.callback_query.edit_message_text(
-            message,
-            reply_markup=InlineKeyboardMarkup(keyboard),
-            parse_mode="HTML"
+            message, reply_markup=EVENT_CONFIRM_KEYBOARD, parse_mode="HTML"
         )
     else:
         await update.message.reply_text(
-            message,
-            reply_markup=InlineKeyboardMarkup(keyboard),
-            parse_mode="HTML"
+            message, reply_markup=EVENT_CONFIRM_KEYBOARD, parse_mode="HTML"
         )
     return EVENT_CONFIRM
 
@@ -672,77 +3019,73 @@ async def save_event_to_db(update: Update, context: CallbackContext) -> int:
     await query.answer()  # added await here
     event_data = context.user_data
 
-    conn = None
-    cursor = None
     try:
-        conn = get_db_connection()
-        cursor = conn.cursor()
-        cursor.execute("""
+        event_id, date_start = await db_fetchone("""
             INSERT INTO events (
                 name, type, date_start, max_participants, description, created_by, status)
             VALUES (%s, %s, %s, %s, %s, %s, 'active')
+            RETURNING event_id, date_start
         """, (
             event_data["event_name"], event_data["event_type"], event_data["event_date"],
             event_data["max_participants"],
             event_data.get("description"), update.effective_user.id)  # used .get()
                        )
-        conn.commit()
-        await query.edit_message_text("Мероприятие сохранено!")
+        events_cache.invalidate()
+        # Задачи напоминаний живут только на лидере, как и в ensure_event_reminder
+        if leader.is_leader:
+            schedule_event_reminder(context.job_queue, event_id, date_start)
+        await query.edit_message_text(TEXTS["event_saved"])
         context.user_data.clear()  # clear user data
     except psycopg2.Error as e:
         logger.error(f"DB error: {e}")
-        await query.edit_message_text("Ошибка при сохранении.")
-    finally:
-        if cursor:
-            cursor.close()
-        if conn:
-            return_db_connection(conn)
+        await query.edit_message_text(TEXTS["event_save_error"])
     return ConversationHandler.END
 
 
 # Просмотр мероприятий
 async def show_events(update: Update, context: CallbackContext) -> int:
     """Shows a list of active events."""
-    conn = None
-    cursor = None
     try:
-        conn = get_db_connection()
-        cursor = conn.cursor()
-        cursor.execute("""
-            SELECT event_id, name, date_start, max_participants, current_participants
-            FROM events
-            WHERE status = 'active'
-        """)
-        events = cursor.fetchall()
-
-        if not events:
-            await update.message.reply_text("🎭 Активных мероприятий нет.")
+        if not await require_approved(update):
             return ConversationHandler.END
+        markup = await events_cache.get_markup()
 
-        keyboard = []
-        for event in events:
-            event_id, name, date, max_p, current_p = event
-            free_slots = max_p - current_p
-            btn_text = f"{name} ({date.strftime('%d.%m.%Y')}) | 🆓 {free_slots}/{max_p}"
-            keyboard.append([InlineKeyboardButton(btn_text, callback_data=f"select_{event_id}")])
-
-        keyboard.append([InlineKeyboardButton("Отмена", callback_data="cancel")])
+        if markup is None:
+            await update.message.reply_text(TEXTS["no_events"])
+            return ConversationHandler.END
 
         await update.message.reply_text(
-            "📅 Выберите мероприятие:",
-            reply_markup=InlineKeyboardMarkup(keyboard)
+            TEXTS["choose_event"],
+            reply_markup=markup
         )
         return SHOW_EVENTS
 
     except psycopg2.Error as e:
         logger.error(f"DB error: {e}")
-        await update.message.reply_text("❌ Ошибка при загрузке мероприятий.")
+        await update.message.reply_text(TEXTS["events_error"])
+        return ConversationHandler.END
+
+
+async def browse_events(update: Update, context: CallbackContext) -> int:
+    """Shows the next or previous page of active events."""
+    query = update.callback_query
+    await query.answer()
+    _, direction, cursor_text = query.data.split("_", 2)  # "events_next_<cursor>"
+
+    try:
+        markup = await events_cache.get_markup(direction, cursor_text)
+        if markup is None:
+            markup = await events_cache.get_markup()
+        if markup is None:
+            await query.edit_message_text(TEXTS["no_events"])
+            return ConversationHandler.END
+
+        await query.edit_message_text(TEXTS["choose_event"], reply_markup=markup)
+        return SHOW_EVENTS
+    except psycopg2.Error as e:
+        logger.error(f"DB error: {e}")
+        await query.edit_message_text(TEXTS["events_error"])
         return ConversationHandler.END
-    finally:
-        if cursor:
-            cursor.close()
-        if conn:
-            return_db_connection(conn)
 
 
 # Выбор мероприятий
@@ -753,189 +3096,80 @@ async def select_event(update: Update, context: CallbackContext) -> int:
     event_id = int(query.data.split("_")[1])
     context.user_data["selected_event_id"] = event_id
 
-    # Проверяем, есть ли уже запись
-    conn = None
-    cursor = None
     try:
-        conn = get_db_connection()
-        cursor = conn.cursor()
-        cursor.execute("""
-            SELECT 1 FROM event_participants
-            WHERE user_id = %s AND event_id = %s
+        if not await require_approved(update):
+            return ConversationHandler.END
+        # Проверяем наличие записи и свободные места одним запросом
+        row = await db_fetchone("""
+            SELECT e.max_participants, e.current_participants,
+                   EXISTS (SELECT 1 FROM event_participants ep
+                           WHERE ep.user_id = %s AND ep.event_id = e.event_id)
+            FROM events e
+            WHERE e.event_id = %s
         """, (query.from_user.id, event_id))
-        if cursor.fetchone():
-            await query.edit_message_text("⚠️ Вы уже записаны на это мероприятие.")
+        if not row:
+            await query.edit_message_text(TEXTS["event_not_found"])
             return ConversationHandler.END
 
-        # Проверяем свободные места
-        cursor.execute("""
-            SELECT max_participants, current_participants
-            FROM events
-            WHERE event_id = %s
-        """, (event_id,))
-        max_p, current_p = cursor.fetchone()
-        if current_p >= max_p:
-            await query.edit_message_text("❌ Мест больше нет.")
+        max_p, current_p, already_booked = row
+        if already_booked:
+            await query.edit_message_text(TEXTS["already_booked"])
             return ConversationHandler.END
 
+        if current_p >= max_p:
+            await query.edit_message_text(TEXTS["event_full"], reply_markup=waitlist_keyboard(event_id))
+            return CONFIRM_BOOKING
+
         # Запрашиваем подтверждение
         await query.edit_message_text(
-            f"Подтвердите запись на мероприятие:\n\n"
-            f"Свободных мест: {max_p - current_p}/{max_p}",
-            reply_markup=InlineKeyboardMarkup([
-                [InlineKeyboardButton("✅ Подтвердить", callback_data="confirm_booking")],
-                [InlineKeyboardButton("❌ Отмена", callback_data="cancel")]
-            ])
+            render("confirm_booking", free=max_p - current_p, max_participants=max_p),
+            reply_markup=BOOKING_CONFIRM_KEYBOARD
         )
         return CONFIRM_BOOKING
 
     except psycopg2.Error as e:
         logger.error(f"DB error: {e}")
-        await query.edit_message_text("❌ Ошибка при бронировании.")
+        await query.edit_message_text(TEXTS["booking_error"])
         return ConversationHandler.END
-    finally:
-        if cursor:
-            cursor.close()
-        if conn:
-            return_db_connection(conn)
-
-
-# Подтверждение бронирования
-async def confirm_booking(update: Update, context: CallbackContext) -> int:
-    """Confirms the booking for an event."""
-    query = update.callback_query
-    await query.answer()
-    user_id = query.from_user.id
-    event_id = context.user_data["selected_event_id"]
-
-    conn = None
-    cursor = None
-    try:
-        conn = get_db_connection()
-        cursor = conn.cursor()
-        # Записываем участника
-        cursor.execute("""
-            INSERT INTO event_participants
-            (user_id, event_id, booking_status)
-            VALUES (%s, %s, 'pending')
-        """, (user_id, event_id))
-
-        # Обновляем счётчик участников
-        cursor.execute("""
-            UPDATE events
-            SET current_participants = current_participants + 1
-            WHERE event_id = %s
-        """, (event_id,))
-        conn.commit()
 
-        # Уведомляем пользователя
-        await context.bot.send_message(
-            chat_id=user_id,
-            text="🎟️ Ваша заявка принята! Ожидайте подтверждения."
-        )
-
-        # Уведомляем админа (если требуется модерация)
-        await notify_admin_about_booking(context, user_id, event_id)
-
-        await query.edit_message_text("✅ Запись завершена!")
-        context.user_data.clear()  # clear user data
-        return BOOKING_COMPLETE
-
-    except psycopg2.Error as e:
-        logger.error(f"DB error: {e}")
-        await query.edit_message_text("❌ Ошибка при сохранении.")
-        return ConversationHandler.END
-    finally:
-        if cursor:
-            cursor.close()
-        if conn:
-            return_db_connection(conn)
 
 # Уведомление админа
-async def notify_admin_about_booking(context: CallbackContext, user_id: int, event_id: int) -> None:
-    """Notifies the admin about a new booking."""
-    conn = None
-    cursor = None
-    try:
-        conn = get_db_connection()
-        cursor = conn.cursor()
-        # Получаем данные о мероприятии
-        cursor.execute("""
-            SELECT name FROM events WHERE event_id = %s
-        """, (event_id,))
-        event_name = cursor.fetchone()[0]
-
-        # Получаем данные о пользователе
-        cursor.execute("""
-                    SELECT first_name, contacts FROM users WHERE user_id = %s
-                """, (user_id,))
-        user_name, contacts = cursor.fetchone()
-
-        message = (
-            "⚠️ Новая заявка на мероприятие!\n\n"
-            f"Мероприятие: {event_name}\n"
-            f"Участник: {user_name} (ID: {user_id})\n"
-            f"Контакты: {contacts}\n\n"
-            "Подтвердить запись?"
-        )
-
-        keyboard = [
-            [InlineKeyboardButton("✅ Подтвердить", callback_data=f"approve_booking_{event_id}_{user_id}")],
-            [InlineKeyboardButton("❌ Отклонить", callback_data=f"reject_booking_{event_id}_{user_id}")]
-        ]
-
-        for admin_id in ADMINISTRATOR_IDS:
-            try:
-                await context.bot.send_message(
-                    chat_id=admin_id,
-                    text=message,
-                    reply_markup=InlineKeyboardMarkup(keyboard)
-                )
-            except Exception as e:
-                logger.error(f"Failed to send message to admin {admin_id}: {e}")
-
-    except psycopg2.Error as e:
-        logger.error(f"DB error: {e}")
-    finally:
-        if cursor:
-            cursor.close()
-        if conn:
-            return_db_connection(conn)
+async def notify_admin_about_booking(context: CallbackContext, user_id: int, event_id: int,
+                                     event_name: str, user_name: str, contacts: str) -> None:
+    """Notifies the admin about a new booking; the details come from the booking statement."""
+    broadcaster.broadcast(
+        context.bot, ADMINISTRATOR_IDS,
+        render("new_booking", event_name=event_name, user_name=user_name, user_id=user_id,
+               contacts=contacts),
+        reply_markup=booking_review_keyboard(event_id, user_id)
+    )
 
 # Подтверждение брони админом
 async def approve_booking(update: Update, context: CallbackContext) -> None:
     """Approves the booking by the admin."""
     query = update.callback_query
     await query.answer()
-    _, event_id, user_id = query.data.split("_")  # "approve_booking_123_456"
+    event_id, user_id = map(int, query.data.split("_")[2:])  # "approve_booking_123_456"
 
-    conn = None
-    cursor = None
-    try:
-        conn = get_db_connection()
-        cursor = conn.cursor()
+    def approve(cursor):
+        lock_event(cursor, event_id)
         cursor.execute("""
                     UPDATE event_participants
                     SET booking_status = 'confirmed'
                     WHERE event_id = %s AND user_id = %s
                 """, (event_id, user_id))
-        conn.commit()
+        enqueue_notification(cursor, user_id, TEXTS["booking_approved"], "booking_approved",
+                             event_id)
 
-        # Уведомляем пользователя
-        await context.bot.send_message(
-            chat_id=user_id,
-            text=f"✅ Ваша заявка на мероприятие одобрена!"
-        )
+    try:
+        await run_db(approve)
+        outbox.wake()
 
-        await query.edit_message_text(f"Заявка пользователя {user_id} подтверждена.")
+        await query.edit_message_text(render("booking_approved_admin", user_id=user_id))
+        await ensure_event_reminder(context.job_queue, event_id)
     except psycopg2.Error as e:
         logger.error(f"DB error: {e}")
-        await query.edit_message_text("❌ Ошибка при подтверждении.")
-    finally:
-        if cursor:
-            cursor.close()
-        if conn:
-            return_db_connection(conn)
+        await query.edit_message_text(TEXTS["approve_error"])
 
     # Отклонение брони админом
 
@@ -944,42 +3178,47 @@ async def reject_booking(update: Update, context: CallbackContext) -> None:
     """Rejects the booking by the admin."""
     query = update.callback_query
     await query.answer()
-    _, event_id, user_id = query.data.split("_")
+    event_id, user_id = map(int, query.data.split("_")[2:])  # "reject_booking_123_456"
+
+    def reject(cursor):
+        released_status, promotion = release_seat(cursor, user_id, event_id)
+        if released_status is None:
+            return released_status, promotion
+        enqueue_notification(cursor, user_id, TEXTS["booking_rejected"], "booking_rejected",
+                             event_id)
+        # Освободившееся место перешло первому из листа ожидания
+        if promotion:
+            enqueue_waitlist_promotion(cursor, promotion["user_id"], event_id,
+                                       promotion["payment_required"], promotion["price"])
+        return released_status, promotion
 
-    conn = None
-    cursor = None
     try:
-        conn = get_db_connection()
-        cursor = conn.cursor()
-        # Уменьшаем счётчик участников
-        cursor.execute("""
-                            UPDATE events
-                            SET current_participants = current_participants - 1
-                            WHERE event_id = %s
-                        """, (event_id,))
-
-        # Удаляем запись
-        cursor.execute("""
-                            DELETE FROM event_participants
-                            WHERE event_id = %s AND user_id = %s
-                        """, (event_id, user_id))
-        conn.commit()
-
-        # Уведомляем пользователя
-        await context.bot.send_message(
-            chat_id=user_id,
-            text="❌ Ваша заявка на мероприятие отклонена."
-        )
-
-        await query.edit_message_text(f"Заявка пользователя {user_id} отклонена.")
+        released_status, promotion = await run_db(reject)
+        if released_status is None:
+            await query.edit_message_text(render("booking_missing_admin", user_id=user_id))
+            return
+        outbox.wake()
+        if released_status != 'waitlist' and not promotion:
+            events_cache.adjust_participants(event_id, -1)
+
+        await query.edit_message_text(render("booking_rejected_admin", user_id=user_id))
+
+        if promotion and not promotion["payment_required"]:
+            await notify_admin_about_booking(context, promotion["user_id"], event_id,
+                                             promotion["event_name"], promotion["user_name"],
+                                             promotion["contacts"])
+            await ensure_event_reminder(context.job_queue, event_id)
     except psycopg2.Error as e:
         logger.error(f"DB error: {e}")
-        await query.edit_message_text("❌ Ошибка при отклонении.")
-    finally:
-        if cursor:
-            cursor.close()
-        if conn:
-            return_db_connection(conn)
+        await query.edit_message_text(TEXTS["reject_error"])
+
+
+def enqueue_waitlist_promotion(cursor, user_id: int, event_id: int,
+                               payment_required: bool, price: int) -> None:
+    """Queues the messages for a waitlisted user who has been given a seat."""
+    enqueue_notification(cursor, user_id, TEXTS["waitlist_promoted"], "waitlist_promoted", event_id)
+    if payment_required:
+        enqueue_payment_details(cursor, user_id, event_id, price)
 
     # Дорабатываем бронирование
 
@@ -991,81 +3230,94 @@ async def confirm_booking(update: Update, context: CallbackContext) -> int:
     event_id = context.user_data["selected_event_id"]
     user_id = query.from_user.id
 
-    conn = None
-    cursor = None
     try:
-        conn = get_db_connection()
-        cursor = conn.cursor()
-        cursor.execute("""
-                            SELECT payment_required, price, type
-                            FROM events
-                            WHERE event_id = %s
-                        """, (event_id,))
-        payment_required, price, event_type = cursor.fetchone()
-
-        if payment_required:
-            # Сохраняем временную запись о бронировании
-            cursor.execute("""
-                                INSERT INTO event_participants
-                                (user_id, event_id, booking_status, payment_status)
-                                VALUES (%s, %s, 'pending', 'unpaid')
-                            """, (user_id, event_id))
-
-            # Отправляем реквизиты
-            await send_payment_details(context, user_id, event_id, price)
-            await query.edit_message_text("💳 Оплатите участие, чтобы завершить бронирование.")
-        else:
-            # Бесплатное мероприятие — сразу подтверждаем
-            cursor.execute("""
-                                INSERT INTO event_participants
-                                (user_id, event_id, booking_status, payment_status)
-                                VALUES (%s, %s, 'confirmed', 'not_required')
-                            """, (user_id, event_id))
-            await query.edit_message_text("✅ Запись завершена!")
-            await notify_admin_about_booking(context, user_id, event_id)
-
-        conn.commit()
-        return BOOKING_COMPLETE
+        if not await require_approved(update):
+            return ConversationHandler.END
+        try:
+            # Одна выдача соединения и один запрос: место, бронь, реквизиты и данные для админа
+            result, booking = await run_db(reserve_seat, user_id, event_id)
+        except errors.UniqueViolation:
+            # Параллельный повторный запрос того же пользователя
+            result, booking = BOOKING_DUPLICATE, None
+        return await finish_booking(query, context, event_id, result, booking)
 
     except psycopg2.Error as e:
         logger.error(f"DB error: {e}")
-        await query.edit_message_text("❌ Ошибка при бронировании.")
+        await query.edit_message_text(TEXTS["booking_error"])
         return ConversationHandler.END
-    finally:
-        if cursor:
-            cursor.close()
-        if conn:
-            return_db_connection(conn)
 
-    # Отправка реквизитов
 
+async def finish_booking(query, context: CallbackContext, event_id: int, result, booking) -> int:
+    """Reports the result of reserve_seat to the user and notifies the admins."""
+    user_id = query.from_user.id
+    if result == BOOKING_DUPLICATE:
+        await query.edit_message_text(TEXTS["already_booked"])
+        return ConversationHandler.END
+    if result == BOOKING_NOT_FOUND:
+        await query.edit_message_text(TEXTS["event_not_found"])
+        return ConversationHandler.END
+    if result == BOOKING_FULL:
+        await query.edit_message_text(TEXTS["event_full"], reply_markup=waitlist_keyboard(event_id))
+        return CONFIRM_BOOKING
+
+    events_cache.adjust_participants(event_id, 1)
 
-async def send_payment_details(context: CallbackContext, user_id: int, event_id: int, price: int) -> None:
-    """Sends payment details to the user."""
-    payment_message = (
-        f"🔹 <b>Оплата мероприятия</b>\n\n"
-        f"Сумма: {price} ₽\n"
-        "Способ оплаты: <b>СБП</b>\n\n"
-        "➔ Реквизиты для перевода:\n"
-        "Банк: Тинькофф\n"
-        "Номер: <code>+7 (XXX) XXX-XX-XX</code>\n\n"
-        "Или переведите по ссылке: [Оплатить через СБП](https://qr.nspk.ru/...)\n\n"
-        "После оплаты нажмите кнопку ниже ⤵️"
-    )
+    if booking["payment_required"]:
+        # Реквизиты уже в очереди уведомлений
+        outbox.wake()
+        await query.edit_message_text(TEXTS["payment_required"])
+    else:
+        await query.edit_message_text(TEXTS["booking_complete"])
+        await notify_admin_about_booking(context, user_id, event_id, booking["event_name"],
+                                         booking["user_name"], booking["contacts"])
+        await ensure_event_reminder(context.job_queue, event_id)
 
-    keyboard = [
-        [InlineKeyboardButton("✅ Я оплатил", callback_data=f"confirm_payment_{event_id}")]
-    ]
+    return ConversationHandler.END
+
+
+# Лист ожидания
+async def add_to_waitlist(update: Update, context: CallbackContext) -> int:
+    """Puts the user on the waitlist of a full event, or books a seat that has freed up."""
+    query = update.callback_query
+    await query.answer()
+    event_id = int(query.data.split("_")[1])
 
     try:
-        await context.bot.send_message(
-            chat_id=user_id,
-            text=payment_message,
-            reply_markup=InlineKeyboardMarkup(keyboard),
-            parse_mode="HTML"
-        )
-    except Exception as e:
-        logger.error(f"Failed to send payment details to user {user_id}: {e}")
+        if not await require_approved(update):
+            return ConversationHandler.END
+        try:
+            result, detail = await run_db(join_waitlist, query.from_user.id, event_id)
+        except errors.UniqueViolation:
+            result, detail = BOOKING_DUPLICATE, None
+        if result != BOOKING_WAITLISTED:
+            # Место освободилось, пока висела кнопка: бронь уже оформлена
+            return await finish_booking(query, context, event_id, result, detail)
+        await query.edit_message_text(render("waitlist_joined", position=detail))
+    except psycopg2.Error as e:
+        logger.error(f"DB error: {e}")
+        await query.edit_message_text(TEXTS["booking_error"])
+    return ConversationHandler.END
+
+
+async def cancel_booking(update: Update, context: CallbackContext) -> int:
+    """Cancels the booking flow."""
+    query = update.callback_query
+    if query:
+        await query.answer()
+        await query.edit_message_text(TEXTS["booking_cancelled"])
+    else:
+        await update.message.reply_text(TEXTS["booking_cancelled"])
+    context.user_data.pop("selected_event_id", None)
+    return ConversationHandler.END
+
+    # Отправка реквизитов
+
+
+def enqueue_payment_details(cursor, user_id: int, event_id: int, price: int) -> None:
+    """Queues payment details for the user."""
+    enqueue_notification(cursor, user_id, render("payment_details", price=price),
+                         "payment_details", event_id,
+                         reply_markup=payment_keyboard(event_id), parse_mode="HTML")
 
     # Подтверждение оплаты
 
@@ -1077,82 +3329,48 @@ async def handle_payment_confirmation(update: Update, context: CallbackContext)
     event_id = int(query.data.split("_")[2])
     user_id = query.from_user.id
 
-    conn = None
-    cursor = None
     try:
-        conn = get_db_connection()
-        cursor = conn.cursor()
+        if not await require_approved(update):
+            return
         # Помечаем оплату как "ожидает проверки"
-        cursor.execute("""
+        def mark_pending(cursor):
+            lock_event(cursor, event_id)
+            cursor.execute("""
                             UPDATE event_participants
                             SET payment_status = 'pending_verification'
                             WHERE user_id = %s AND event_id = %s
                         """, (user_id, event_id))
-        conn.commit()
+
+        await run_db(mark_pending)
 
         # Уведомляем админа
         await notify_admin_about_payment(context, user_id, event_id)
-        await query.edit_message_text("🔄 Платеж отправлен на проверку. Мы уведомим вас о подтверждении.")
+        await query.edit_message_text(TEXTS["payment_sent"])
 
     except psycopg2.Error as e:
         logger.error(f"DB error: {e}")
-        await query.edit_message_text("❌ Ошибка при обработке платежа.")
-    finally:
-        if cursor:
-            cursor.close()
-        if conn:
-            return_db_connection(conn)
+        await query.edit_message_text(TEXTS["payment_error"])
 
     # Уведомление админа о платеже
 
 
 async def notify_admin_about_payment(context: CallbackContext, user_id: int, event_id: int) -> None:
     """Notifies the admin about a new payment."""
-    conn = None
-    cursor = None
     try:
-        conn = get_db_connection()
-        cursor = conn.cursor()
-        cursor.execute("""
+        event_name, price = await db_fetchone("""
                             SELECT name, price FROM events WHERE event_id = %s
                         """, (event_id,))
-        event_name, price = cursor.fetchone()
+        user_name = (await user_cache.get(user_id) or {}).get("first_name")
 
-        cursor.execute("""
-                            SELECT first_name FROM users WHERE user_id = %s
-                        """, (user_id,))
-        user_name = cursor.fetchone()[0]
-
-        message = (
-            "⚠️ Новый платеж для проверки!\n\n"
-            f"Мероприятие: {event_name}\n"
-            f"Участник: {user_name} (ID: {user_id})\n"
-            f"Сумма: {price} ₽\n\n"
-            "Подтвердить получение средств?"
+        broadcaster.broadcast(
+            context.bot, ADMINISTRATOR_IDS,
+            render("new_payment", event_name=event_name, user_name=user_name, user_id=user_id,
+                   price=price),
+            reply_markup=payment_review_keyboard(event_id, user_id)
         )
 
-        keyboard = [
-            [InlineKeyboardButton("✅ Подтвердить", callback_data=f"verify_payment_{event_id}_{user_id}")],
-            [InlineKeyboardButton("❌ Отклонить", callback_data=f"reject_payment_{event_id}_{user_id}")]
-        ]
-
-        for admin_id in ADMINISTRATOR_IDS:
-            try:
-                await context.bot.send_message(
-                    chat_id=admin_id,
-                    text=message,
-                    reply_markup=InlineKeyboardMarkup(keyboard)
-                )
-            except Exception as e:
-                logger.error(f"Failed to send message to admin {admin_id}: {e}")
-
     except psycopg2.Error as e:
         logger.error(f"DB error: {e}")
-    finally:
-        if cursor:
-            cursor.close()
-        if conn:
-            return_db_connection(conn)
 
     # Подтверждение платежа
 
@@ -1161,14 +3379,11 @@ async def verify_payment(update: Update, context: CallbackContext) -> None:
     """Verifies the payment by the admin."""
     query = update.callback_query
     await query.answer()
-    _, event_id, user_id = query.data.split("_")
+    event_id, user_id = map(int, query.data.split("_")[2:])
 
-    conn = None
-    cursor = None
-    try:
-        conn = get_db_connection()
-        cursor = conn.cursor()
+    def verify(cursor):
         # Обновляем статусы
+        lock_event(cursor, event_id)
         cursor.execute("""
                             UPDATE event_participants
                             SET
@@ -1176,51 +3391,47 @@ async def verify_payment(update: Update, context: CallbackContext) -> None:
                                 booking_status = 'confirmed'
                             WHERE user_id = %s AND event_id = %s
                         """, (user_id, event_id))
-        conn.commit()
+        enqueue_notification(cursor, user_id, TEXTS["payment_verified"], "payment_verified",
+                             event_id)
 
-        # Уведомляем пользователя
-        await context.bot.send_message(
-            chat_id=user_id,
-            text="✅ Ваш платеж подтвержден! Бронирование активно."
-        )
+    def store_chat(cursor, invite_link, rules):
+        cursor.execute("""
+                            INSERT INTO chats (event_id, invite_link, rules)
+                            VALUES (%s, %s, %s)
+                        """, (event_id, invite_link, rules))
+        # Invite to chat after payment
+        enqueue_chat_invite(cursor, user_id, event_id)
+
+    try:
+        await run_db(verify)
+        outbox.wake()
 
-        await query.edit_message_text(f"Платеж пользователя {user_id} подтвержден.")
+        await query.edit_message_text(render("payment_verified_admin", user_id=user_id))
+        await ensure_event_reminder(context.job_queue, event_id)
 
         # После подтверждения платежа:
         # Get event details
-        cursor.execute("SELECT name FROM events WHERE event_id = %s", (event_id,))
-        event_name = cursor.fetchone()[0]
+        event_name = (await db_fetchone("SELECT name FROM events WHERE event_id = %s", (event_id,)))[0]
         ADMIN_GROUP_ID = os.environ.get("ADMIN_GROUP_ID")
 
         if ADMIN_GROUP_ID:  # Only if the environment variable is set
-            chat_title = f"Чат мероприятия: {event_name}"
+            chat_title = render("chat_title", event_name=event_name)
             chat = await context.bot.create_chat_invite_link(
                 chat_id=ADMIN_GROUP_ID,  # ID группы-шаблона
                 name=chat_title
             )
-            rules = os.environ.get("CHAT_RULES", "Правила не установлены")
-            cursor.execute("""
-                            INSERT INTO chats (event_id, invite_link, rules)
-                            VALUES (%s, %s, %s)
-                        """, (event_id, chat.invite_link, rules))
-            conn.commit()
-
-            # Invite to chat after payment
-            await invite_to_chat(context, user_id, event_id)
+            rules = os.environ.get("CHAT_RULES", TEXTS["default_chat_rules"])
+            await run_db(store_chat, chat.invite_link, rules)
+            outbox.wake()
         else:
             logger.warning("ADMIN_GROUP_ID not set. Skipping chat creation")
 
     except psycopg2.Error as e:
         logger.error(f"DB error: {e}")
-        await query.edit_message_text("❌ Ошибка при подтверждении.")
+        await query.edit_message_text(TEXTS["approve_error"])
     except Exception as e:
         logger.error(f"Telegram API error: {e}")
-        await query.edit_message_text("❌ Ошибка Telegram.")
-    finally:
-        if cursor:
-            cursor.close()
-        if conn:
-            return_db_connection(conn)
+        await query.edit_message_text(TEXTS["telegram_error"])
 
     # Отклонение платежа
 
@@ -1229,163 +3440,208 @@ async def reject_payment(update: Update, context: CallbackContext) -> None:
     """Rejects the payment by the admin."""
     query = update.callback_query
     await query.answer()
-    _, event_id, user_id = query.data.split("_")
+    event_id, user_id = map(int, query.data.split("_")[2:])
 
-    conn = None
-    cursor = None
-    try:
-        conn = get_db_connection()
-        cursor = conn.cursor()
+    def reject(cursor):
         # Возвращаем статус "не оплачено"
+        lock_event(cursor, event_id)
         cursor.execute("""
                             UPDATE event_participants
                             SET payment_status = 'rejected'
                             WHERE user_id = %s AND event_id = %s
                         """, (user_id, event_id))
-        conn.commit()
+        enqueue_notification(cursor, user_id, TEXTS["payment_rejected"], "payment_rejected",
+                             event_id)
 
-        # Уведомляем пользователя
-        await context.bot.send_message(
-            chat_id=user_id,
-            text="❌ Платеж не подтвержден. Пожалуйста, свяжитесь с администратором."
-        )
+    try:
+        await run_db(reject)
+        outbox.wake()
 
-        await query.edit_message_text(f"Платеж пользователя {user_id} отклонен.")
+        await query.edit_message_text(render("payment_rejected_admin", user_id=user_id))
     except psycopg2.Error as e:
         logger.error(f"DB error: {e}")
-        await query.edit_message_text("❌ Ошибка при отклонении.")
-    finally:
-        if cursor:
-            cursor.close()
-        if conn:
-            return_db_connection(conn)
+        await query.edit_message_text(TEXTS["reject_error"])
 
     # Приглашение в чат
 
 
-async def invite_to_chat(context: CallbackContext, user_id: int, event_id: int) -> None:
-    """Invites a user to the event chat."""
-    conn = None
-    cursor = None
-    try:
-        conn = get_db_connection()
-        cursor = conn.cursor()
-        cursor.execute("""
-                            SELECT invite_link FROM chats WHERE event_id = %s
-                        """, (event_id,))
-        invite_link = cursor.fetchone()[0]
+def enqueue_chat_invite(cursor, user_id: int, event_id: int) -> None:
+    """Queues an invitation to the event chat."""
+    cursor.execute("""
+                        SELECT invite_link FROM chats WHERE event_id = %s
+                        ORDER BY chat_id DESC LIMIT 1
+                    """, (event_id,))
+    invite_link = cursor.fetchone()[0]
 
-        await context.bot.send_message(
-            chat_id=user_id,
-            text=f"🔹 Вы подтверждены на мероприятие!\n"
-                 f"Присоединяйтесь к чату: {invite_link}\n\n"
-                 "Правила чата: ..."
-        )
+    enqueue_notification(cursor, user_id, render("chat_invite", invite_link=invite_link),
+                         "chat_invite", event_id)
+
+    # Проверка предстоящих событий
+
+
+def reminder_job_name(event_id: int) -> str:
+    return f"reminder_{event_id}"
+
+
+def schedule_event_reminder(job_queue: JobQueue, event_id: int,
+                            date_start: datetime.datetime) -> None:
+    """Schedules the reminder job for an event, replacing an existing one."""
+    if not job_queue:
+        return
+    for job in job_queue.get_jobs_by_name(reminder_job_name(event_id)):
+        job.schedule_removal()
+
+    now = datetime.datetime.now()
+    if date_start <= now:
+        return
+    delay = (date_start - REMINDER_LEAD - now).total_seconds()
+    job_queue.run_once(
+        send_event_reminders, when=max(delay, 0),
+        data=event_id, name=reminder_job_name(event_id)
+    )
+
+
+async def ensure_event_reminder(job_queue: JobQueue, event_id: int) -> None:
+    """Makes sure a reminder job exists for an event with a new confirmed participant.
+
+    If the reminder already went out, a fresh job reminds only the participants
+    that have not received it yet.
+    """
+    # Задачи живут только на лидере; остальные воркеры полагаются на его пересинхронизацию
+    if not job_queue or not leader.is_leader:
+        return
+    if job_queue.get_jobs_by_name(reminder_job_name(event_id)):
+        return
+    try:
+        row = await db_fetchone("SELECT date_start FROM events WHERE event_id = %s", (event_id,))
+        if row:
+            schedule_event_reminder(job_queue, event_id, row[0])
     except psycopg2.Error as e:
         logger.error(f"DB error: {e}")
-    except Exception as e:
-        logger.error(f"Telegram API error: {e}")
-    finally:
-        if cursor:
-            cursor.close()
-        if conn:
-            return_db_connection(conn)
 
-    # Проверка предстоящих событий
 
+async def restore_reminder_schedule(job_queue: JobQueue) -> None:
+    """Rebuilds reminder jobs for all upcoming events.
+
+    Runs when a worker becomes leader and, with several workers, every
+    REMINDER_RESYNC_INTERVAL, so events and confirmations handled by other
+    workers get their reminders. Events that already have a job, or whose
+    reminder went out to every confirmed participant, are skipped.
+    """
+    if not job_queue:
+        return
+    scheduled = 0
+    now = datetime.datetime.now()
+    events = stream_query("""
+        SELECT e.event_id, e.date_start FROM events e
+        WHERE e.status = 'active' AND e.date_start > %s
+          AND (e.date_start > %s OR EXISTS (
+              SELECT 1 FROM event_participants ep
+              WHERE ep.event_id = e.event_id AND ep.booking_status = 'confirmed'
+                AND NOT EXISTS (
+                    SELECT 1 FROM notifications n
+                    WHERE n.type = 'reminder' AND n.event_id = ep.event_id
+                      AND n.user_id = ep.user_id
+                )
+          ))
+    """, (now, now + REMINDER_LEAD))
+    try:
+        async with contextlib.aclosing(events):
+            async for event_id, date_start in events:
+                if job_queue.get_jobs_by_name(reminder_job_name(event_id)):
+                    continue
+                schedule_event_reminder(job_queue, event_id, date_start)
+                scheduled += 1
+        logger.debug(f"Scheduled reminders for {scheduled} upcoming events")
+    except psycopg2.Error as e:
+        logger.error(f"DB error: {e}")
 
-async def check_upcoming_events(context: CallbackContext) -> None:
-    """Checks for upcoming events and sends reminders."""
-    conn = None
-    cursor = None  # Initialize cursor here
 
+def queue_event_reminders(cursor, event_id):
+    """Queues reminders for confirmed participants that have not had one yet.
+
+    Returns the number of queued reminders.
+    """
+    cursor.execute("""
+        SELECT e.name, e.date_start,
+               (SELECT c.invite_link FROM chats c WHERE c.event_id = e.event_id
+                ORDER BY c.chat_id DESC LIMIT 1)
+        FROM events e
+        WHERE e.event_id = %s AND e.status = 'active'
+    """, (event_id,))
+    event = cursor.fetchone()
+    if not event:
+        return 0
+    name, start_time, invite_link = event
+    message = reminder_text(name, start_time, invite_link)
+
+    # Уникальный индекс idx_notifications_reminder не даёт отправить напоминание дважды
+    cursor.execute("""
+        INSERT INTO notifications (user_id, event_id, message, type)
+        SELECT ep.user_id, ep.event_id, %s, 'reminder'
+        FROM event_participants ep
+        WHERE ep.event_id = %s AND ep.booking_status = 'confirmed'
+        ON CONFLICT (user_id, event_id) WHERE type = 'reminder' DO NOTHING
+    """, (message, event_id))
+    return cursor.rowcount
+
+
+@instrument_job
+async def send_event_reminders(context: CallbackContext) -> None:
+    """Job: queues the reminder for one event to its confirmed participants."""
+    event_id = context.job.data
     try:
-        conn = get_db_connection()
-        cursor = conn.cursor()
-        now = datetime.datetime.now()
-        cursor.execute("""
-                        SELECT e.event_id, e.name, e.date_start,
-                               c.invite_link, ep.user_id
-                        FROM events e
-                        JOIN event_participants ep ON e.event_id = ep.event_id
-                        LEFT JOIN chats c ON e.event_id = c.event_id
-                        WHERE ep.booking_status = 'confirmed'
-                          AND e.date_start BETWEEN %s AND %s + INTERVAL '1 hour'
-                    """, (now, now))
-        events = cursor.fetchall()
-
-        for event in events:
-            event_id, name, start_time, invite_link, user_id = event
-            time_left = start_time - now
-
-            if time_left.total_seconds() <= 3600:  # 1 час
-                await send_reminder(context, user_id, name, start_time, invite_link)
+        queued = await run_db(queue_event_reminders, event_id)
+        if queued:
+            outbox.wake()
+        logger.info(f"Queued {queued} reminders for event {event_id}")
 
     except psycopg2.Error as e:
         logger.error(f"DB error: {e}")
 
     except Exception as e:
-        logger.error(f"Error in check_upcoming_events: {e}")
+        logger.error(f"Error in send_event_reminders: {e}")
 
-    finally:
-        if cursor:  # Check if cursor is not None before closing
-            cursor.close()
-        if conn:
-            return_db_connection(conn)
 
-    # Отправка напоминания
+@instrument_job
+async def resync_reminders(context: CallbackContext) -> None:
+    """Job: picks up events and confirmations handled by other workers."""
+    await restore_reminder_schedule(context.job_queue)
 
 
-async def send_reminder(context: CallbackContext, user_id: int, event_name: str,
-                        start_time: datetime.datetime, invite_link: str) -> None:
-    """Sends a reminder to the user about an upcoming event."""
-    message = (
-        f"⏰ Напоминание: мероприятие «{event_name}»\n"
-        f"Начнётся через 1 час ({start_time.strftime('%H:%M')})\n\n"
-        f"Чат: {invite_link}"
-    )
-    try:
-        await context.bot.send_message(chat_id=user_id, text=message)
-    except Exception as e:
-        logger.error(f"Failed to send reminder to user {user_id}: {e}")
+def reminder_text(event_name: str, start_time: datetime.datetime, invite_link: str) -> str:
+    minutes_left = max(int((start_time - datetime.datetime.now()).total_seconds() // 60), 0)
+    message = render("reminder", event_name=event_name, minutes_left=minutes_left,
+                     start_time=start_time)
+    if invite_link:
+        message += render("reminder_chat", invite_link=invite_link)
+    return message
 
     # Правила чата
 
 
 async def send_rules(update: Update, context: CallbackContext) -> None:
     """Sends the chat rules to the user."""
-    conn = None
-    cursor = None
     try:
-        conn = get_db_connection()
-        cursor = conn.cursor()
-        cursor.execute("""
+        rules = await db_fetchone("""
                         SELECT rules FROM chats
                         WHERE event_id = (SELECT event_id FROM event_participants
                                          WHERE user_id = %s LIMIT 1)
                     """, (update.effective_user.id,))
-        rules = cursor.fetchone()
 
-        await update.message.reply_text(rules[0] if rules else "Правила не установлены.")
+        await update.message.reply_text(rules[0] if rules else TEXTS["no_chat_rules"])
     except psycopg2.Error as e:
         logger.error(f"DB error: {e}")
-        await update.message.reply_text("Произошла ошибка при получении правил чата")
+        await update.message.reply_text(TEXTS["chat_rules_error"])
     except Exception as e:
         logger.error(f"Ошибка при отправке правил: {e}")
-        await update.message.reply_text("Не удалось отправить правила чата.")
-    finally:
-        if cursor:
-            cursor.close()
-        if conn:
-            return_db_connection(conn)
+        await update.message.reply_text(TEXTS["chat_rules_send_error"])
 
 async def cancel(update: Update, context: CallbackContext) -> int:
     """Cancels and ends the conversation."""
     user = update.message.from_user
     logger.info("User %s canceled the conversation.", user.first_name)
-    await update.message.reply_text(
-        "Bye! I hope we can talk again some day.", reply_markup=ReplyKeyboardRemove()
-    )
+    await update.message.reply_text(TEXTS["bye"], reply_markup=ReplyKeyboardRemove())
     return ConversationHandler.END
 
 async def cancel_event_creation(update: Update, context: CallbackContext) -> int:
@@ -1393,18 +3649,362 @@ async def cancel_event_creation(update: Update, context: CallbackContext) -> int
     query = update.callback_query
     if query:
         await query.answer()
-        await query.edit_message_text("❌ Создание мероприятия отменено.")
+        await query.edit_message_text(TEXTS["event_creation_cancelled"])
     else:
-        await update.message.reply_text("❌ Создание мероприятия отменено.")
+        await update.message.reply_text(TEXTS["event_creation_cancelled"])
 
     # Очищаем временные данные
     context.user_data.clear()
     return ConversationHandler.END
 
-async def main():
-    """Main function to run the bot."""
-    init_db()
-    application = Application.builder().token(TOKEN).build()
+# --- Сохранение состояния бота ---
+class PostgresPersistence(BasePersistence):
+    """Stores conversation states, user_data, chat_data and bot_data in Postgres.
+
+    The Application hands over changed entries every `update_interval` seconds;
+    everything staged in one such round is written in a single transaction, so
+    persisting state costs one DB write per interval rather than per message.
+
+    With several workers only the owner of a user (see UpdateRouter) writes
+    that user's user_data and conversation states. A worker that handles
+    another worker's update after a failed forward works on its own, possibly
+    stale copy of that state, and its changes are dropped instead of
+    overwriting the owner's rows.
+    """
+
+    USER_DATA = "user_data"
+    CHAT_DATA = "chat_data"
+    BOT_DATA = "bot_data"
+    CONVERSATION = "conversation:"
+
+    def __init__(self, update_interval: float = 60, store_data: PersistenceInput = None):
+        super().__init__(
+            store_data=store_data or PersistenceInput(callback_data=False),
+            update_interval=update_interval
+        )
+        self._pending = {}  # (kind, key) -> данные или None для удаления
+        self._write_task = None
+
+    # Загрузка: строк может быть по одной на каждого пользователя, поэтому они
+    # читаются потоком, а не одним fetchall()
+    @staticmethod
+    def _load(kind):
+        return stream_query("SELECT key, data FROM bot_persistence WHERE kind = %s", (kind,))
+
+    async def get_user_data(self):
+        return {int(key): data async for key, data in self._load(self.USER_DATA)}
+
+    async def get_chat_data(self):
+        return {int(key): data async for key, data in self._load(self.CHAT_DATA)}
+
+    async def get_bot_data(self):
+        rows = [data async for _, data in self._load(self.BOT_DATA)]
+        return rows[0] if rows else {}
+
+    async def get_callback_data(self):
+        return None
+
+    async def get_conversations(self, name):
+        return {
+            tuple(json.loads(key)): state
+            async for key, state in self._load(self.CONVERSATION + name)
+        }
+
+    # Запись
+    @staticmethod
+    def _owns(user_id) -> bool:
+        return int(user_id) % WORKER_COUNT == WORKER_ID
+
+    def _stage(self, kind, key, data):
+        self._pending[(kind, str(key))] = data
+        if self._write_task is None or self._write_task.done():
+            # Задача стартует после остальных update_* текущего раунда и пишет их одной транзакцией
+            self._write_task = asyncio.get_running_loop().create_task(self._write_pending())
+
+    async def _write_pending(self):
+        pending, self._pending = self._pending, {}
+        if not pending:
+            return
+        upserts = [(kind, key, Json(data)) for (kind, key), data in pending.items()
+                   if data is not None]
+        deletes = [(kind, key) for (kind, key), data in pending.items() if data is None]
+
+        def write(cursor):
+            if upserts:
+                execute_values(cursor, """
+                    INSERT INTO bot_persistence (kind, key, data) VALUES %s
+                    ON CONFLICT (kind, key) DO UPDATE
+                    SET data = EXCLUDED.data, updated_at = NOW()
+                """, upserts)
+            if deletes:
+                execute_values(cursor, """
+                    DELETE FROM bot_persistence p
+                    USING (VALUES %s) AS d (kind, key)
+                    WHERE p.kind = d.kind AND p.key = d.key
+                """, deletes)
+
+        try:
+            await run_db(write)
+        except psycopg2.Error as e:
+            logger.error(f"Failed to persist bot state: {e}")
+            # Вернём записи в очередь, не затирая более свежие
+            for item, data in pending.items():
+                self._pending.setdefault(item, data)
+
+    async def update_user_data(self, user_id, data):
+        if self._owns(user_id):
+            self._stage(self.USER_DATA, user_id, data)
+
+    async def update_chat_data(self, chat_id, data):
+        self._stage(self.CHAT_DATA, chat_id, data)
+
+    async def update_bot_data(self, data):
+        self._stage(self.BOT_DATA, "", data)
+
+    async def update_callback_data(self, data):
+        pass
+
+    async def update_conversation(self, name, key, new_state):
+        # Ключ диалога (chat_id, user_id) заканчивается пользователем
+        if self._owns(key[-1]):
+            self._stage(self.CONVERSATION + name, json.dumps(list(key)), new_state)
+
+    async def drop_user_data(self, user_id):
+        if self._owns(user_id):
+            self._stage(self.USER_DATA, user_id, None)
+
+    async def drop_chat_data(self, chat_id):
+        self._stage(self.CHAT_DATA, chat_id, None)
+
+    async def refresh_user_data(self, user_id, user_data):
+        pass
+
+    async def refresh_chat_data(self, chat_id, chat_data):
+        pass
+
+    async def refresh_bot_data(self, bot_data):
+        pass
+
+    async def flush(self):
+        if self._write_task and not self._write_task.done():
+            await self._write_task
+        await self._write_pending()
+
+
+# --- Webhook ---
+class WebhookServer:
+    """Embedded aiohttp server that feeds webhook updates into the Application.
+
+    Requests must carry the X-Telegram-Bot-Api-Secret-Token header when a secret
+    is configured. Updates are put on the application's update queue and handled
+    concurrently like polled ones, so the server can be tested locally by
+    POSTing a recorded update:
+
+        curl -d @update.json -H "X-Telegram-Bot-Api-Secret-Token: $SECRET" localhost:8080/telegram
+    """
+
+    SECRET_HEADER = "X-Telegram-Bot-Api-Secret-Token"
+
+    def __init__(self, application: Application, listen: str, port: int, path: str,
+                 secret_token: str = None):
+        self.application = application
+        self.listen = listen
+        self.port = port
+        self.path = path
+        self.secret_token = secret_token
+        self._runner = None
+
+    async def handle_update(self, request: web.Request) -> web.Response:
+        if self.secret_token and not hmac.compare_digest(
+                request.headers.get(self.SECRET_HEADER, ""), self.secret_token):
+            return web.Response(status=403)
+        try:
+            update = Update.de_json(await request.json(), self.application.bot)
+        except Exception as e:
+            logger.warning(f"Rejected malformed webhook payload: {e}")
+            return web.Response(status=400)
+        await self.application.update_queue.put(update)
+        return web.Response()
+
+    async def start(self) -> None:
+        app = web.Application()
+        app.router.add_post(self.path, self.handle_update)
+        self._runner = web.AppRunner(app, access_log=None)
+        await self._runner.setup()
+        await web.TCPSite(self._runner, self.listen, self.port).start()
+        logger.info(f"Webhook server listening on {self.listen}:{self.port}{self.path}")
+
+    async def stop(self) -> None:
+        if self._runner:
+            await self._runner.cleanup()
+            self._runner = None
+
+
+# --- Несколько воркеров ---
+class LeaderElection:
+    """Elects one worker to run scheduled jobs (and to poll Telegram).
+
+    Leadership is a session-level Postgres advisory lock held on a dedicated
+    connection outside the pool. The lock is retried every `interval` seconds;
+    if the connection dies, Postgres releases the lock and another worker
+    takes over on its next check.
+    """
+
+    def __init__(self, lock_id, interval):
+        self.lock_id = lock_id
+        self.interval = interval
+        self.is_leader = False
+        self.on_elected = []  # async-колбэки
+        self.on_demoted = []
+        self._conn = None
+        self._task = None
+
+    def _check_lock(self) -> bool:
+        """Takes or verifies the lock; runs on the DB thread pool."""
+        try:
+            if self._conn is None or self._conn.closed:
+                self._conn = psycopg2.connect(**db_connect_kwargs())
+                self._conn.autocommit = True
+            # Опрос блокировки не профилируется: он не относится ни к одному обработчику
+            with self._conn.cursor(cursor_factory=extensions.cursor) as cursor:
+                if self.is_leader:
+                    cursor.execute("SELECT 1")
+                    return True
+                cursor.execute("SELECT pg_try_advisory_lock(%s)", (self.lock_id,))
+                return cursor.fetchone()[0]
+        except psycopg2.Error as e:
+            logger.error(f"Leader election DB error: {e}")
+            if self._conn is not None:
+                self._conn.close()
+                self._conn = None
+            return False
+
+    async def check(self) -> None:
+        loop = asyncio.get_running_loop()
+        is_leader = await loop.run_in_executor(db_executor, self._check_lock)
+        if is_leader == self.is_leader:
+            return
+        self.is_leader = is_leader
+        logger.info(f"Worker {WORKER_ID} {'became' if is_leader else 'is no longer'} the leader")
+        for callback in (self.on_elected if is_leader else self.on_demoted):
+            try:
+                await callback()
+            except Exception as e:
+                logger.error(f"Leadership callback {callback.__name__} failed: {e}")
+
+    async def _run(self) -> None:
+        while True:
+            await asyncio.sleep(self.interval)
+            await self.check()
+
+    async def start(self) -> None:
+        await self.check()
+        self._task = asyncio.get_running_loop().create_task(self._run())
+
+    async def stop(self) -> None:
+        if self._task:
+            # Дожидаемся отмены, чтобы колбэки смены лидерства не работали после остановки
+            self._task.cancel()
+            with contextlib.suppress(asyncio.CancelledError):
+                await self._task
+            self._task = None
+        if self._conn is not None:
+            # Закрытие сессии снимает advisory-блокировку
+            self._conn.close()
+            self._conn = None
+        self.is_leader = False
+
+
+leader = LeaderElection(LEADER_LOCK_ID, LEADER_CHECK_INTERVAL)
+update_router = None  # создаётся в build_application при WORKER_COUNT > 1
+
+
+class UpdateRouter:
+    """Sends every update to the worker that owns its user.
+
+    The owner is user_id % worker_count, so a user's conversation state and
+    user_data are only ever touched by one worker. Updates for other workers
+    are POSTed to the peer's webhook endpoint; if the peer is unreachable the
+    update is handled locally rather than dropped. The local user_data and
+    conversation state of such a user may be stale, so it is not reloaded
+    and PostgresPersistence does not save it: the owner's copy stays
+    authoritative. Updates without a user are handled where they arrive.
+    """
+
+    def __init__(self, worker_id, worker_count, peers, path, secret_token=None):
+        self.worker_id = worker_id
+        self.worker_count = worker_count
+        self.peers = peers
+        self.path = path
+        self.secret_token = secret_token
+        self._session = None
+
+    def owner(self, update: Update) -> int:
+        user = update.effective_user
+        return user.id % self.worker_count if user else self.worker_id
+
+    async def _forward(self, worker_id: int, update: Update) -> bool:
+        if self._session is None:
+            self._session = ClientSession(timeout=ClientTimeout(total=WORKER_FORWARD_TIMEOUT))
+        headers = {WebhookServer.SECRET_HEADER: self.secret_token} if self.secret_token else {}
+        try:
+            async with self._session.post(self.peers[worker_id] + self.path,
+                                          json=update.to_dict(), headers=headers) as response:
+                if response.status == 200:
+                    return True
+                logger.warning(f"Worker {worker_id} rejected update {update.update_id}: {response.status}")
+        except (ClientError, asyncio.TimeoutError) as e:
+            logger.warning(f"Failed to forward update {update.update_id} to worker {worker_id}: {e}")
+        return False
+
+    async def route(self, update: Update, context: CallbackContext) -> None:
+        """Group -100 handler: stops processing of updates owned by another worker."""
+        owner = self.owner(update)
+        if owner != self.worker_id and await self._forward(owner, update):
+            raise ApplicationHandlerStop
+
+    async def close(self) -> None:
+        if self._session is not None:
+            await self._session.close()
+            self._session = None
+
+
+def build_application(bot=None) -> Application:
+    """Builds the Application with all handlers registered.
+
+    `bot` replaces the default Bot built from TOKEN, e.g. with a stub in bench.py.
+    """
+    multi_worker = WORKER_COUNT > 1
+    if multi_worker and len(WORKER_PEERS) != WORKER_COUNT:
+        raise RuntimeError("WORKER_PEERS must list the webhook address of every worker")
+    # Без секрета любой, кто достучится до порта, может прислать поддельное обновление от админа.
+    # С несколькими воркерами webhook-сервер принимает пересланные обновления и в режиме polling.
+    if (BOT_MODE == "webhook" or multi_worker) and not WEBHOOK_SECRET:
+        raise RuntimeError("WEBHOOK_SECRET is required in webhook mode and with several workers")
+
+    # Обновления обрабатываются параллельно: запросы к БД выполняются в db_executor.
+    # С несколькими воркерами bot_data и chat_data не сохраняются: их писали бы все
+    # воркеры сразу, а user_data и диалоги принадлежат воркеру-владельцу пользователя.
+    persistence = PostgresPersistence(
+        update_interval=PERSISTENCE_FLUSH_INTERVAL,
+        store_data=PersistenceInput(bot_data=False, chat_data=False, callback_data=False)
+        if multi_worker else None
+    )
+    builder = Application.builder().concurrent_updates(True).persistence(persistence)
+    if bot is None:
+        builder = builder.token(TOKEN).request(
+            InstrumentedRequest(connection_pool_size=TELEGRAM_CONNECTION_POOL_SIZE)
+        )
+    else:
+        builder = builder.bot(bot)
+    application = builder.build()
+
+    global update_router
+    if multi_worker:
+        update_router = UpdateRouter(WORKER_ID, WORKER_COUNT, WORKER_PEERS, WEBHOOK_PATH, WEBHOOK_SECRET)
+        application.add_handler(TypeHandler(Update, update_router.route), group=-100)
+    # Ограничение частоты — после маршрутизации, но до всех обработчиков
+    application.add_handler(TypeHandler(Update, rate_limiter.check), group=-1)
 
     # Обработчик команды /start
     application.add_handler(CommandHandler("start", start))
@@ -1423,7 +4023,9 @@ async def main():
             REGISTER_SOURCE: [MessageHandler(filters.TEXT & ~filters.COMMAND, save_registration)]
         },
         fallbacks=[CommandHandler("cancel", cancel)],
-        per_message=False
+        per_message=False,
+        name="registration",
+        persistent=True
     )
     application.add_handler(registration_handler)
 
@@ -1444,31 +4046,198 @@ async def main():
                 CallbackQueryHandler(cancel_event_creation, pattern="^cancel$")
             ]
         },
-        fallbacks=[CommandHandler('cancel', cancel_event_creation)]
+        fallbacks=[CommandHandler('cancel', cancel_event_creation)],
+        name="event_creation",
+        persistent=True
     )
     application.add_handler(event_creation_handler)
 
+    # Бронирование мероприятий
+    booking_handler = ConversationHandler(
+        entry_points=[CommandHandler("events", show_events)],
+        states={
+            SHOW_EVENTS: [
+                CallbackQueryHandler(select_event, pattern=r"^select_\d+$"),
+                CallbackQueryHandler(browse_events, pattern=r"^events_(next|prev)_")
+            ],
+            CONFIRM_BOOKING: [
+                CallbackQueryHandler(confirm_booking, pattern="^confirm_booking$"),
+                CallbackQueryHandler(add_to_waitlist, pattern=r"^waitlist_\d+$")
+            ]
+        },
+        fallbacks=[
+            CallbackQueryHandler(cancel_booking, pattern="^cancel$"),
+            CommandHandler("cancel", cancel_booking)
+        ],
+        allow_reentry=True,
+        name="booking",
+        persistent=True
+    )
+    application.add_handler(booking_handler)
+    application.add_handlers([
+        CallbackQueryHandler(approve_booking, pattern=r"^approve_booking_\d+_\d+$"),
+        CallbackQueryHandler(reject_booking, pattern=r"^reject_booking_\d+_\d+$"),
+        CallbackQueryHandler(handle_payment_confirmation, pattern=r"^confirm_payment_\d+$"),
+        CallbackQueryHandler(verify_payment, pattern=r"^verify_payment_\d+_\d+$"),
+        CallbackQueryHandler(reject_payment, pattern=r"^reject_payment_\d+_\d+$")
+    ])
+
     # Обработчики админ-панели
     application.add_handler(CommandHandler("admin", admin_menu))
+    application.add_handler(CommandHandler("dbstats", show_db_stats))
+    application.add_handler(CommandHandler("broadcast", start_broadcast))
+    application.add_handler(CommandHandler("reconcile", reconcile_counters))
     admin_handlers = [
-        CallbackQueryHandler(list_pending_users, pattern="^list_pending$"),
+        CallbackQueryHandler(list_pending_users, pattern=r"^(list_pending|pending_(next|prev)_.+)$"),
+        CallbackQueryHandler(toggle_pending_user, pattern=r"^pending_toggle_\d+$"),
+        CallbackQueryHandler(moderate_selected_users, pattern=r"^pending_(approve|reject)$"),
         CallbackQueryHandler(admin_menu, pattern="^back_to_admin$"),
-        CallbackQueryHandler(approve_user, pattern="^approve_"),
-        CallbackQueryHandler(reject_user_callback, pattern="^reject_"),
+        CallbackQueryHandler(approve_user, pattern=r"^approve_\d+$"),
+        CallbackQueryHandler(reject_user_callback, pattern=r"^reject_\d+$"),
         CallbackQueryHandler(save_rejection_reason, pattern="^default_reason$")
     ]
     application.add_handlers(admin_handlers)
 
-    # Планировщик напоминаний
-    if application.job_queue:
-        application.job_queue.run_repeating(check_upcoming_events, interval=1800)
+    # Метрики: время обработчиков считается после регистрации всех обработчиков
+    instrument_handlers(application)
+    return application
+
+
+async def main():
+    """Main function to run the bot."""
+    startup.stages["imports"] = time.perf_counter() - startup.started
+    loop = asyncio.get_running_loop()
+    application = build_application()
+
+    async def get_me():
+        with startup.stage("getMe"):
+            await application.bot.initialize()
+
+    # Проверка схемы и getMe не зависят друг от друга
+    await asyncio.gather(loop.run_in_executor(db_executor, init_db), get_me())
+
+    # Лидер ведёт планировщик напоминаний (по одной задаче на мероприятие)
+    # и в режиме polling единственный получает обновления от Telegram
+    async def take_leadership():
+        await restore_reminder_schedule(application.job_queue)
+        # Один воркер сам планирует напоминания для всех новых мероприятий и записей
+        if WORKER_COUNT > 1:
+            application.job_queue.run_repeating(
+                resync_reminders, interval=REMINDER_RESYNC_INTERVAL,
+                first=REMINDER_RESYNC_INTERVAL, name="reminder_resync"
+            )
+        # Незавершённые рассылки продолжаются с последней сохранённой пачки
+        await broadcasts.resume(application.bot)
+        application.job_queue.run_repeating(
+            resume_broadcasts, interval=BROADCAST_POLL_INTERVAL,
+            first=BROADCAST_POLL_INTERVAL, name="broadcast_resume"
+        )
+        if BOT_MODE != "webhook":
+            await application.updater.start_polling()
+
+    async def give_up_leadership():
+        for job in application.job_queue.jobs():
+            job.schedule_removal()
+        await broadcasts.stop(BROADCAST_STOP_TIMEOUT)
+        if application.updater.running:
+            await application.updater.stop()
+
+    leader.on_elected.append(take_leadership)
+    leader.on_demoted.append(give_up_leadership)
+
+    # SIGTERM (перезапуск в bot.yml) и Ctrl+C запускают плавную остановку
+    stop_signal = asyncio.Event()
+    for signum in (signal.SIGTERM, signal.SIGINT):
+        try:
+            loop.add_signal_handler(signum, stop_signal.set)
+        except NotImplementedError:  # Windows: остаётся KeyboardInterrupt
+            pass
+
+    async def warm_pool():
+        try:
+            with startup.stage("pool warm-up"):
+                opened = await loop.run_in_executor(db_executor, connection_pool.warm)
+            logger.info(f"Connection pool warmed up: {opened} connections opened")
+        except psycopg2.Error as e:
+            logger.error(f"DB error: {e}")
 
     # Запуск бота
+    metrics_server = webhook_server = None
+    with startup.stage("persistence"):
+        await application.initialize()
     async with application:
         await application.start()
-        await application.updater.start_polling()
-        while True:
-            await asyncio.sleep(3600)
+        # Остальные соединения пула открываются параллельно с приёмом обновлений
+        pool_warm_up = asyncio.create_task(warm_pool())
+        outbox.start(application.bot)
+        if METRICS_PORT:
+            metrics_server = MetricsServer(METRICS_LISTEN, METRICS_PORT)
+            await metrics_server.start()
+        # Webhook-сервер нужен и в polling-режиме с несколькими воркерами: через него
+        # лидер пересылает обновления владельцам
+        if BOT_MODE == "webhook" or WORKER_COUNT > 1:
+            webhook_server = WebhookServer(
+                application, WEBHOOK_LISTEN, WEBHOOK_PORT, WEBHOOK_PATH, WEBHOOK_SECRET
+            )
+            await webhook_server.start()
+        if BOT_MODE == "webhook" and WEBHOOK_URL:
+            await application.bot.set_webhook(
+                url=WEBHOOK_URL,
+                secret_token=WEBHOOK_SECRET,
+                allowed_updates=Update.ALL_TYPES
+            )
+        await leader.start()
+        startup.log()
+
+        await stop_signal.wait()
+        await drain(application, webhook_server, metrics_server, pool_warm_up)
+    # Выход из контекста вызывает application.shutdown(), который сбрасывает persistence;
+    # пул соединений закрывается после этого, в __main__
+
+
+async def drain(application: Application, webhook_server, metrics_server, pool_warm_up=None) -> None:
+    """Stops taking updates and lets the work already accepted finish before SHUTDOWN_TIMEOUT."""
+    loop = asyncio.get_running_loop()
+    deadline = loop.time() + SHUTDOWN_TIMEOUT
+    logger.info(f"Shutting down, draining for up to {SHUTDOWN_TIMEOUT:.0f}s")
+
+    # 1. Лидерство больше не меняется: иначе take_leadership снова запустил бы polling
+    # и рассылки после их остановки. Блокировка снимается, её забирает другой воркер
+    await leader.stop()
+
+    # 2. Больше не получаем обновления: Telegram доставит их следующему процессу
+    if application.updater.running:
+        await application.updater.stop()
+    if webhook_server:
+        await webhook_server.stop()
+
+    # 3. Application.stop() дожидается очереди обновлений, запущенных обработчиков
+    # и задач JobQueue, а затем последний раз сохраняет состояние
+    try:
+        await asyncio.wait_for(asyncio.shield(application.stop()), max(deadline - loop.time(), 0))
+    except asyncio.TimeoutError:
+        logger.warning("In-flight handlers did not finish before the shutdown deadline")
+
+    # 4. Исходящие сообщения: объявления дописывают текущую пачку, фоновые рассылки
+    # и уже записанные уведомления отправляются до дедлайна
+    await broadcasts.stop(deadline - loop.time())
+    cut_off = await broadcaster.drain(deadline - loop.time())
+    if cut_off:
+        logger.warning(f"{cut_off} broadcasts cut off by the shutdown deadline")
+    await outbox.drain(application.bot, deadline - loop.time())
+
+    # 5. Прогрев пула, если он ещё идёт, тоже ограничен дедлайном
+    if pool_warm_up is not None:
+        try:
+            await asyncio.wait_for(asyncio.shield(pool_warm_up), max(deadline - loop.time(), 0))
+        except asyncio.TimeoutError:
+            logger.warning("Connection pool warm-up did not finish before the shutdown deadline")
+
+    if update_router:
+        await update_router.close()
+    if metrics_server:
+        await metrics_server.stop()
+    logger.info("Drain complete")
 
 
 if __name__ == "__main__":
@@ -1482,5 +4251,8 @@ if __name__ == "__main__":
         print("Bot stopped by user")
     finally:
         loop.close()
+        # Дожидаемся запросов, уже отправленных в пул потоков, и только потом закрываем пул
+        db_executor.shutdown(wait=True)
         if connection_pool:
+            logger.info(f"Connection pool stats: {connection_pool.stats()}")
             connection_pool.closeall()
@@ -0,0 +1,45 @@
+import asyncio
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+os.environ.setdefault("TELEGRAM_BOT_TOKEN", "123:test")
+os.environ.setdefault("ADMINISTRATOR_IDS", "1")
+
+import bot  # noqa: E402
+
+
+def test_instrumented_job_records_duration():
+    @bot.instrument_job
+    async def metrics_test_job(context):
+        return context
+
+    assert asyncio.run(metrics_test_job("context")) == "context"
+    assert 'bot_job_duration_seconds_count{name="metrics_test_job"} 1' in bot.metrics.render()
+
+
+def test_instrumented_job_counts_errors():
+    @bot.instrument_job
+    async def metrics_failing_job(context):
+        raise RuntimeError("boom")
+
+    with pytest.raises(RuntimeError):
+        asyncio.run(metrics_failing_job(None))
+    rendered = bot.metrics.render()
+    assert 'bot_job_errors_total{name="metrics_failing_job"} 1' in rendered
+    assert 'bot_job_duration_seconds_count{name="metrics_failing_job"} 1' in rendered
+
+
+def test_handler_stop_is_not_an_error():
+    async def metrics_stopping_handler(update, context):
+        raise bot.ApplicationHandlerStop
+
+    handler = bot.instrument(metrics_stopping_handler, "bot_handler_duration_seconds",
+                             "bot_handler_errors_total")
+    with pytest.raises(bot.ApplicationHandlerStop):
+        asyncio.run(handler(None, None))
+    rendered = bot.metrics.render()
+    assert 'bot_handler_errors_total{name="metrics_stopping_handler"}' not in rendered
+    assert 'bot_handler_duration_seconds_count{name="metrics_stopping_handler"} 1' in rendered
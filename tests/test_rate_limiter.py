@@ -0,0 +1,95 @@
+import asyncio
+import os
+import sys
+from types import SimpleNamespace
+
+import pytest
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+os.environ.setdefault("TELEGRAM_BOT_TOKEN", "123:test")
+os.environ.setdefault("ADMINISTRATOR_IDS", "1")
+
+import bot  # noqa: E402
+
+
+class Clock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = Clock()
+    monkeypatch.setattr(bot.time, "monotonic", clock)
+    return clock
+
+
+def callback(user_id, data):
+    return SimpleNamespace(effective_user=SimpleNamespace(id=user_id),
+                           callback_query=SimpleNamespace(data=data), message=None)
+
+
+def message(user_id, text="hello"):
+    async def reply_text(text):
+        return text
+
+    msg = SimpleNamespace(text=text, reply_text=reply_text)
+    return SimpleNamespace(effective_user=SimpleNamespace(id=user_id), callback_query=None,
+                           message=msg, effective_message=msg)
+
+
+def test_token_bucket_burst_and_refill(clock):
+    bucket = bot.TokenBucket(2, 3)
+    assert [bucket.try_acquire() for _ in range(4)] == [True, True, True, False]
+
+    clock.now += 0.5
+    assert bucket.try_acquire()
+    assert not bucket.try_acquire()
+
+    clock.now += 60
+    assert bucket.idle
+    assert [bucket.try_acquire() for _ in range(4)] == [True, True, True, False]
+
+
+def test_user_bucket_throttles_after_burst(clock):
+    limiter = bot.RateLimiter(1, 2, 100, 100, 0.5)
+    assert [limiter.verdict(message(500)) for _ in range(3)] == [None, None, "user"]
+    assert limiter.verdict(message(501)) is None
+
+    clock.now += 1
+    assert limiter.verdict(message(500)) is None
+
+
+def test_duplicate_callback_is_dropped(clock):
+    limiter = bot.RateLimiter(100, 100, 100, 100, 0.5)
+    assert limiter.verdict(callback(500, "select_12")) is None
+    assert limiter.verdict(callback(500, "select_12")) == "duplicate"
+    assert limiter.verdict(callback(500, "select_13")) is None
+
+    clock.now += 1
+    assert limiter.verdict(callback(500, "select_13")) is None
+
+
+def test_administrators_are_not_limited(clock):
+    admin_id = next(iter(bot.ADMINISTRATOR_IDS))
+    limiter = bot.RateLimiter(1, 1, 1, 1, 0.5)
+    assert all(limiter.verdict(callback(admin_id, "select_12")) is None for _ in range(5))
+    assert all(limiter.verdict(message(admin_id, "/events")) is None for _ in range(5))
+
+
+def test_warned_users_are_pruned(clock, monkeypatch):
+    monkeypatch.setattr(bot.RateLimiter, "MAX_USERS", 3)
+    limiter = bot.RateLimiter(1, 1, 100, 100, 0.5)
+
+    async def flood(user_id):
+        await limiter.check(message(user_id), None)
+        with pytest.raises(bot.ApplicationHandlerStop):
+            await limiter.check(message(user_id), None)
+
+    for user_id in range(500, 510):
+        asyncio.run(flood(user_id))
+        clock.now += 10
+    assert len(limiter._warned) <= 3